@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import TactioSim
+from PyTactio import FRAME_DTYPE
+
+SENSORS = [9, 7, 8, 18, 6, 5]
+
+'''
+Simulated chain without noise, so every frame of a sensor carries its
+baseline and decoded values can be checked exactly
+'''
+@pytest.fixture
+def chain():
+    baseline = np.arange(len(SENSORS)*16).reshape(-1, 4, 4)*37 % 4096
+    return TactioSim.SimulatedChain(SENSORS, noise=0, baseline=baseline, seed=0)
+
+'''
+Frames of a few sensors with distinct, slowly changing data and one
+millisecond between frames, as a recording would hold them
+'''
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    n = 5000
+    frames = np.zeros(n, dtype=FRAME_DTYPE)
+    frames['timestamp'] = 100.0 + 0.001*np.arange(n)
+    frames['addr'] = np.tile(SENSORS, -(-n // len(SENSORS)))[:n]
+    frames['valid'] = 0xF
+    walk = np.cumsum(rng.integers(-3, 4, (n, 4, 4)), axis=0) + 2048
+    frames['data'] = np.clip(walk, 0, 0xFFF)
+    return frames
@@ -0,0 +1,27 @@
+import asyncio
+import numpy as np
+from AsyncTactio import AsyncSerialProcessor
+from PyTactio import SerialActions
+from conftest import SENSORS
+
+def test_reads_and_sends_on_a_loop_started_later(chain):
+    processor = AsyncSerialProcessor(chain) # Made outside any running loop
+
+    async def run():
+        frames = await processor.read_batch(256, timeout=5)
+        await processor.led_on(7)
+        processor.close()
+        return frames
+
+    frames = asyncio.run(run())
+    assert len(frames)
+    assert set(frames['addr'].tolist()) <= set(SENSORS)
+    assert np.array_equal(frames['data'][0], np.rint(chain.baseline[SENSORS.index(frames['addr'][0])]))
+    assert chain.led[7]
+
+    async def again():
+        frames = await processor.read_batch(256, timeout=5) # Watches the port on the new loop
+        processor.close()
+        return frames
+
+    assert len(asyncio.run(again()))
@@ -0,0 +1,22 @@
+import numpy as np
+import Calibration
+
+def lut():
+    params = {5: np.tile([2.0, 1.0], (4, 4, 1))} # 2g + 1 on every taxel
+    return Calibration.CalibrationLUT([5, 6], params)
+
+def test_table_matches_the_polynomial():
+    data = np.arange(0, 3000, 200).reshape(-1, 1, 1).repeat(4, 1).repeat(4, 2)
+    out = lut().apply(data, np.full(len(data), 5))
+    assert np.allclose(out, 2*Calibration.conductance(data.astype(np.float64)) + 1, rtol=1e-6)
+
+def test_sensors_without_parameters_pass_through():
+    data = np.full((3, 4, 4), 1234)
+    assert np.array_equal(lut().apply(data, [6, 6, 999]), data)
+
+def test_out_of_range_input_is_clamped():
+    calibration = lut()
+    low = calibration.apply(np.full((1, 4, 4), -50.0), [5])
+    high = calibration.apply(np.full((1, 4, 4), 1e6), [5])
+    assert np.array_equal(low, calibration.apply(np.zeros((1, 4, 4)), [5]))
+    assert np.array_equal(high, calibration.apply(np.full((1, 4, 4), Calibration.RAW_LEVELS - 1), [5]))
@@ -0,0 +1,41 @@
+import time
+import pytest
+import TactioSim
+from CommandScheduler import CommandScheduler
+from PyTactio import SerialProcessor, SerialActions
+from conftest import SENSORS
+
+@pytest.fixture
+def scheduler(chain):
+    scheduler = CommandScheduler(SerialProcessor(chain), sensorInterval=0.05, linkInterval=0.01)
+    yield scheduler, chain
+    scheduler.stop()
+
+def test_commands_to_one_sensor_are_spaced(scheduler):
+    scheduler, chain = scheduler
+    futures = [scheduler.submit(action, 7) for action in [SerialActions.LEDON, SerialActions.LEDOFF]*3]
+    sent = [future.result(5) for future in futures]
+    assert all(later - earlier >= 0.05 - 1e-3 for earlier, later in zip(sent, sent[1:]))
+    assert [entry[1] for entry in chain.commandLog] == [SerialActions.LEDON, SerialActions.LEDOFF]*3
+
+def test_commands_to_several_sensors_share_a_write(scheduler):
+    scheduler, chain = scheduler
+    sent = [future.result(5) for future in scheduler.broadcast(SerialActions.LEDON, SENSORS)]
+    assert len(set(sent)) == 1
+    assert all(chain.led.values())
+
+def test_writes_to_the_link_are_spaced(scheduler):
+    scheduler, chain = scheduler
+    first = scheduler.submit(SerialActions.LEDON, 7).result(5)
+    second = scheduler.submit(SerialActions.LEDON, 9).result(5)
+    assert second - first >= 0.01 - 1e-3
+
+def test_delay_and_cancel(scheduler):
+    scheduler, chain = scheduler
+    start = time.monotonic()
+    later = scheduler.submit(SerialActions.LEDON, 7, delay=0.1)
+    cancelled = scheduler.submit(SerialActions.LEDON, 9, delay=0.1)
+    assert cancelled.cancel()
+    assert later.result(5) - start >= 0.1
+    time.sleep(0.05)
+    assert [entry[2] for entry in chain.commandLog] == [7]
@@ -0,0 +1,22 @@
+import numpy as np
+import FrameStore
+from PyTactio import FRAME_DTYPE
+
+def batch(addrs):
+    frames = np.zeros(len(addrs), dtype=FRAME_DTYPE)
+    frames['addr'] = addrs
+    frames['timestamp'] = np.arange(len(addrs))
+    frames['data'] = np.arange(len(addrs))[:, None, None]
+    return frames
+
+def test_backlog_and_coalesced():
+    store = FrameStore.LatestFrameStore([1, 2, 3])
+    store.write(batch([1, 2, 1, 1, 99]))
+    rows, frames, timestamps = store.readChanged()
+    assert rows.tolist() == [0, 1]
+    assert frames[:, 0, 0].tolist() == [3, 1] # Newest frame of each sensor
+    assert store.backlog == 4
+    assert store.coalesced.tolist() == [2, 0, 0]
+    assert store.unknown == 1
+    rows, _, _ = store.readChanged()
+    assert len(rows) == 0 and store.backlog == 0
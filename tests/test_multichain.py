@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import MultiChain
+import TactioSim
+from PyTactio import FRAME_DTYPE
+
+def portFrames(port, stamps, first=0):
+    frames = np.zeros(len(stamps), dtype=FRAME_DTYPE)
+    frames['timestamp'] = stamps
+    frames['addr'] = MultiChain.sensorKey(port, 5)
+    frames['data'] = first + np.arange(len(stamps))[:, None, None] # Frame number within the port
+    return frames
+
+def queued(chains, batches):
+    for port, frames in batches:
+        chains._queues[port].append(frames)
+        chains._pendingCount += len(frames)
+
+def test_merges_ports_in_timestamp_order():
+    chains = MultiChain.MultiChainProcessor([TactioSim.MemoryPort(b''), TactioSim.MemoryPort(b''), TactioSim.MemoryPort(b'')], slack=0)
+    rng = np.random.default_rng(0)
+    stamps = [np.sort(rng.uniform(0, 10, 1000)) for port in range(3)]
+    queued(chains, [(port, portFrames(port, stamps[port][start:start + 100], start)) for start in range(0, 1000, 100) for port in range(3)])
+    chains._progress = [5.0, 6.0, 7.0]
+    batches = [chains.read_batch(77, 0) for i in range(100)]
+    merged = np.concatenate(batches)
+    assert max(len(batch) for batch in batches) == 77
+    expected = np.sort(np.concatenate(stamps))
+    assert np.array_equal(merged['timestamp'], expected[expected <= 5.0])
+    for port in range(3): # Every port's frames come out in their own order
+        assert np.all(np.diff(merged['data'][merged['addr'] >> 8 == port][:, 0, 0].astype(int)) == 1)
+    assert chains._pendingCount == 3000 - len(merged)
+
+def test_holds_frames_back_by_slack():
+    chains = MultiChain.MultiChainProcessor([TactioSim.MemoryPort(b''), TactioSim.MemoryPort(b'')], slack=0.5)
+    queued(chains, [(0, portFrames(0, [1.0, 2.0, 3.0])), (1, portFrames(1, [1.5, 2.6]))])
+    chains._progress = [3.0, 3.1]
+    assert chains.read_batch(10, 0)['timestamp'].tolist() == [1.0, 1.5, 2.0]
+
+def test_drops_the_oldest_beyond_maxPending():
+    chains = MultiChain.MultiChainProcessor([TactioSim.MemoryPort(b''), TactioSim.MemoryPort(b'')], maxPending=4)
+    queued(chains, [(0, portFrames(0, [1.0, 3.0, 5.0])), (1, portFrames(1, [2.0, 4.0, 6.0]))])
+    chains._dropOldest()
+    assert chains.dropped == 2
+    chains._progress = [10.0, 10.0]
+    assert chains.read_batch(10, 0)['timestamp'].tolist() == [3.0, 4.0, 5.0, 6.0]
+
+def test_simulated_chains():
+    chains = MultiChain.MultiChainProcessor([TactioSim.SimulatedChain([1, 2, 3], frameRate=100), TactioSim.SimulatedChain([1, 4], frameRate=37)])
+    chains.start()
+    try:
+        batches = []
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            batches.append(chains.read_batch(64, 0.05))
+    finally:
+        chains.stop()
+    frames = np.concatenate(batches)
+    assert np.all(np.diff(frames['timestamp']) >= 0)
+    assert set(frames['addr'].tolist()) == {1, 2, 3, 256 + 1, 256 + 4}
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import Codec
+import Playback
+import Recording
+
+@pytest.fixture(params=['.tactio', Codec.EXTENSION])
+def source(request, tmp_path, frames):
+    path = str(tmp_path / ('p' + request.param))
+    if request.param == Codec.EXTENSION:
+        Codec.writeFile(path, frames, chunkFrames=700)
+    else:
+        Recording.writeRecording(path, frames)
+    playback = Playback.PlaybackSource(path, speed=None, retime=False, chunkFrames=700)
+    yield playback
+    playback.close()
+
+def readAll(playback):
+    batches = []
+    while not playback.finished:
+        batches.append(playback.read_batch(1000, 0))
+    return np.concatenate(batches)
+
+def test_plays_everything_in_order(source, frames):
+    assert source.start == frames['timestamp'][0]
+    assert source.end == frames['timestamp'][-1]
+    assert np.array_equal(readAll(source), frames)
+
+@pytest.mark.parametrize('index', [0, 1, 699, 700, 2345, 4999])
+def test_seek(source, frames, index):
+    source.seek(frames['timestamp'][index] - 1e-4) # Between two frames, lands on the later one
+    assert source.position == frames['timestamp'][index]
+    assert np.array_equal(readAll(source), frames[index:])
+
+def test_seek_back_and_past_the_end(source, frames):
+    readAll(source)
+    source.seek(source.start)
+    assert np.array_equal(source.read_batch(10, 0), frames[:10])
+    source.seek(source.end + 1)
+    assert source.finished
+    assert len(source.read_batch(10, 0)) == 0
+
+def test_step_while_paused(source, frames):
+    source.pause()
+    assert len(source.read_batch(10, 0)) == 0
+    source.step(3)
+    assert np.array_equal(source.read_batch(10, 0), frames[:3])
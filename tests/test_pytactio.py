@@ -0,0 +1,75 @@
+import numpy as np
+import TactioSim
+from PyTactio import SerialProcessor, SerialStatus, addressIndex
+from conftest import SENSORS
+
+def expected(chain, addrs):
+    return np.rint(chain.baseline[addressIndex(SENSORS)[addrs]]).astype(np.uint16)
+
+def readAll(processor, port, batch=256):
+    batches = [processor.read_batch(batch, 0)]
+    while len(batches[-1]) or not port.exhausted:
+        batches.append(processor.read_batch(batch, 0))
+    return np.concatenate(batches)
+
+def test_read_batch_decodes_simulated_frames(chain):
+    port = TactioSim.MemoryPort(chain.generate(50))
+    frames = readAll(SerialProcessor(port), port)
+    assert len(frames) == 50*len(SENSORS)
+    assert frames['addr'].tolist() == SENSORS*50
+    assert np.array_equal(frames['data'], expected(chain, frames['addr']))
+    assert np.all(np.diff(frames['timestamp']) >= 0)
+
+def test_parseSerial_matches_read_batch(chain):
+    data = chain.generate(20)
+    processor = SerialProcessor(TactioSim.MemoryPort(data))
+    parsed = []
+    while True:
+        result, status = processor.parseSerial()
+        if status == SerialStatus.PORT_EMPTY:
+            break
+        assert status == SerialStatus.DATA
+        parsed.append(result)
+    port = TactioSim.MemoryPort(data)
+    frames = readAll(SerialProcessor(port), port, batch=7)
+    assert [addr for addr, _ in parsed] == frames['addr'].tolist()
+    assert np.array_equal(np.array([values for _, values in parsed]), frames['data'])
+
+def test_address_list(chain):
+    chain.write(bytes([0x01]))
+    port = TactioSim.MemoryPort(chain.read(chain.in_waiting) + chain.generate(1))
+    processor = SerialProcessor(port)
+    frames = readAll(processor, port)
+    assert list(processor.addressLists) == [SENSORS]
+    assert len(frames) == len(SENSORS)
+
+def test_junk_between_frames_is_skipped(chain):
+    frame = len(chain.generate(1)) // len(SENSORS)
+    sweeps = chain.generate(10)
+    junk = b'\x00\x12\x34'
+    data = b''.join(junk + sweeps[i:i + frame] for i in range(0, len(sweeps), frame))
+    port = TactioSim.MemoryPort(data[5:]) # Starts inside a frame
+    processor = SerialProcessor(port)
+    frames = readAll(processor, port)
+    assert len(frames) == 10*len(SENSORS) - 1
+    assert np.array_equal(frames['data'], expected(chain, frames['addr']))
+    assert processor.discardedBytes > 0
+
+def test_random_corruption_recovers(chain):
+    chain.corruptRate = 0.2
+    port = TactioSim.MemoryPort(chain.generate(200))
+    processor = SerialProcessor(port)
+    frames = readAll(processor, port)
+    assert chain.corruptBytes > 0
+    # Junk can fake a frame header and swallow the real frame after it, but no more than that
+    good = np.all(frames['data'] == expected(chain, frames['addr']), axis=(1, 2))
+    assert good.sum() >= 0.9*200*len(SENSORS)
+
+def test_partial_frame_waits_for_the_rest(chain):
+    data = chain.generate(1)
+    port = TactioSim.MemoryPort(data[:-10])
+    processor = SerialProcessor(port)
+    assert len(processor.read_batch(256, 0)) == len(SENSORS) - 1
+    port.data = memoryview(data)
+    frames = processor.read_batch(256, 0)
+    assert frames['addr'].tolist() == SENSORS[-1:]
@@ -0,0 +1,76 @@
+import zlib
+import numpy as np
+import pytest
+import Codec
+import Recording
+from PyTactio import FRAME_DTYPE
+
+def test_recording_round_trip(tmp_path, frames):
+    path = str(tmp_path / 'r.tactio')
+    Recording.writeRecording(path, frames)
+    recording = Recording.Recording(path)
+    assert len(recording) == len(frames)
+    assert recording.sensorIDs == sorted(set(frames['addr'].tolist()))
+    assert np.array_equal(recording.timeSlice(0, len(frames)), frames)
+
+def test_recording_sensor_range(tmp_path, frames):
+    path = str(tmp_path / 'r.tactio')
+    Recording.writeRecording(path, frames)
+    recording = Recording.Recording(path)
+    mine = frames[frames['addr'] == 7]
+    t0, t1 = mine['timestamp'][10], mine['timestamp'][20]
+    assert np.array_equal(recording.sensor(7, t0, t1), mine[10:20])
+    assert len(recording.sensor(1234)) == 0
+
+def test_empty_recording(tmp_path):
+    path = str(tmp_path / 'empty.tactio')
+    Recording.writeRecording(path, np.empty(0, dtype=FRAME_DTYPE))
+    assert len(Recording.Recording(path)) == 0
+
+def test_pack12_round_trip():
+    values = np.random.default_rng(0).integers(0, 4096, (100, 16)).astype(np.uint16)
+    assert np.array_equal(Codec.unpack12(Codec.pack12(values)).reshape(-1, 16), values)
+
+@pytest.mark.parametrize('delta', [True, False])
+@pytest.mark.parametrize('compressor', ['none', 'zlib', 'lzma', 'bz2'])
+def test_chunk_round_trip(frames, compressor, delta):
+    chunk = Codec.encodeChunk(frames, compressor, delta=delta)
+    assert np.array_equal(Codec.decodeChunk(chunk), frames)
+    assert Codec.chunkStartTime(chunk) == frames['timestamp'][0]
+
+def test_delta_wraps_around():
+    addr = np.array([1, 1, 1, 2, 2], dtype=np.uint16)
+    data = np.array([0, 4095, 0, 4095, 1], dtype=np.uint16)[:, None].repeat(16, axis=1)
+    assert np.array_equal(Codec.deltaDecode(addr, Codec.deltaEncode(addr, data)), data)
+
+@pytest.mark.parametrize('delta', [True, False])
+def test_file_round_trip(tmp_path, frames, delta):
+    path = str(tmp_path / ('f' + Codec.EXTENSION))
+    Codec.writeFile(path, frames, chunkFrames=1000, delta=delta, workers=2)
+    assert np.array_equal(Codec.readFile(path), frames)
+
+def test_writer_round_trip(tmp_path, frames):
+    path = str(tmp_path / ('w' + Codec.EXTENSION))
+    with Codec.CodecWriter(path, chunkFrames=1000) as writer:
+        for start in range(0, len(frames), 333):
+            writer.append(frames[start:start + 333])
+    assert writer.count == len(frames)
+    assert np.array_equal(Codec.readFile(path), frames)
+
+def test_file_without_index(tmp_path, frames):
+    path = str(tmp_path / ('f' + Codec.EXTENSION))
+    Codec.writeFile(path, frames, chunkFrames=1000)
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    offsets = Codec.chunkOffsets(data)
+    with open(path, 'wb') as outfile:
+        outfile.write(data[:offsets[-1] + 10]) # Index lost and last chunk cut short, as by a crash
+    assert np.array_equal(Codec.readFile(path), frames[:4000])
+
+def test_writer_reports_failed_chunks(tmp_path, frames):
+    path = str(tmp_path / ('w' + Codec.EXTENSION))
+    with pytest.raises(zlib.error): # From append or close, whichever sees the failed chunk first
+        with Codec.CodecWriter(path, chunkFrames=1000, level=99) as writer: # Not a valid zlib level
+            writer.append(frames[:500])
+            writer.append(frames[500:])
+    assert writer._file.closed
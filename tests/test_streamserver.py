@@ -0,0 +1,68 @@
+import threading
+import time
+import numpy as np
+import pytest
+import StreamServer
+import TactioSim
+from PyTactio import SerialProcessor, SerialActions
+from conftest import SENSORS
+
+@pytest.fixture
+def server(tmp_path, chain):
+    chain.frameRate = 200
+    server = StreamServer.StreamServer(SerialProcessor(chain), 'unix:' + str(tmp_path / 's.sock'))
+    thread = threading.Thread(target=server.serveForever)
+    thread.start()
+    yield server, chain
+    server.stop()
+    thread.join(5)
+
+def receive(client, count, timeout=5):
+    batches = []
+    deadline = time.monotonic() + timeout
+    while sum(len(batch) for batch in batches) < count and time.monotonic() < deadline:
+        batches.append(client.read_batch(256, 0.1))
+    return np.concatenate(batches)
+
+def test_subscribe(server):
+    server, chain = server
+    address = 'unix:' + server.address
+    everything = StreamServer.StreamClient(address)
+    some = StreamServer.StreamClient(address, sensors=[7, 18])
+    try:
+        frames = receive(some, 100)
+        assert len(frames) >= 100
+        assert set(frames['addr'].tolist()) == {7, 18}
+        assert set(receive(everything, 100)['addr'].tolist()) == set(SENSORS)
+        some.subscribe(None)
+        receive(some, 200) # Drains what was queued under the old subscription
+        assert set(receive(some, 100)['addr'].tolist()) == set(SENSORS)
+    finally:
+        everything.close()
+        some.close()
+
+def test_commands_and_malformed_messages(server):
+    server, chain = server
+    client = StreamServer.StreamClient('unix:' + server.address)
+    try:
+        client.input_ser.write(StreamServer.message(StreamServer.MSG_COMMAND, b'\x01'))
+        client.input_ser.write(StreamServer.message(StreamServer.MSG_COMMAND, StreamServer.COMMAND.pack(250, 7)))
+        client.input_ser.write(StreamServer.message(77))
+        client.sendLEDon(7)
+        receive(client, 50)
+        assert chain.led[7]
+        assert server.malformed == 3
+    finally:
+        client.close()
+
+def test_oversized_message_drops_the_client(server):
+    server, chain = server
+    client = StreamServer.StreamClient('unix:' + server.address)
+    try:
+        client.input_ser.write(StreamServer.HEADER.pack(StreamServer.MSG_SUBSCRIBE, 1 << 30))
+        with pytest.raises(ConnectionError):
+            receive(client, 1 << 30)
+        assert server.malformed == 1
+        assert not server.clients
+    finally:
+        client.close()
@@ -0,0 +1,224 @@
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from PyTactio import SerialProcessor, FRAME_DTYPE
+
+HEADER_WORDS = 8 # uint64 words at the start of the ring: [0] frames written, [1] capacity, [2] discarded bytes, [3] malformed messages
+INVALID = np.uint64(0xFFFFFFFFFFFFFFFF) # Slot sequence value while a slot is being rewritten
+POLL_INTERVAL = 0.002 # Seconds a reader sleeps between checks of the write counter
+
+'''
+Ring buffer of decoded frames (PyTactio.FRAME_DTYPE) in shared memory, with
+a single writer and any number of readers in other processes.
+
+The writer never waits for readers. Every slot carries the number of the
+frame it holds; the writer invalidates a slot's number before overwriting
+it and publishes the new number, then the global write counter, afterwards.
+Readers check a slot's number before and after copying it, so a frame that
+was overwritten mid-copy is detected and counted instead of returned torn.
+Readers only ever read the shared block
+'''
+class SharedFrameRing:
+    def __init__(self, name=None, capacity=1 << 16):
+        if name is None:
+            size = HEADER_WORDS*8 + capacity*(8 + FRAME_DTYPE.itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = _attach(name)
+            self.owner = False
+        self.header = np.ndarray(HEADER_WORDS, dtype=np.uint64, buffer=self.shm.buf)
+        if self.owner:
+            self.header[:] = 0
+            self.header[1] = capacity
+        self.capacity = int(self.header[1])
+        self.slotSeq = np.ndarray(self.capacity, dtype=np.uint64, buffer=self.shm.buf, offset=HEADER_WORDS*8)
+        self.slots = np.ndarray(self.capacity, dtype=FRAME_DTYPE, buffer=self.shm.buf,
+                                offset=HEADER_WORDS*8 + self.capacity*8)
+        if self.owner:
+            self.slotSeq[:] = INVALID
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def written(self):
+        return int(self.header[0])
+
+    '''
+    Appends a batch of frames. Only one process may write
+    '''
+    def write(self, frames):
+        total = len(frames)
+        frames = frames[-self.capacity:] # Older ones would be overwritten straight away
+        start = self.written + total - len(frames)
+        numbers = np.arange(start, start + len(frames), dtype=np.uint64)
+        slots = numbers % np.uint64(self.capacity)
+        self.slotSeq[slots] = INVALID
+        self.slots[slots] = frames
+        self.slotSeq[slots] = numbers
+        self.header[0] = start + len(frames)
+
+    '''
+    Copies frames cursor to cursor + maxFrames (if written yet). Returns the
+    frames, the cursor to continue from and the number of frames that were
+    overwritten before they could be read
+    '''
+    def read(self, cursor, maxFrames):
+        written = self.written
+        lost = 0
+        if written - cursor > self.capacity:
+            lost = written - self.capacity - cursor
+            cursor = written - self.capacity
+        stop = min(written, cursor + maxFrames)
+        numbers = np.arange(cursor, stop, dtype=np.uint64)
+        slots = numbers % np.uint64(self.capacity)
+        before = self.slotSeq[slots]
+        frames = self.slots[slots]
+        after = self.slotSeq[slots]
+        intact = (before == numbers) & (after == numbers)
+        if not intact.all():
+            lost += int(len(intact) - intact.sum())
+            frames = frames[intact]
+        return frames, stop, lost
+
+    def close(self):
+        # Views into the block have to go before it can be closed
+        del self.header, self.slotSeq, self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+'''
+Attaches to an existing block. Processes started through multiprocessing
+share the creator's resource tracker, which only unlinks the block when the
+owner does; where supported, tracking is skipped altogether
+'''
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+'''
+Entry point of the acquisition process: decodes frames from the serial port
+into the ring, forwards address lists and writes queued command bytes
+'''
+def _acquire(portName, baudrate, ringName, commands, addressLists, stop):
+    import serial # Only the acquisition process opens the port
+    ring = SharedFrameRing(ringName)
+    try:
+        with serial.Serial(portName, baudrate) as ser:
+            processor = SerialProcessor(ser)
+            while not stop.is_set():
+                frames = processor.read_batch(1024, POLL_INTERVAL*10)
+                if len(frames):
+                    ring.write(frames)
+                ring.header[2] = processor.discardedBytes
+                ring.header[3] = processor.malformedMessages
+                while processor.addressLists:
+                    addressLists.put(processor.addressLists.popleft())
+                try:
+                    while True:
+                        ser.write(commands.get_nowait())
+                except queue.Empty:
+                    pass
+    finally:
+        ring.close()
+
+'''
+Runs SerialProcessor in its own process, so decoding never competes with
+the GUI for the GIL and a stalled GUI cannot hold up reading the port.
+Decoded frames are published through a SharedFrameRing; call reader() for
+a consumer and commandPort() for something SerialProcessor can send
+commands through
+'''
+class AcquisitionProcess:
+    def __init__(self, portName, baudrate=230400, capacity=1 << 16):
+        self.ring = SharedFrameRing(capacity=capacity)
+        self.commands = mp.Queue()
+        self.addressLists = mp.Queue()
+        self._stop = mp.Event()
+        self.process = mp.Process(target=_acquire, daemon=True,
+                                  args=(portName, baudrate, self.ring.name, self.commands, self.addressLists, self._stop))
+
+    def start(self):
+        self.process.start()
+
+    def stop(self):
+        self._stop.set()
+        self.process.join()
+        self.ring.close()
+
+    def reader(self):
+        return RingReader(self.ring.name, self.addressLists)
+
+    def commandPort(self):
+        return CommandPort(self.commands)
+
+'''
+Consumer side of a SharedFrameRing, with the read_batch/addressLists
+interface of SerialProcessor so ParseThread.Parser can run on it.
+Starts at the oldest frame still in the ring; lost counts the frames that
+were overwritten before this reader got to them
+'''
+class RingReader:
+    def __init__(self, ringName, addressLists=None):
+        self.ring = SharedFrameRing(ringName)
+        self.cursor = max(0, self.ring.written - self.ring.capacity)
+        self.lost = 0
+        self.addressLists = deque()
+        self._addressQueue = addressLists
+
+    def read_batch(self, max_frames=256, timeout=0.1):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._pollAddresses()
+            if self.ring.written > self.cursor:
+                frames, self.cursor, lost = self.ring.read(self.cursor, max_frames)
+                self.lost += lost
+                if len(frames):
+                    return frames
+            if deadline is not None and time.monotonic() >= deadline:
+                return np.empty(0, dtype=FRAME_DTYPE)
+            time.sleep(POLL_INTERVAL)
+
+    # Link counters of the acquisition process
+    @property
+    def discardedBytes(self):
+        return int(self.ring.header[2])
+
+    @property
+    def malformedMessages(self):
+        return int(self.ring.header[3])
+
+    def _pollAddresses(self):
+        if self._addressQueue is None:
+            return
+        try:
+            while True:
+                self.addressLists.append(self._addressQueue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def close(self):
+        self.ring.close()
+
+'''
+Write-only stand-in for the serial port that forwards command bytes to the
+acquisition process
+'''
+class CommandPort:
+    def __init__(self, commands):
+        self.commands = commands
+
+    def write(self, data):
+        self.commands.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from PyTactio import SerialProcessor, SerialActions, GET_ADDRESSES
+
+'''
+asyncio client for a Tactio chain.
+
+AsyncSerialProcessor decodes with the same buffered decoder as
+SerialProcessor, but never blocks: the port's file descriptor is watched by
+the event loop (loop.add_reader), and ports without one (e.g.
+TactioSim.SimulatedChain) are polled every pollInterval seconds. Any number
+of chains can share one loop:
+
+    async for frames in AsyncSerialProcessor(port):
+        ...
+
+yields batches of PyTactio.FRAME_DTYPE frames. Commands are coroutines
+(led_on, heartbeat_off, bias_cal_enable, ...) that complete once the bytes
+are handed to the port
+'''
+class AsyncSerialProcessor(SerialProcessor):
+    def __init__(self, port, pollInterval=0.005):
+        super(AsyncSerialProcessor, self).__init__(port)
+        self.pollInterval = pollInterval
+        try:
+            self._fd = port.fileno()
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+        self._loop = None
+        self._pollTask = None
+        self._dataEvent = None # Made on the running loop, as before Python 3.10 an Event binds to the loop current at creation
+
+    def _startReading(self):
+        self._loop = asyncio.get_running_loop()
+        self._dataEvent = asyncio.Event()
+        if self._fd is not None:
+            self._loop.add_reader(self._fd, self._readAvailable)
+        else:
+            self._pollTask = self._loop.create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            self._readAvailable()
+            await asyncio.sleep(self.pollInterval)
+
+    # Moves whatever the port holds into the buffer without blocking
+    def _readAvailable(self):
+        waiting = self.input_ser.in_waiting
+        if waiting:
+            self._received(self.input_ser.read(waiting))
+            self._dataEvent.set()
+
+    '''
+    Returns up to max_frames decoded frames, waiting up to timeout seconds
+    (None waits forever) for at least one. Returns an empty array on timeout
+    '''
+    async def read_batch(self, max_frames=256, timeout=None):
+        if self._loop is None:
+            self._startReading()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frames = self._decodeBuffered(max_frames)
+            if len(frames):
+                return frames
+            self._dataEvent.clear()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return frames
+            try:
+                await asyncio.wait_for(self._dataEvent.wait(), remaining)
+            except asyncio.TimeoutError:
+                return self._decodeBuffered(max_frames)
+
+    '''
+    Async generator of non-empty frame batches for as long as the port is open
+    '''
+    async def iter_frames(self, max_frames=256):
+        while self.input_ser.isOpen():
+            yield await self.read_batch(max_frames)
+
+    def __aiter__(self):
+        return self.iter_frames()
+
+    '''
+    Stops watching the port. The port itself is left open
+    '''
+    def close(self):
+        if self._loop is not None and self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        if self._pollTask is not None:
+            self._pollTask.cancel()
+        self._loop = None
+
+    # Writes without blocking the loop, waiting for the descriptor to become writable if needed
+    async def _write(self, data):
+        if self._fd is None:
+            self.input_ser.write(data)
+            return
+        loop = asyncio.get_running_loop()
+        data = memoryview(data)
+        while len(data):
+            try:
+                data = data[os.write(self._fd, data):]
+            except BlockingIOError:
+                pass
+            if len(data):
+                writable = loop.create_future()
+                loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(self._fd)
+
+    async def send(self, action, id):
+        await self._write(self.encodeCommand(action, id))
+
+    async def get_addresses(self):
+        await self._write(GET_ADDRESSES)
+
+    async def led_on(self, id):
+        await self.send(SerialActions.LEDON, id)
+
+    async def led_off(self, id):
+        await self.send(SerialActions.LEDOFF, id)
+
+    async def bias_cal(self, id):
+        await self.send(SerialActions.CAL_BIAS, id)
+
+    async def bias_cal_enable(self, id):
+        await self.send(SerialActions.BIAS_EN, id)
+
+    async def bias_cal_disable(self, id):
+        await self.send(SerialActions.BIAS_DIS, id)
+
+    async def heartbeat_on(self, id):
+        await self.send(SerialActions.HEART_ON, id)
+
+    async def heartbeat_off(self, id):
+        await self.send(SerialActions.HEART_OFF, id)
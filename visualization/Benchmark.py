@@ -0,0 +1,312 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import Calibration
+import Codec
+import Recorder
+import TactioSim
+from PyTactio import SerialProcessor, SerialStatus, addressIndex
+
+'''
+Benchmarks of the hot paths, on synthetic chains.
+
+Every benchmark runs on a Workload: the bytes of a simulated chain with the
+sensors of a config (by default each of configs/1sensor.xml to
+16sensor.xml), read back from a TactioSim.MemoryPort so nothing is paced.
+A benchmark prepares its inputs, then returns a function that does the
+timed work and returns (frames, seconds) samples, so setup costs count in
+neither the timing nor the memory figures.
+
+Each result reports the frames per second over all samples, percentiles
+of the per-frame latency (the seconds of a sample divided by its frames)
+and the peak memory allocated while running, traced with tracemalloc in a
+second, untimed run. Results are saved as JSON together with the
+environment they were measured in, and compare() lines two runs up to
+show regressions between versions
+'''
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIGS = [os.path.join(_HERE, 'configs', name) for name in ['1sensor.xml', '2sensor.xml', '5sensor.xml', '6sensor.xml', '16sensor.xml']]
+RESULTS_VERSION = 1 # Changed whenever results stop being comparable with older files
+CALIBRATION = os.path.join(_HERE, 'regression_params.json')
+
+'''
+Synthetic chain data for the sensors of a config
+'''
+class Workload:
+    def __init__(self, config, frames, corrupt=0.0, seed=0):
+        self.name = os.path.splitext(os.path.basename(config))[0]
+        self.sensorIDs = TactioSim.loadSensorIDs(config)
+        chain = TactioSim.SimulatedChain(self.sensorIDs, corruptRate=corrupt, seed=seed)
+        self.data = chain.generate(-(-frames // len(self.sensorIDs)))
+        self._frames = None
+
+    '''
+    The decoded frames (PyTactio.FRAME_DTYPE) of the workload
+    '''
+    @property
+    def frames(self):
+        if self._frames is None:
+            port = TactioSim.MemoryPort(self.data)
+            processor = SerialProcessor(port)
+            batches = [processor.read_batch(1 << 16, 0)]
+            while len(batches[-1]) or not port.exhausted:
+                batches.append(processor.read_batch(1 << 16, 0))
+            self._frames = np.concatenate(batches)
+        return self._frames
+
+    # Consecutive slices of the frames of at most size frames
+    def batches(self, size):
+        frames = self.frames
+        return [frames[start:start + size] for start in range(0, len(frames), size)]
+
+
+# Decoding one frame per call, as the GUI's parse thread did before read_batch
+def benchParseSerial(workload, batch):
+    processor = SerialProcessor(TactioSim.MemoryPort(workload.data))
+    def run():
+        samples = []
+        clock = time.perf_counter
+        start = clock()
+        while True:
+            result, status = processor.parseSerial()
+            if status == SerialStatus.DATA:
+                now = clock()
+                samples.append((1, now - start)) # Includes calls that skipped junk before the frame
+                start = now
+            elif status == SerialStatus.PORT_EMPTY:
+                return samples
+    return run
+
+def benchReadBatch(workload, batch):
+    port = TactioSim.MemoryPort(workload.data)
+    processor = SerialProcessor(port)
+    def run():
+        samples = []
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            frames = processor.read_batch(batch, 0)
+            samples.append((len(frames), clock() - start))
+            if not len(frames) and port.exhausted: # Frames already read from the port may still be queued
+                return samples
+    return run
+
+'''
+Calibration of raw frames as MultiSensorVis.calModel does it, through a
+Calibration.CalibrationLUT. Sensors take the parameters of
+regression_params.json in turn, so every sensor has a full table
+'''
+def benchCalModel(workload, batch):
+    params = Calibration.loadRegressionParams(CALIBRATION)
+    known = [params[id] for id in sorted(params)]
+    lut = Calibration.CalibrationLUT(workload.sensorIDs, {id: known[i % len(known)] for i, id in enumerate(workload.sensorIDs)})
+    batches = workload.batches(batch)
+    def run():
+        samples = []
+        clock = time.perf_counter
+        for frames in batches:
+            start = clock()
+            lut.apply(frames['data'].astype(np.float64), frames['addr'])
+            samples.append((len(frames), clock() - start))
+        return samples
+    return run
+
+_app = None # QApplication of the setData benchmark, kept for the life of the process
+
+'''
+Colouring and painting the grids of the GUI on Qt's offscreen platform.
+Like the GUI's display timer, every sample updates one frame of every
+sensor and then lets Qt repaint
+'''
+def benchSetData(workload, batch):
+    global _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    import SingleGrid
+    if(_app is None):
+        _app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = QtWidgets.QWidget()
+    layout = QtWidgets.QGridLayout(window)
+    grids = []
+    for i in range(len(workload.sensorIDs)):
+        grid = SingleGrid.SensorGrid()
+        grid.setId(workload.sensorIDs[i])
+        layout.addWidget(grid, i // 4, i % 4)
+        grids.append(grid)
+    window.show()
+    _app.processEvents()
+    rows = addressIndex(workload.sensorIDs)
+    sweeps = workload.batches(len(workload.sensorIDs))
+    def run():
+        samples = []
+        clock = time.perf_counter
+        for frames in sweeps:
+            start = clock()
+            for row, data in zip(rows[frames['addr']], frames['data'].astype(np.float64)):
+                grids[row].setData(data)
+            _app.processEvents()
+            samples.append((len(frames), clock() - start))
+        window.close()
+        return samples
+    return run
+
+def benchRecordAppend(workload, batch):
+    recorder = Recorder.Recorder()
+    recorder.start()
+    batches = workload.batches(batch)
+    def run():
+        samples = []
+        clock = time.perf_counter
+        for frames in batches:
+            start = clock()
+            recorder.append(frames)
+            samples.append((len(frames), clock() - start))
+        recorder.stop()
+        return samples
+    return run
+
+# Saving everything recorded from the workload to a file named name
+def _recordSave(workload, batch, name):
+    recorder = Recorder.Recorder()
+    recorder.start()
+    for frames in workload.batches(batch):
+        recorder.append(frames)
+    recorder.stop()
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            recorder.save(os.path.join(directory, name))
+            return [(len(recorder), time.perf_counter() - start)]
+    return run
+
+def benchRecordSave(workload, batch):
+    return _recordSave(workload, batch, 'bench.tactio')
+
+def benchRecordSaveCompressed(workload, batch):
+    return _recordSave(workload, batch, 'bench' + Codec.EXTENSION)
+
+BENCHMARKS = {
+    'parseSerial': benchParseSerial,
+    'read_batch': benchReadBatch,
+    'calModel': benchCalModel,
+    'setData': benchSetData,
+    'recordAppend': benchRecordAppend,
+    'recordSave': benchRecordSave,
+    'recordSaveCompressed': benchRecordSaveCompressed,
+}
+
+'''
+Runs one benchmark on a workload and returns its result
+'''
+def measure(benchmark, workload, batch):
+    samples = np.array(benchmark(workload, batch)(), dtype=np.float64).reshape(-1, 2)
+    run = benchmark(workload, batch)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    samples = samples[samples[:, 0] > 0]
+    frames = int(samples[:, 0].sum())
+    seconds = float(samples[:, 1].sum())
+    latency = samples[:, 1]/samples[:, 0]
+    p50, p90, p99 = np.percentile(latency, [50, 90, 99]) if len(latency) else (0.0, 0.0, 0.0)
+    return {'frames': frames,
+            'seconds': seconds,
+            'framesPerSecond': frames/seconds if seconds > 0 else 0.0,
+            'latency': {'p50': p50, 'p90': p90, 'p99': p99, 'max': float(latency.max(initial=0))},
+            'peakMemory': peak}
+
+'''
+Where and with what the benchmarks ran, saved with the results
+'''
+def environment():
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=_HERE,
+                                  capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {'revision': revision,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.machine()}
+
+'''
+Runs the named benchmarks (all by default) on a workload of every config
+and returns the results, keyed "<benchmark>/<config name>". Benchmarks
+that cannot run here (e.g. setData without PyQt5) are recorded as skipped.
+progress is called with every key and result as they complete
+'''
+def run(configs=CONFIGS, names=None, frames=20000, batch=1024, corrupt=0.0, progress=None):
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    for config in configs:
+        workload = Workload(config, frames, corrupt)
+        for name in names:
+            key = '{}/{}'.format(name, workload.name)
+            try:
+                results[key] = measure(BENCHMARKS[name], workload, batch)
+            except ImportError as e:
+                results[key] = {'skipped': str(e)}
+            if(progress is not None):
+                progress(key, results[key])
+    return {'version': RESULTS_VERSION,
+            'environment': environment(),
+            'parameters': {'frames': frames, 'batch': batch, 'corrupt': corrupt},
+            'results': results}
+
+def save(report, path):
+    with open(path, 'w') as outfile:
+        json.dump(report, outfile, indent=2, default=float)
+
+def load(path):
+    with open(path, 'r') as infile:
+        report = json.load(infile)
+    if report.get('version') != RESULTS_VERSION:
+        raise ValueError("{} holds results of version {}, expected {}".format(path, report.get('version'), RESULTS_VERSION))
+    return report
+
+'''
+One line of text for a result
+'''
+def formatResult(key, result):
+    if 'skipped' in result:
+        return '{:30s} skipped ({})'.format(key, result['skipped'])
+    latency = result['latency']
+    return '{:30s} {:11.0f} frames/s  p50 {:8.2f} us  p99 {:8.2f} us  peak {:8.1f} kB'.format(
+        key, result['framesPerSecond'], 1e6*latency['p50'], 1e6*latency['p99'], result['peakMemory']/1024)
+
+'''
+Compares two reports (as from run or load). Returns a line of text for
+every result found in both, and the keys of the results that regressed:
+throughput down, or p99 latency or peak memory up, by more than tolerance
+(a fraction)
+'''
+def compare(previous, current, tolerance=0.1):
+    lines = []
+    regressions = []
+    if previous['parameters'] != current['parameters']:
+        lines.append('Warning: parameters differ ({} before, {} now)'.format(previous['parameters'], current['parameters']))
+    for key, result in current['results'].items():
+        before = previous['results'].get(key)
+        if before is None or 'skipped' in before or 'skipped' in result:
+            continue
+        throughput = result['framesPerSecond']/before['framesPerSecond'] - 1 if before['framesPerSecond'] else 0.0
+        latency = result['latency']['p99']/before['latency']['p99'] - 1 if before['latency']['p99'] else 0.0
+        memory = result['peakMemory']/before['peakMemory'] - 1 if before['peakMemory'] else 0.0
+        regressed = throughput < -tolerance or latency > tolerance or memory > tolerance
+        if(regressed):
+            regressions.append(key)
+        lines.append('{:30s} frames/s {:+7.1%}  p99 {:+7.1%}  peak {:+7.1%}{}'.format(
+            key, throughput, latency, memory, '  REGRESSION' if regressed else ''))
+    return lines, regressions
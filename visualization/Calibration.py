@@ -0,0 +1,77 @@
+import json
+import numpy as np
+from PyTactio import addressIndex
+
+INPUT_VOLTAGE = 3300 # Supply of the taxel voltage divider, in ADC counts
+R2 = 390 # Fixed resistor of the voltage divider
+RAW_LEVELS = 1 << 12 # Taxel values are 12 bits
+
+'''
+Converts raw taxel values into the conductance of the taxel's force
+sensitive resistor, which the regression parameters are fitted against
+'''
+def conductance(voltage):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return voltage/(R2*INPUT_VOLTAGE - R2*voltage)
+
+'''
+Reads regression parameters (as in regression_params.json) into a dict
+mapping each sensor address to a (4, 4, order + 1) array of polynomial
+coefficients, highest power first. The file stores one [slope, offset]
+pair, or a longer coefficient list, per "node<address>_<row>_<column>" key
+'''
+def loadRegressionParams(path):
+    with open(path, 'r') as regFile:
+        model_data = json.load(regFile)
+    order = max(len(coeffs) for coeffs in model_data.values()) - 1
+    params = {}
+    for key in model_data:
+        splitName = key.split('_')
+        node = int(splitName[0][4:])
+        idx1 = int(splitName[1])
+        idx2 = int(splitName[2])
+        if node not in params:
+            params[node] = np.zeros((4, 4, order + 1))
+        coeffs = model_data[key]
+        params[node][idx1, idx2, order + 1 - len(coeffs):] = coeffs # Shorter lists are lower order
+    return params
+
+'''
+Per-taxel lookup table calibration.
+
+The polynomial in conductance fitted for each taxel is evaluated once for
+every possible 12-bit input, giving an (n_sensors + 1, 16, 4096) float32
+table. Negative outputs are clamped to zero, like the old per-frame model
+did, and inputs where the divider formula breaks down map to zero. The
+extra last row passes raw values through unchanged and is used for sensors
+without parameters. Calibrating any number of frames is then one gather
+'''
+class CalibrationLUT:
+    def __init__(self, sensorIDs, params):
+        self.sensorIDs = list(sensorIDs)
+        n = len(self.sensorIDs)
+        self.rows = addressIndex(self.sensorIDs, missing=n)
+        raw = np.arange(RAW_LEVELS, dtype=np.float64)
+        g = conductance(raw)
+        self.table = np.empty((n + 1, 16, RAW_LEVELS), dtype=np.float32)
+        self.table[:] = raw
+        for row, id in enumerate(self.sensorIDs):
+            if id not in params:
+                continue
+            coeffs = params[id].reshape(16, -1)
+            out = np.zeros((16, RAW_LEVELS))
+            with np.errstate(invalid='ignore', over='ignore'):
+                for k in range(coeffs.shape[1]): # Horner's scheme over all taxels at once
+                    out = out*g + coeffs[:, k:k + 1]
+            out[~np.isfinite(out) | (out < 0)] = 0
+            self.table[row] = out
+        self._taxels = np.arange(16).reshape(4, 4)
+
+    '''
+    Calibrates raw data of shape (..., 4, 4). addrs holds the address of each
+    frame and must broadcast against the leading dimensions of data
+    '''
+    def apply(self, data, addrs):
+        rows = self.rows[np.asarray(addrs)]
+        raw = np.clip(np.asarray(data).astype(np.intp), 0, RAW_LEVELS - 1) # Filtered data can leave the 12-bit range either way
+        return self.table[np.expand_dims(rows, (-2, -1)), self._taxels, raw]
@@ -0,0 +1,320 @@
+import bz2
+import lzma
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from PyTactio import FRAME_DTYPE
+
+'''
+Compressed archive format for recordings (.tactioz).
+
+Taxel values are 12 bits, so two of them are packed into three bytes and a
+frame's 16 taxels take 24 bytes. Optionally each taxel is stored as the
+difference (mod 4096) from the previous frame of the same sensor, which
+turns slowly changing data into small numbers that compress well.
+
+Frames are grouped into chunks, and every chunk is compressed on its own
+with a standard library compressor and carries everything needed to decode
+it, so chunks can be written as a recording runs and decoded in parallel.
+
+Layout (little endian):
+    header      FILE_HEADER: MAGIC, VERSION
+    chunks      CHUNK_HEADER (CHUNK_MAGIC, compressor, flags, frames,
+                payload length) and the compressed payload
+    index       uint64 offset of every chunk, then FOOTER (index offset,
+                number of chunks, INDEX_MAGIC). Written on close; files
+                without one (e.g. from a crashed capture) are read by
+                walking the chunk headers
+
+A chunk's payload holds its columns one after the other: timestamps (the
+float64 bit patterns, each stored as the difference from the previous
+one, which is exact), addr, valid and the packed taxels
+'''
+EXTENSION = '.tactioz'
+MAGIC = b'TACTIOZ\x00'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sH')
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sBBII')
+INDEX_MAGIC = b'TIDX'
+FOOTER = struct.Struct('<QI4s')
+DELTA = 1 # Chunk flag: taxels are differences from the sensor's previous frame
+
+COMPRESSORS = {'none': 0, 'zlib': 1, 'lzma': 2, 'bz2': 3}
+
+def compress(data, compressor, level=None):
+    if compressor == 'none':
+        return data
+    if compressor == 'zlib':
+        return zlib.compress(data, 6 if level is None else level)
+    if compressor == 'lzma':
+        return lzma.compress(data, preset=6 if level is None else level)
+    if compressor == 'bz2':
+        return bz2.compress(data, 9 if level is None else level)
+    raise ValueError("Unknown compressor {}".format(compressor))
+
+def decompress(data, compressorID):
+    if compressorID == COMPRESSORS['none']:
+        return data
+    if compressorID == COMPRESSORS['zlib']:
+        return zlib.decompress(data)
+    if compressorID == COMPRESSORS['lzma']:
+        return lzma.decompress(data)
+    if compressorID == COMPRESSORS['bz2']:
+        return bz2.decompress(data)
+    raise ValueError("Unknown compressor id {}".format(compressorID))
+
+'''
+Packs 12-bit values (an even number of them) two to three bytes
+'''
+def pack12(values):
+    pairs = np.asarray(values, dtype=np.uint16).reshape(-1, 2) & 0xFFF
+    packed = np.empty((len(pairs), 3), dtype=np.uint8)
+    packed[:, 0] = pairs[:, 0] & 0xFF
+    packed[:, 1] = (pairs[:, 0] >> 8) | ((pairs[:, 1] & 0xF) << 4)
+    packed[:, 2] = pairs[:, 1] >> 4
+    return packed.ravel()
+
+'''
+Inverse of pack12, returning the values as uint16
+'''
+def unpack12(packed):
+    triples = np.asarray(packed, dtype=np.uint8).reshape(-1, 3).astype(np.uint16)
+    values = np.empty((len(triples), 2), dtype=np.uint16)
+    values[:, 0] = triples[:, 0] | ((triples[:, 1] & 0xF) << 8)
+    values[:, 1] = (triples[:, 1] >> 4) | (triples[:, 2] << 4)
+    return values.ravel()
+
+# Positions of the frames grouped by sensor (in order within each sensor) and where each group starts
+def _groups(addr):
+    order = np.argsort(addr, kind='stable')
+    sortedAddr = addr[order]
+    first = np.r_[True, sortedAddr[1:] != sortedAddr[:-1]]
+    return order, first
+
+'''
+Replaces every frame's (m, 16) taxels by the difference from the previous
+frame of the same sensor, mod 4096. First frames of each sensor stay as
+they are. Differences are zigzag coded (0, -1, 1, -2, ... become 0, 1, 2,
+3, ...) so small changes of either sign leave the high bits clear
+'''
+def deltaEncode(addr, data):
+    order, first = _groups(addr)
+    grouped = data[order].astype(np.int32)
+    deltas = grouped.copy()
+    deltas[1:] -= grouped[:-1]
+    deltas = (deltas << 20) >> 20 # Sign extend from 12 bits
+    deltas = (deltas << 1) ^ (deltas >> 11)
+    deltas[first] = grouped[first]
+    encoded = np.empty_like(data)
+    encoded[order] = deltas & 0xFFF
+    return encoded
+
+'''
+Inverse of deltaEncode
+'''
+def deltaDecode(addr, deltas):
+    order, first = _groups(addr)
+    grouped = deltas[order].astype(np.int64)
+    grouped = np.where(first[:, np.newaxis], grouped, (grouped >> 1) ^ -(grouped & 1))
+    total = np.cumsum(grouped, axis=0)
+    # Running sums restart at every sensor, so take away what was summed before its first frame
+    starts = np.flatnonzero(first)
+    before = total[starts] - grouped[starts]
+    total -= np.repeat(before, np.diff(np.r_[starts, len(addr)]), axis=0)
+    decoded = np.empty(deltas.shape, dtype=np.uint16)
+    decoded[order] = total & 0xFFF
+    return decoded
+
+'''
+Encodes frames into one self-contained chunk, header included
+'''
+def encodeChunk(frames, compressor='zlib', level=None, delta=True):
+    frames = np.asarray(frames)
+    stamps = frames['timestamp'].astype('<f8').view('<i8')
+    stamps = np.r_[stamps[:1], np.diff(stamps)] # int64 differences wrap around, so decoding is exact
+    data = frames['data'].reshape(-1, 16)
+    if delta:
+        data = deltaEncode(frames['addr'], data)
+    payload = b''.join([stamps.astype('<i8').tobytes(), frames['addr'].astype('<u2').tobytes(),
+                        frames['valid'].astype('u1').tobytes(), pack12(data).tobytes()])
+    payload = compress(payload, compressor, level)
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, COMPRESSORS[compressor], DELTA if delta else 0, len(frames), len(payload))
+    return header + payload
+
+'''
+Decodes a chunk made by encodeChunk back into PyTactio.FRAME_DTYPE frames
+'''
+def decodeChunk(chunk):
+    magic, compressorID, flags, count, length = CHUNK_HEADER.unpack_from(chunk)
+    if magic != CHUNK_MAGIC:
+        raise ValueError("Not a Tactio codec chunk")
+    payload = decompress(bytes(chunk[CHUNK_HEADER.size:CHUNK_HEADER.size + length]), compressorID)
+    frames = np.empty(count, dtype=FRAME_DTYPE)
+    pos = 0
+    stamps = np.frombuffer(payload, dtype='<i8', count=count, offset=pos)
+    frames['timestamp'] = np.cumsum(stamps).view('<f8')
+    pos += 8*count
+    frames['addr'] = np.frombuffer(payload, dtype='<u2', count=count, offset=pos)
+    pos += 2*count
+    frames['valid'] = np.frombuffer(payload, dtype='u1', count=count, offset=pos)
+    pos += count
+    data = unpack12(np.frombuffer(payload, dtype=np.uint8, count=24*count, offset=pos)).reshape(-1, 16)
+    if flags & DELTA:
+        data = deltaDecode(frames['addr'], data)
+    frames['data'] = data.reshape(-1, 4, 4)
+    return frames
+
+'''
+Returns the timestamp of the first frame of a chunk, decompressing only
+the first eight bytes of its payload
+'''
+def chunkStartTime(chunk):
+    magic, compressorID, flags, count, length = CHUNK_HEADER.unpack_from(chunk)
+    payload = bytes(chunk[CHUNK_HEADER.size:CHUNK_HEADER.size + length])
+    if compressorID == COMPRESSORS['none']:
+        head = payload[:8]
+    elif compressorID == COMPRESSORS['zlib']:
+        head = zlib.decompressobj().decompress(payload, 8)
+    elif compressorID == COMPRESSORS['lzma']:
+        head = lzma.LZMADecompressor().decompress(payload, 8)
+    else:
+        head = bz2.BZ2Decompressor().decompress(payload, 8)
+    return float(np.frombuffer(head[:8], dtype='<f8')[0]) # The first difference is the timestamp itself
+
+def _pool(workers, processes):
+    return ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+
+
+'''
+Writes a .tactioz file as frames arrive, e.g. from a Parser consumer.
+Every chunkFrames frames are compressed and written on a background thread,
+so append() only copies. close() writes the rest and the chunk index.
+A chunk that failed to be written raises its exception from the next
+append() or from close(), which then leaves the file without an index
+'''
+class CodecWriter:
+    def __init__(self, path, chunkFrames=1 << 14, compressor='zlib', level=None, delta=True):
+        self.chunkFrames = chunkFrames
+        self.compressor = compressor
+        self.level = level
+        self.delta = delta
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._offsets = []
+        self._pending = []
+        self._pendingFrames = 0
+        self._writes = [] # Futures of the chunks not known to be written yet
+        self._encoder = ThreadPoolExecutor(1) # One worker, so chunks are written in order
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, frames):
+        if not len(frames):
+            return
+        self._pending.append(np.array(frames, dtype=FRAME_DTYPE))
+        self._pendingFrames += len(frames)
+        self.count += len(frames)
+        if self._pendingFrames >= self.chunkFrames:
+            frames = np.concatenate(self._pending)
+            full = len(frames) - len(frames) % self.chunkFrames
+            for start in range(0, full, self.chunkFrames):
+                self._writes.append(self._encoder.submit(self._writeChunk, frames[start:start + self.chunkFrames]))
+            self._pending = [frames[full:]]
+            self._pendingFrames = len(frames) - full
+            self._checkWrites()
+
+    # Raises the exception of any finished chunk write that failed
+    def _checkWrites(self):
+        while self._writes and self._writes[0].done():
+            self._writes.pop(0).result()
+
+    def _writeChunk(self, frames):
+        chunk = encodeChunk(frames, self.compressor, self.level, self.delta)
+        self._offsets.append(self._file.tell())
+        self._file.write(chunk)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._pendingFrames:
+            self._writes.append(self._encoder.submit(self._writeChunk, np.concatenate(self._pending)))
+        self._encoder.shutdown(wait=True)
+        try:
+            for future in self._writes:
+                future.result()
+            indexOffset = self._file.tell()
+            self._file.write(np.asarray(self._offsets, dtype='<u8').tobytes())
+            self._file.write(FOOTER.pack(indexOffset, len(self._offsets), INDEX_MAGIC))
+        finally:
+            self._writes = []
+            self._file.close()
+
+
+'''
+Writes frames to a .tactioz file in one go, compressing chunks in parallel
+on workers threads (or processes)
+'''
+def writeFile(path, frames, chunkFrames=1 << 14, compressor='zlib', level=None, delta=True, workers=None, processes=False):
+    starts = range(0, len(frames), chunkFrames)
+    with _pool(workers, processes) as pool:
+        encode = partial(encodeChunk, compressor=compressor, level=level, delta=delta)
+        chunks = pool.map(encode, [np.asarray(frames[start:start + chunkFrames]) for start in starts])
+        with open(path, 'wb') as f:
+            f.write(FILE_HEADER.pack(MAGIC, VERSION))
+            offsets = []
+            for chunk in chunks:
+                offsets.append(f.tell())
+                f.write(chunk)
+            indexOffset = f.tell()
+            f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            f.write(FOOTER.pack(indexOffset, len(offsets), INDEX_MAGIC))
+
+'''
+Returns the offsets of the chunks of a .tactioz file held in data (bytes
+or a memory map), from the index or, without one, the chunk headers
+'''
+def chunkOffsets(data):
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a Tactio codec file")
+    if len(data) >= FILE_HEADER.size + FOOTER.size:
+        indexOffset, count, indexMagic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+        if indexMagic == INDEX_MAGIC:
+            return np.frombuffer(data, dtype='<u8', count=count, offset=indexOffset).astype(np.int64)
+    offsets = []
+    pos = FILE_HEADER.size
+    while pos + CHUNK_HEADER.size <= len(data):
+        chunkMagic, _, _, _, length = CHUNK_HEADER.unpack_from(data, pos)
+        if chunkMagic != CHUNK_MAGIC or pos + CHUNK_HEADER.size + length > len(data):
+            break # Truncated by an interrupted write
+        offsets.append(pos)
+        pos += CHUNK_HEADER.size + length
+    return np.asarray(offsets, dtype=np.int64)
+
+'''
+Reads all frames of a .tactioz file, decoding chunks in parallel on
+workers threads (or processes). zlib, lzma and bz2 release the GIL while
+decompressing, so threads already use several cores
+'''
+def readFile(path, workers=None, processes=False):
+    with open(path, 'rb') as f:
+        data = f.read()
+    offsets = chunkOffsets(data)
+    view = memoryview(data)
+    chunks = []
+    for offset in offsets:
+        length = CHUNK_HEADER.unpack_from(data, offset)[4]
+        chunk = view[offset:offset + CHUNK_HEADER.size + length]
+        chunks.append(bytes(chunk) if processes else chunk)
+    if not chunks:
+        return np.empty(0, dtype=FRAME_DTYPE)
+    with _pool(workers, processes) as pool:
+        return np.concatenate(list(pool.map(decodeChunk, chunks)))
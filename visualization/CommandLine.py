@@ -1,6 +1,7 @@
 import serial
 import numpy as np
-from PyTactio import SerialProcessor
+import sys
+from PyTactio import SerialProcessor, SerialStatus
 import time
 
 '''
@@ -10,20 +11,21 @@ without needing a dependency on QT
 
 if __name__ == '__main__':
     spy = False
-    with serial.serial_for_url('spy:///dev/cu.usbmodem1422' if spy else '/dev/cu.usbmodem1422') as ser:
+    port = sys.argv[1] if len(sys.argv) > 1 else '/dev/cu.usbmodem1422'
+    with serial.serial_for_url('spy://' + port if spy else port) as ser:
         ser.baudrate = 230400
         processor = SerialProcessor(ser)
         time.sleep(2)
         ser.write(b'\x01') # Get all known node addresses
         while True:
             result, msg = processor.parseSerial()
-            if msg == -2:
+            if msg == SerialStatus.PORT_EMPTY:
                 pass
-            elif msg == 1:
+            elif msg == SerialStatus.NET_ADDRS:
                 addrs_hex = ', '.join([f'0x{addr:02x}' for addr in result])
                 addrs_dec = ', '.join([f'{addr:3d}' for addr in result])
                 print(f'All known addresses: {addrs_hex} / {addrs_dec}')
-            elif msg == 0:
+            elif msg == SerialStatus.DATA:
                 addr, data = result
                 print(f'Data from {addr:3d}:')
                 if False:
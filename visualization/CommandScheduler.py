@@ -0,0 +1,127 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+'''
+Non-blocking command queue for a Tactio chain.
+
+Callers submit commands and get a concurrent.futures.Future back straight
+away; a writer thread sends them. Each command is encoded into one bytes
+object when it is submitted, and all commands that are due on the same link
+are joined into a single write. Pacing is enforced by the writer instead of
+the caller sleeping:
+    sensorInterval - minimum seconds between two commands to one sensor
+    linkInterval - minimum seconds between two writes on one link
+Commands can also be given a delay, which replaces time.sleep in scripted
+sequences such as flashing every LED in turn.
+
+processor is a PyTactio.SerialProcessor, or anything with a route(key)
+method returning (SerialProcessor, address) such as
+MultiChain.MultiChainProcessor, in which case every port is its own link
+'''
+class CommandScheduler:
+    def __init__(self, processor, sensorInterval=0.01, linkInterval=0.002, maxBatch=64):
+        self.processor = processor
+        self.sensorInterval = sensorInterval
+        self.linkInterval = linkInterval
+        self.maxBatch = maxBatch # Commands per write
+        self.alive = True
+        self._heap = [] # (due time, submission order, link, id, bytes, future)
+        self._order = itertools.count()
+        self._sensorReady = {} # (link, id) -> earliest time the sensor may get its next command
+        self._linkReady = {} # link -> earliest time of the next write
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _route(self, id):
+        if hasattr(self.processor, 'route'):
+            return self.processor.route(id)
+        return self.processor, id
+
+    '''
+    Queues action (PyTactio.SerialActions) for sensor id, to be sent no
+    earlier than delay seconds from now. The future's result is the time the
+    command was written
+    '''
+    def submit(self, action, id, delay=0):
+        link, addr = self._route(id)
+        future = Future()
+        with self._cond:
+            data = link.encodeCommand(action, addr) # Encoded in submission order, as bias state depends on it
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._order), link, addr, data, future))
+            self._cond.notify()
+        return future
+
+    '''
+    Queues action for every sensor in ids, spaced start, start + spacing, ...
+    seconds from now. Returns the futures in the order of ids
+    '''
+    def broadcast(self, action, ids, spacing=0, start=0):
+        return [self.submit(action, id, start + i*spacing) for i, id in enumerate(ids)]
+
+    '''
+    Stops the writer thread. Commands still queued are cancelled
+    '''
+    def stop(self):
+        with self._cond:
+            self.alive = False
+            self._cond.notify()
+        self._thread.join()
+        for entry in self._heap:
+            entry[5].cancel()
+        self._heap = []
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batches = self._takeDue()
+                while self.alive and not batches:
+                    wait = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(wait)
+                    batches = self._takeDue()
+                if not self.alive:
+                    return
+            for link, entries in batches.items():
+                try:
+                    link.input_ser.write(b''.join(entry[4] for entry in entries))
+                    link.input_ser.flush()
+                except Exception as e:
+                    for entry in entries:
+                        if not entry[5].done():
+                            entry[5].set_exception(e)
+                else:
+                    sent = time.monotonic()
+                    for entry in entries:
+                        if not entry[5].done():
+                            entry[5].set_result(sent)
+
+    # Pops the commands that may be sent now, grouped by link. Called with the lock held
+    def _takeDue(self):
+        now = time.monotonic()
+        batches = {}
+        deferred = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            due, order, link, addr, data, future = entry
+            if future.cancelled():
+                continue
+            linkReady = self._linkReady.get(link, 0)
+            sensorReady = self._sensorReady.get((link, addr), 0)
+            batch = batches.get(link)
+            if batch is None and linkReady > now:
+                deferred.append((linkReady, order) + entry[2:])
+            elif sensorReady > now:
+                deferred.append((sensorReady, order) + entry[2:])
+            elif batch is not None and len(batch) >= self.maxBatch:
+                deferred.append((now + self.linkInterval, order) + entry[2:])
+            elif future.set_running_or_notify_cancel(): # Can no longer be cancelled once taken
+                batches.setdefault(link, []).append(entry)
+                self._sensorReady[(link, addr)] = now + self.sensorInterval
+        for link in batches:
+            self._linkReady[link] = now + self.linkInterval
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return batches
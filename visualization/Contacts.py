@@ -0,0 +1,190 @@
+import xml.etree.ElementTree as et
+import numpy as np
+from PyTactio import addressIndex
+from Filters import waves
+
+'''
+Live contact detection and tracking over the whole sensor layout.
+
+Taxels are placed on the layout of the config: sensor i covers the square
+at (x_pos, y_pos) of side size, and taxel (row, column) sits
+at the centre of its cell. Taxels closer than `reach` taxel pitches are
+neighbours, which links neighbouring sensors as well as taxels within one
+sensor, so a contact straddling two sensors is one blob.
+
+Blobs are the connected components of taxels above a threshold, found by
+label propagation over the neighbour edges. Each update only relabels the
+blobs that can have changed: those touching the updated sensors or their
+neighbouring sensors. Contacts are then matched to the previous ones by
+greedy nearest neighbour to carry IDs and velocities from frame to frame
+'''
+
+CONTACT_DTYPE = [('id', '<u4'), ('x', '<f8'), ('y', '<f8'), ('vx', '<f8'), ('vy', '<f8'),
+                 ('area', '<f8'), ('force', '<f8'), ('taxels', '<u4')]
+
+'''
+Reads the taxel centres (n, 4, 4, 2) as (x, y) and the taxel pitch (n,) of
+every sensor of a config, in config order
+'''
+def loadGeometry(configPath):
+    position_data = et.parse(configPath).getroot()
+    corners = []
+    pitch = []
+    for sensor in position_data:
+        size = sensor.find('size')
+        size = 400 if size is None else int(size.text) # Same default as the GUI
+        corners.append((int(sensor.find('x_pos').text), int(sensor.find('y_pos').text)))
+        pitch.append(size/4)
+    corners = np.array(corners, dtype=np.float64)
+    pitch = np.array(pitch)
+    cell = np.arange(4) + 0.5
+    centres = np.empty((len(pitch), 4, 4, 2))
+    centres[..., 0] = corners[:, 0, None, None] + pitch[:, None, None]*cell[None, None, :] # x from the column
+    centres[..., 1] = corners[:, 1, None, None] + pitch[:, None, None]*cell[None, :, None] # y from the row
+    return centres, pitch
+
+'''
+Returns the (E, 2) taxel pairs closer than reach times the larger of their
+pitches, taxels numbered sensor*16 + row*4 + column
+'''
+def neighbourEdges(centres, pitch, reach=1.5):
+    points = centres.reshape(-1, 2)
+    taxelPitch = np.repeat(pitch, 16)
+    distance = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+    limit = reach*np.maximum(taxelPitch[:, None], taxelPitch[None, :])
+    a, b = np.nonzero(np.triu(distance <= limit, k=1))
+    return np.stack([a, b], axis=1)
+
+
+class ContactTracker:
+    '''
+    sensorIDs - sensor keys in the same order as the geometry
+    centres, pitch - as returned by loadGeometry
+    threshold - value a taxel must exceed to be part of a contact
+    transform - optional function (data, addrs) -> values applied to the
+                frames before thresholding, e.g. CalibrationLUT.apply, so
+                contacts are found in force rather than raw counts
+    maxDistance - furthest a contact may move between updates, in taxel
+                  pitches, and still keep its ID
+    '''
+    def __init__(self, sensorIDs, centres, pitch, threshold=50.0, transform=None, reach=1.5, maxDistance=2.0):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        self.points = centres.reshape(-1, 2)
+        self.cellArea = np.repeat(pitch**2, 16)
+        self.threshold = threshold
+        self.transform = transform
+        self.maxDistance = maxDistance*pitch.max()
+        n = len(self.sensorIDs)
+        self.values = np.zeros(n*16)
+        self.labels = np.full(n*16, -1, dtype=np.intp) # Root taxel of each taxel's blob, -1 when not pressed
+        self.edges = neighbourEdges(centres, pitch, reach)
+        # Sensors sharing at least one edge, including each sensor with itself
+        sensorEdges = self.edges//16
+        self.sensorNeighbours = np.eye(n, dtype=bool)
+        self.sensorNeighbours[sensorEdges[:, 0], sensorEdges[:, 1]] = True
+        self.sensorNeighbours[sensorEdges[:, 1], sensorEdges[:, 0]] = True
+        self.contacts = np.empty(0, dtype=CONTACT_DTYPE)
+        self.timestamp = None
+        self.nextID = 0
+        self.consumers = [] # Called with the contacts after every update by write()
+
+    '''
+    Updates the tracker with a batch of frames. The batch is applied in
+    waves (see Filters.py), each holding at most one frame per sensor and
+    followed by one detection and tracking step
+    '''
+    def write(self, frames):
+        rows = self.rows[frames['addr']]
+        known = np.flatnonzero(rows >= 0)
+        if(not len(known)):
+            return
+        frames = frames[known]
+        rows = rows[known]
+        values = frames['data'].astype(np.float64)
+        if(self.transform is not None):
+            values = self.transform(frames['data'], frames['addr'])
+        for wave in waves(rows):
+            self.update(rows[wave], values[wave], frames['timestamp'][wave].max())
+            for consumer in self.consumers:
+                consumer(self.contacts)
+
+    '''
+    Sets the (k, 4, 4) values of the sensors in rows (all distinct) and
+    returns the contacts, as an array of CONTACT_DTYPE
+    '''
+    def update(self, rows, values, timestamp):
+        self.values.reshape(-1, 16)[rows] = values.reshape(-1, 16)
+        self._relabel(rows)
+        self._track(self._measure(), timestamp)
+        return self.contacts
+
+    def _relabel(self, rows):
+        labels = self.labels
+        nearby = np.flatnonzero(self.sensorNeighbours[rows].any(axis=0))
+        seeds = (nearby[:, None]*16 + np.arange(16)).ravel()
+        # Every blob with a taxel near the updated sensors may have grown, shrunk, split or merged
+        dirty = np.zeros(len(labels) + 1, dtype=bool) # The extra last entry is looked up for label -1
+        dirty[labels[seeds]] = True
+        dirty[-1] = False
+        affected = dirty[labels]
+        affected[seeds] = True
+        active = affected & (self.values > self.threshold)
+        labels[affected] = -1
+        labels[active] = np.flatnonzero(active)
+        edges = self.edges[active[self.edges].all(axis=1)]
+        a, b = edges[:, 0], edges[:, 1]
+        taxels = np.flatnonzero(active)
+        while len(edges):
+            lowest = np.minimum(labels[a], labels[b])
+            updated = labels.copy()
+            np.minimum.at(updated, a, lowest)
+            np.minimum.at(updated, b, lowest)
+            updated[taxels] = updated[updated[taxels]] # Pointer jumping shortens long chains
+            if(np.array_equal(updated, labels)):
+                break
+            labels[:] = updated
+
+    def _measure(self):
+        pressed = np.flatnonzero(self.labels >= 0)
+        roots, blob = np.unique(self.labels[pressed], return_inverse=True)
+        weight = self.values[pressed] - self.threshold # Taxels barely over the threshold count the least
+        force = np.bincount(blob, weight, len(roots))
+        measured = np.zeros(len(roots), dtype=CONTACT_DTYPE)
+        measured['x'] = np.bincount(blob, weight*self.points[pressed, 0], len(roots))/force
+        measured['y'] = np.bincount(blob, weight*self.points[pressed, 1], len(roots))/force
+        measured['area'] = np.bincount(blob, self.cellArea[pressed], len(roots))
+        measured['force'] = np.bincount(blob, self.values[pressed], len(roots))
+        measured['taxels'] = np.bincount(blob, minlength=len(roots))
+        return measured
+
+    # Greedy nearest neighbour matching against where the previous contacts were heading
+    def _track(self, measured, timestamp):
+        previous = self.contacts
+        dt = 0.0 if self.timestamp is None else max(timestamp - self.timestamp, 0.0)
+        self.timestamp = timestamp
+        matched = np.full(len(measured), -1, dtype=np.intp)
+        if(len(previous) and len(measured)):
+            predictedX = previous['x'] + previous['vx']*dt
+            predictedY = previous['y'] + previous['vy']*dt
+            distance = np.hypot(measured['x'][:, None] - predictedX[None, :], measured['y'][:, None] - predictedY[None, :])
+            used = np.zeros(len(previous), dtype=bool)
+            for pair in np.argsort(distance, axis=None):
+                i, j = divmod(pair, len(previous))
+                if(distance[i, j] > self.maxDistance):
+                    break
+                if(matched[i] < 0 and not used[j]):
+                    matched[i] = j
+                    used[j] = True
+        old = matched >= 0
+        measured['id'][old] = previous['id'][matched[old]]
+        if(dt > 0):
+            measured['vx'][old] = (measured['x'][old] - previous['x'][matched[old]])/dt
+            measured['vy'][old] = (measured['y'][old] - previous['y'][matched[old]])/dt
+        else:
+            measured['vx'][old] = previous['vx'][matched[old]]
+            measured['vy'][old] = previous['vy'][matched[old]]
+        new = np.flatnonzero(~old)
+        measured['id'][new] = self.nextID + np.arange(len(new))
+        self.nextID += len(new)
+        self.contacts = measured
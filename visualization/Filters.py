@@ -0,0 +1,215 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from PyTactio import addressIndex
+from Calibration import RAW_LEVELS
+
+'''
+Temporal filtering of taxel data.
+
+Every filter keeps its state for all sensors as (nSensors, 4, 4) arrays and
+updates the rows of many sensors at once. A batch of frames is split into
+"waves": wave k holds the k-th frame of every sensor present in the batch,
+so no sensor appears twice in a wave and each wave is a single vectorized
+update. A batch spread over n sensors takes about len(batch)/n waves, and
+there are never per-taxel Python loops.
+
+Filters are chained by a FilterPipeline, which is fed raw frame batches
+(e.g. as a ParseThread.Parser consumer) and produces frames of the same
+dtype with filtered data
+'''
+
+'''
+Returns, for every frame, how many earlier frames in the batch came from
+the same sensor
+'''
+def occurrenceRank(rows):
+    order = np.argsort(rows, kind='stable')
+    sortedRows = rows[order]
+    starts = np.flatnonzero(np.r_[True, sortedRows[1:] != sortedRows[:-1]])
+    counts = np.diff(np.r_[starts, len(rows)])
+    rank = np.empty(len(rows), dtype=np.intp)
+    rank[order] = np.arange(len(rows)) - np.repeat(starts, counts)
+    return rank
+
+'''
+Splits frame indices into waves in which every sensor row appears at most once
+'''
+def waves(rows):
+    rank = occurrenceRank(rows)
+    order = np.argsort(rank, kind='stable')
+    bounds = np.searchsorted(rank[order], np.arange(1, rank.max() + 1)) if len(rows) else []
+    return np.split(order, bounds)
+
+
+'''
+Base class of the filters. update() is handed the sensor rows of one wave
+(all distinct) and their (k, 4, 4) float values, and returns the filtered values
+'''
+class TaxelFilter(ABC):
+    def __init__(self, nSensors):
+        self.nSensors = nSensors
+        self.reset()
+
+    def reset(self):
+        self.primed = np.zeros(self.nSensors, dtype=bool) # Sensors that have been seen since reset
+
+    @abstractmethod
+    def update(self, rows, values):
+        pass
+
+
+'''
+Exponential moving average, alpha being the weight of the newest frame
+'''
+class EMA(TaxelFilter):
+    def __init__(self, nSensors, alpha=0.3):
+        self.alpha = alpha
+        super().__init__(nSensors)
+
+    def reset(self):
+        super().reset()
+        self.state = np.zeros((self.nSensors, 4, 4))
+
+    def update(self, rows, values):
+        state = self.state[rows]
+        fresh = ~self.primed[rows]
+        state[fresh] = values[fresh] # Start from the first frame instead of ramping up from 0
+        state += self.alpha*(values - state)
+        self.state[rows] = state
+        self.primed[rows] = True
+        return state
+
+
+'''
+Median of the last k frames, which removes single-frame spikes without
+smearing steps the way an average does
+'''
+class Median(TaxelFilter):
+    def __init__(self, nSensors, k=5):
+        self.k = k
+        super().__init__(nSensors)
+
+    def reset(self):
+        super().reset()
+        self.history = np.zeros((self.nSensors, self.k, 4, 4))
+        self.pos = np.zeros(self.nSensors, dtype=np.intp)
+
+    def update(self, rows, values):
+        fresh = ~self.primed[rows]
+        self.history[rows[fresh]] = values[fresh, np.newaxis] # Fill the window with the first frame
+        self.history[rows, self.pos[rows]] = values
+        self.pos[rows] = (self.pos[rows] + 1) % self.k
+        self.primed[rows] = True
+        middle = [(self.k - 1)//2, self.k//2] # The same index when k is odd
+        window = np.partition(self.history[rows], middle, axis=1)
+        return 0.5*(window[:, middle[0]] + window[:, middle[1]])
+
+
+'''
+Per-taxel Kalman filter modelling each taxel as a random walk.
+processNoise is the variance the true value gains per frame and
+measurementNoise the variance of a reading, both in raw counts squared
+'''
+class Kalman(TaxelFilter):
+    def __init__(self, nSensors, processNoise=4.0, measurementNoise=64.0):
+        self.processNoise = processNoise
+        self.measurementNoise = measurementNoise
+        super().__init__(nSensors)
+
+    def reset(self):
+        super().reset()
+        self.estimate = np.zeros((self.nSensors, 4, 4))
+        self.variance = np.zeros((self.nSensors, 4, 4))
+
+    def update(self, rows, values):
+        estimate = self.estimate[rows]
+        variance = self.variance[rows] + self.processNoise
+        fresh = ~self.primed[rows]
+        estimate[fresh] = values[fresh]
+        variance[fresh] = self.measurementNoise
+        gain = variance/(variance + self.measurementNoise)
+        estimate += gain*(values - estimate)
+        self.estimate[rows] = estimate
+        self.variance[rows] = (1 - gain)*variance
+        self.primed[rows] = True
+        return estimate
+
+
+'''
+Tracks the unloaded level of every taxel and subtracts it, compensating
+slow drift without the firmware bias calibration. The baseline follows the
+data at the given rate per frame, but a sensor's baseline is frozen while
+any of its taxels is more than threshold counts above it, so a held press
+is not absorbed into the baseline
+'''
+class BaselineTracker(TaxelFilter):
+    def __init__(self, nSensors, rate=0.002, threshold=40.0):
+        self.rate = rate
+        self.threshold = threshold
+        super().__init__(nSensors)
+
+    def reset(self):
+        super().reset()
+        self.baseline = np.zeros((self.nSensors, 4, 4))
+        self.loaded = np.zeros(self.nSensors, dtype=bool)
+
+    def update(self, rows, values):
+        baseline = self.baseline[rows]
+        fresh = ~self.primed[rows]
+        baseline[fresh] = values[fresh]
+        loaded = ((values - baseline) > self.threshold).any(axis=(1, 2))
+        baseline[~loaded] += self.rate*(values[~loaded] - baseline[~loaded])
+        self.baseline[rows] = baseline
+        self.loaded[rows] = loaded
+        self.primed[rows] = True
+        return values - baseline
+
+
+'''
+Chains filters over the frames of the given sensors. Frames of sensors not
+in sensorIDs pass through unchanged. Disabled filters are skipped, and
+reset when enabled again
+'''
+class FilterPipeline:
+    def __init__(self, sensorIDs, filters=()):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        self.filters = list(filters)
+        self.enabled = [True]*len(self.filters)
+        self.consumers = [] # Called with every filtered batch by write()
+
+    def setEnabled(self, filter, enabled):
+        i = self.filters.index(filter)
+        if(enabled and not self.enabled[i]):
+            filter.reset()
+        self.enabled[i] = enabled
+
+    '''
+    Returns a copy of frames with the data of known sensors filtered.
+    Results are rounded and clipped to the 12-bit raw range so they can
+    be calibrated and displayed like raw frames
+    '''
+    def process(self, frames):
+        frames = frames.copy()
+        if(not any(self.enabled) or not len(frames)):
+            return frames
+        rows = self.rows[frames['addr']]
+        known = np.flatnonzero(rows >= 0)
+        rows = rows[known]
+        values = frames['data'][known].astype(np.float64)
+        batchWaves = waves(rows)
+        for filter, enabled in zip(self.filters, self.enabled):
+            if(not enabled):
+                continue
+            for wave in batchWaves:
+                values[wave] = filter.update(rows[wave], values[wave])
+        frames['data'][known] = np.clip(np.rint(values), 0, RAW_LEVELS - 1)
+        return frames
+
+    '''
+    Filters frames and hands them to every consumer
+    '''
+    def write(self, frames):
+        frames = self.process(frames)
+        for consumer in self.consumers:
+            consumer(frames)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import numpy as np
+import Calibration
+from Recording import Recording
+
+'''
+Fits the per-taxel calibration models stored in regression_params.json.
+
+Input is a manifest (JSON list) pairing recordings with the reference load
+applied while they were captured, for example
+    [{"recording": "empty.tactio", "load": 0},
+     {"recording": "100g.tactio", "load": 0.981},
+     {"recording": "node9_corner.tactio", "load": 0.5, "sensors": [9], "taxels": [[0, 0]],
+      "t0": 12.5, "t1": 20.0}]
+"sensors" and "taxels" ([row, column] pairs) restrict which taxels the load
+applies to and default to everything in the recording. t0 and t1 restrict
+the time range used.
+
+Every frame of every taxel contributes a sample. Samples are accumulated
+into the normal equations of all taxels at once, so the cost of a fit is a
+few array operations per recording and sensor rather than a loop over taxels
+'''
+
+'''
+Normal equations of a polynomial fit for a set of taxels. The fit is done in
+u = R2 * conductance, which keeps higher powers well conditioned, and the
+coefficients are converted back to conductance when solved
+'''
+class TaxelFit:
+    def __init__(self, sensorIDs, order=1):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = {id: i for i, id in enumerate(self.sensorIDs)}
+        self.order = order
+        n = len(self.sensorIDs)
+        self.xtx = np.zeros((n, 16, order + 1, order + 1))
+        self.xty = np.zeros((n, 16, order + 1))
+        self.yy = np.zeros((n, 16))
+        self.count = np.zeros((n, 16))
+
+    '''
+    Adds raw frames (n, 4, 4) of sensor id taken under load. mask is an
+    optional (4, 4) boolean array selecting the taxels the load applies to
+    '''
+    def add(self, id, data, load, mask=None):
+        u = Calibration.R2*Calibration.conductance(np.asarray(data, dtype=np.float64).reshape(-1, 16))
+        weight = np.isfinite(u) & (u >= 0)
+        if mask is not None:
+            weight &= np.asarray(mask).reshape(1, 16)
+        u = np.where(weight, u, 0)
+        powers = u[..., None]**np.arange(self.order, -1, -1) * weight[..., None] # Highest power first
+        row = self.rows[id]
+        self.xtx[row] += np.einsum('ntk,ntj->tkj', powers, powers)
+        self.xty[row] += load*powers.sum(axis=0)
+        self.yy[row] += load*load*weight.sum(axis=0)
+        self.count[row] += weight.sum(axis=0)
+
+    '''
+    Solves all fits. Returns the coefficients against conductance, highest
+    power first, as an (n_sensors, 4, 4, order + 1) array and the RMS
+    residual of each taxel as (n_sensors, 4, 4). Taxels without samples get
+    NaN coefficients
+    '''
+    def solve(self):
+        coeffs = np.einsum('stkj,stj->stk', np.linalg.pinv(self.xtx), self.xty)
+        sse = self.yy - 2*np.einsum('stk,stk->st', coeffs, self.xty) + np.einsum('stk,stkj,stj->st', coeffs, self.xtx, coeffs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rms = np.sqrt(np.maximum(sse, 0)/self.count)
+        coeffs = coeffs*float(Calibration.R2)**np.arange(self.order, -1, -1)
+        coeffs[self.count == 0] = np.nan
+        return coeffs.reshape(-1, 4, 4, self.order + 1), rms.reshape(-1, 4, 4)
+
+'''
+Fits every taxel in the recordings listed by a manifest (see above)
+'''
+def fitManifest(manifest, order=1):
+    recordings = {}
+    sensorIDs = set()
+    for entry in manifest:
+        path = entry['recording']
+        if path not in recordings:
+            recordings[path] = Recording(path)
+        sensorIDs.update(entry.get('sensors', recordings[path].sensorIDs))
+    fit = TaxelFit(sorted(sensorIDs), order)
+    for entry in manifest:
+        recording = recordings[entry['recording']]
+        mask = None
+        if 'taxels' in entry:
+            mask = np.zeros((4, 4), dtype=bool)
+            for row, col in entry['taxels']:
+                mask[row, col] = True
+        for id in entry.get('sensors', recording.sensorIDs):
+            frames = recording.sensor(id, entry.get('t0'), entry.get('t1'))
+            fit.add(id, frames['data'], entry['load'], mask)
+    return fit
+
+'''
+Writes fitted coefficients in the regression_params.json format, skipping
+taxels without samples
+'''
+def writeParams(path, sensorIDs, coeffs):
+    params = {}
+    for s, id in enumerate(sensorIDs):
+        for i in range(4):
+            for j in range(4):
+                if np.all(np.isfinite(coeffs[s, i, j])):
+                    params["node{}_{}_{}".format(id, i, j)] = coeffs[s, i, j].tolist()
+    with open(path, 'w') as outfile:
+        json.dump(params, outfile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit per-taxel calibration models from reference recordings')
+    parser.add_argument('manifest', help='JSON list of {"recording", "load"[, "sensors", "taxels", "t0", "t1"]}')
+    parser.add_argument('-o', '--output', default='regression_params.json')
+    parser.add_argument('--order', type=int, default=1, help='Polynomial order of the model (1 = slope/offset)')
+    args = parser.parse_args()
+
+    with open(args.manifest, 'r') as infile:
+        fit = fitManifest(json.load(infile), args.order)
+    coeffs, rms = fit.solve()
+    writeParams(args.output, fit.sensorIDs, coeffs)
+    for s, id in enumerate(fit.sensorIDs):
+        print('Sensor {:3d}: RMS residual mean {:.4g}, worst {:.4g}, {:d} samples'.format(
+            id, np.nanmean(rms[s]), np.nanmax(rms[s]), int(fit.count[s].sum())))
@@ -0,0 +1,59 @@
+import threading
+import numpy as np
+from PyTactio import addressIndex
+
+'''
+Holds the latest raw frame of every sensor, written by acquisition and read
+by the display at its own pace.
+
+Each write bumps a per-sensor sequence number. readChanged returns only the
+sensors whose sequence moved since the previous call, and counts the frames
+that were overwritten in between (coalesced) so nothing is lost silently.
+backlog is the sequence gap found by the last readChanged: the frames
+written since the one before it, displayed or coalesced by that read.
+Frames from addresses that are not in sensorIDs are counted in unknown
+'''
+class LatestFrameStore:
+    def __init__(self, sensorIDs):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        n = len(self.sensorIDs)
+        self.frames = np.zeros((n, 4, 4), dtype=np.uint16)
+        self.timestamps = np.zeros(n)
+        self.sequence = np.zeros(n, dtype=np.uint64) # Frames written per sensor
+        self.coalesced = np.zeros(n, dtype=np.uint64) # Frames replaced before they were read
+        self.unknown = 0
+        self.backlog = 0 # Frames written between the last two reads
+        self._readSequence = np.zeros(n, dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    '''
+    Stores the newest frame of each sensor in a batch (PyTactio.FRAME_DTYPE)
+    '''
+    def write(self, frames):
+        rows = self.rows[frames['addr']]
+        known = rows >= 0
+        if not known.all():
+            frames = frames[known]
+            rows = rows[known]
+        # np.unique returns first occurrences, so search the reversed rows for the newest frames
+        uniqueRows, lastFromEnd = np.unique(rows[::-1], return_index=True)
+        last = len(rows) - 1 - lastFromEnd
+        counts = np.bincount(rows, minlength=len(self.sensorIDs)).astype(np.uint64)
+        with self._lock:
+            self.unknown += int(len(known) - len(rows))
+            self.frames[uniqueRows] = frames['data'][last]
+            self.timestamps[uniqueRows] = frames['timestamp'][last]
+            self.sequence += counts
+
+    '''
+    Returns the rows (positions in sensorIDs) of the sensors written since
+    the last call, with copies of their frames and timestamps
+    '''
+    def readChanged(self):
+        with self._lock:
+            changed = np.flatnonzero(self.sequence != self._readSequence)
+            self.backlog = int((self.sequence[changed] - self._readSequence[changed]).sum())
+            self.coalesced[changed] += self.sequence[changed] - self._readSequence[changed] - np.uint64(1)
+            self._readSequence[changed] = self.sequence[changed]
+            return changed, self.frames[changed], self.timestamps[changed]
@@ -0,0 +1,111 @@
+import threading
+import numpy as np
+from PyTactio import addressIndex
+from Filters import occurrenceRank
+
+'''
+Rolling per-taxel history of every sensor.
+
+HistoryBuffer keeps the last `capacity` frames of each sensor in
+preallocated ring buffers, (n_sensors, capacity, 16) taxel values and
+(n_sensors, capacity) timestamps, so memory use is fixed however long it
+runs and writing a batch is a handful of vectorized assignments. It is fed
+frame batches by the acquisition thread (e.g. as a ParseThread.Parser or
+FilterPipeline consumer) and read from the GUI thread.
+
+For plotting, decimate() reduces a window of any length to the minimum and
+maximum of every pixel column, so drawing costs the same for a second as
+for minutes of history and short transients stay visible
+'''
+
+class HistoryBuffer:
+    '''
+    sensorIDs - sensor keys, in the order of the rows of the buffers
+    capacity - frames kept per sensor
+    dtype - type the taxel values are stored as; the raw uint16 of
+            PyTactio.FRAME_DTYPE by default
+    '''
+    def __init__(self, sensorIDs, capacity=1 << 15, dtype=np.uint16):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        self.capacity = capacity
+        n = len(self.sensorIDs)
+        self.values = np.zeros((n, capacity, 16), dtype=dtype)
+        self.timestamps = np.zeros((n, capacity))
+        self.count = np.zeros(n, dtype=np.int64) # Frames written per sensor since the start
+        self._lock = threading.Lock()
+
+    '''
+    Appends a batch of frames (PyTactio.FRAME_DTYPE) to the history of their sensors
+    '''
+    def write(self, frames):
+        rows = self.rows[frames['addr']]
+        known = np.flatnonzero(rows >= 0)
+        frames = frames[known]
+        rows = rows[known]
+        rank = occurrenceRank(rows)
+        counts = np.bincount(rows, minlength=len(self.count))
+        keep = rank >= counts[rows] - self.capacity # Only the last capacity frames of a sensor fit
+        rows = rows[keep]
+        with self._lock:
+            slots = (self.count[rows] + rank[keep]) % self.capacity
+            self.values[rows, slots] = frames['data'][keep].reshape(-1, 16)
+            self.timestamps[rows, slots] = frames['timestamp'][keep]
+            self.count += counts
+
+    '''
+    Returns copies of the timestamps (k,) and values (k, 16) of the sensor in
+    row, oldest first: the frames of the last `seconds` before the newest one,
+    or everything held for None
+    '''
+    def window(self, row, seconds=None):
+        with self._lock:
+            count = int(self.count[row])
+            held = min(count, self.capacity)
+            slots = (count - held + np.arange(held)) % self.capacity
+            timestamps = self.timestamps[row, slots]
+            if(seconds is not None and held):
+                first = np.searchsorted(timestamps, timestamps[-1] - seconds, side='left')
+                slots = slots[first:]
+                timestamps = timestamps[first:]
+            return timestamps, self.values[row, slots]
+
+    '''
+    Returns the number of frames written to the sensor in row so far, and
+    copies of the timestamps and values of those from frame number start
+    on, as far as they are still held. Lets a reader keep up with a sensor
+    by handing back the count it got last time
+    '''
+    def since(self, row, start):
+        with self._lock:
+            count = int(self.count[row])
+            slots = np.arange(max(start, count - self.capacity), count) % self.capacity
+            return count, self.timestamps[row, slots], self.values[row, slots]
+
+    '''
+    Forgets everything written so far
+    '''
+    def clear(self):
+        with self._lock:
+            self.count[:] = 0
+
+
+'''
+Min/max decimation of a series to width columns. Samples are split into
+width runs of consecutive samples, and each run is replaced by its minimum
+and its maximum, placed at the first and last timestamp of the run. values
+may have several columns (k, m), decimated independently. Series of at
+most 2*width samples are returned unchanged
+'''
+def decimate(timestamps, values, width):
+    if(len(timestamps) <= 2*width):
+        return timestamps, values
+    edges = np.linspace(0, len(timestamps), width + 1).astype(np.intp)
+    starts = edges[:-1]
+    x = np.empty(2*width)
+    x[0::2] = timestamps[starts]
+    x[1::2] = timestamps[edges[1:] - 1]
+    y = np.empty((2*width,) + values.shape[1:], dtype=values.dtype)
+    y[0::2] = np.minimum.reduceat(values, starts, axis=0)
+    y[1::2] = np.maximum.reduceat(values, starts, axis=0)
+    return x, y
@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+import numpy as np
+
+INTERVAL_EDGES = np.geomspace(1e-4, 10.0, 41) # Seconds; frames intervals histogram bin edges
+LATENCY_SAMPLES = 4096 # Most recent latency samples kept for percentiles
+
+'''
+Fixed-size ring of the most recent samples of a latency, for percentiles
+'''
+class LatencySamples:
+    def __init__(self, size=LATENCY_SAMPLES):
+        self.samples = np.zeros(size)
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()[-len(self.samples):]
+        slots = (self.count + np.arange(len(values))) % len(self.samples)
+        self.samples[slots] = values
+        self.count += len(values)
+
+    def summary(self):
+        values = self.samples[:min(self.count, len(self.samples))]
+        if not len(values):
+            return {'samples': 0}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {'samples': self.count, 'p50': p50, 'p90': p90, 'p99': p99, 'max': float(values.max())}
+
+'''
+Acquisition health metrics.
+
+The parse thread records every batch (per-sensor frame counts and a
+histogram of inter-arrival intervals, from which rate and jitter follow),
+the decode latency of each frame and any exception it hits, and copies the
+link counters (bytes discarded while resyncing, malformed messages) from its
+processor. Consumers add queue latencies, backlog, drops and coalesced
+frames. snapshot() returns everything as a dict, dump() writes it as JSON
+and summary() as a few lines of text for display. All methods are thread-safe
+'''
+class AcquisitionMetrics:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.resyncBytes = 0
+        self.malformedMessages = 0
+        self.exceptions = 0
+        self.lastException = None
+        self.backlog = 0
+        self.backlogMax = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.decodeLatency = LatencySamples()
+        self.queueLatency = LatencySamples()
+        self.sweeps = 0
+        self.incompleteSweeps = 0
+        self.sweepSkew = LatencySamples()
+        self._rows = np.full(1 << 16, -1, dtype=np.intp) # Address to row of the per-sensor arrays
+        self._addrs = []
+        self._frames = np.zeros(0, dtype=np.int64)
+        self._first = np.zeros(0)
+        self._last = np.zeros(0)
+        self._intervalSum = np.zeros(0)
+        self._intervalSq = np.zeros(0)
+        self._histogram = np.zeros((0, len(INTERVAL_EDGES) + 1), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    # Assigns rows to addresses seen for the first time. Called with the lock held
+    def _rowsFor(self, addrs):
+        rows = self._rows[addrs]
+        if (rows < 0).any():
+            new = np.unique(addrs[rows < 0])
+            self._rows[new] = len(self._addrs) + np.arange(len(new))
+            self._addrs.extend(int(addr) for addr in new)
+            grow = len(new)
+            self._frames = np.concatenate([self._frames, np.zeros(grow, dtype=np.int64)])
+            self._first = np.concatenate([self._first, np.zeros(grow)])
+            self._last = np.concatenate([self._last, np.zeros(grow)])
+            self._intervalSum = np.concatenate([self._intervalSum, np.zeros(grow)])
+            self._intervalSq = np.concatenate([self._intervalSq, np.zeros(grow)])
+            self._histogram = np.concatenate([self._histogram, np.zeros((grow, self._histogram.shape[1]), dtype=np.int64)])
+            rows = self._rows[addrs]
+        return rows
+
+    '''
+    Records a batch of frames (PyTactio.FRAME_DTYPE) as it leaves the decoder
+    '''
+    def recordFrames(self, frames, now=None):
+        if not len(frames):
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            rows = self._rowsFor(frames['addr'])
+            order = np.argsort(rows, kind='stable')
+            rows = rows[order]
+            times = frames['timestamp'][order]
+            # Each frame's predecessor is the previous frame of the same sensor in the batch,
+            # or the last one recorded for the first frame of each sensor
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = rows[1:] != rows[:-1]
+            previous = np.empty_like(times)
+            previous[1:] = times[:-1]
+            previous[first] = self._last[rows[first]]
+            hasPrevious = ~first | (self._frames[rows] > 0)
+            intervals = (times - previous)[hasPrevious]
+            intervalRows = rows[hasPrevious]
+            np.add.at(self._histogram, (intervalRows, np.searchsorted(INTERVAL_EDGES, intervals)), 1)
+            np.add.at(self._intervalSum, intervalRows, intervals)
+            np.add.at(self._intervalSq, intervalRows, intervals*intervals)
+
+            newSensor = first & (self._frames[rows] == 0)
+            self._first[rows[newSensor]] = times[newSensor]
+            last = np.ones(len(rows), dtype=bool)
+            last[:-1] = rows[1:] != rows[:-1]
+            self._last[rows[last]] = times[last]
+            self._frames += np.bincount(rows, minlength=len(self._frames))
+            self.decodeLatency.add(now - frames['timestamp'])
+
+    '''
+    Records how long frames waited between decoding and their consumer
+    '''
+    def recordQueueLatency(self, timestamps, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.queueLatency.add(now - np.asarray(timestamps))
+
+    '''
+    Records the number of frames waiting for a consumer, how many were
+    dropped in total and how many were coalesced (replaced by a newer frame
+    of the same sensor before being shown) in total
+    '''
+    def recordBacklog(self, backlog, dropped=None, coalesced=None):
+        with self._lock:
+            self.backlog = int(backlog)
+            self.backlogMax = max(self.backlogMax, self.backlog)
+            if dropped is not None:
+                self.dropped = int(dropped)
+            if coalesced is not None:
+                self.coalesced = int(coalesced)
+
+    '''
+    Copies the link counters of a processor (PyTactio.SerialProcessor or
+    anything with discardedBytes and malformedMessages)
+    '''
+    def recordLink(self, processor):
+        with self._lock:
+            self.resyncBytes = int(getattr(processor, 'discardedBytes', 0))
+            self.malformedMessages = int(getattr(processor, 'malformedMessages', 0))
+
+    '''
+    Records a batch of sweeps from a Sweeps.SweepAssembler
+    '''
+    def recordSweeps(self, sweeps):
+        with self._lock:
+            self.sweeps += len(sweeps)
+            self.incompleteSweeps += int(np.count_nonzero(sweeps['complete'] < 1))
+            self.sweepSkew.add(sweeps['skew'])
+
+    def recordException(self, text):
+        with self._lock:
+            self.exceptions += 1
+            self.lastException = text
+
+    def snapshot(self):
+        with self._lock:
+            sensors = {}
+            for row, addr in enumerate(self._addrs):
+                intervals = self._frames[row] - 1
+                span = self._last[row] - self._first[row]
+                entry = {'frames': int(self._frames[row]),
+                         'rate': float(intervals / span) if span > 0 else 0.0,
+                         'intervalHistogram': self._histogram[row].tolist()}
+                if intervals > 0:
+                    mean = self._intervalSum[row] / intervals
+                    entry['intervalMean'] = mean
+                    entry['jitter'] = float(np.sqrt(max(self._intervalSq[row] / intervals - mean*mean, 0)))
+                sensors[addr] = entry
+            return {'uptime': time.monotonic() - self.start,
+                    'sensors': sensors,
+                    'intervalEdges': INTERVAL_EDGES.tolist(),
+                    'resyncBytes': self.resyncBytes,
+                    'malformedMessages': self.malformedMessages,
+                    'exceptions': self.exceptions,
+                    'lastException': self.lastException,
+                    'decodeLatency': self.decodeLatency.summary(),
+                    'queueLatency': self.queueLatency.summary(),
+                    'sweeps': self.sweeps,
+                    'incompleteSweeps': self.incompleteSweeps,
+                    'sweepSkew': self.sweepSkew.summary(),
+                    'backlog': self.backlog,
+                    'backlogMax': self.backlogMax,
+                    'dropped': self.dropped,
+                    'coalesced': self.coalesced}
+
+    def dump(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.snapshot(), outfile, indent=2, default=float)
+
+    '''
+    A few lines of text summarizing the snapshot, e.g. for an overlay
+    '''
+    def summary(self):
+        snap = self.snapshot()
+        rates = [entry['rate'] for entry in snap['sensors'].values()]
+        jitters = [entry['jitter'] for entry in snap['sensors'].values() if 'jitter' in entry]
+        lines = ['{} sensors, {:.1f}-{:.1f} frames/s'.format(len(rates), min(rates, default=0), max(rates, default=0)),
+                 'Jitter (worst): {:.2f} ms'.format(1000*max(jitters, default=0)),
+                 'Resync bytes: {}  Malformed: {}  Exceptions: {}'.format(snap['resyncBytes'], snap['malformedMessages'], snap['exceptions'])]
+        if snap['sweeps']:
+            lines.append('Sweeps: {} ({} incomplete), skew p50 {:.1f} ms'.format(snap['sweeps'], snap['incompleteSweeps'], 1000*snap['sweepSkew']['p50']))
+        for name in ('decodeLatency', 'queueLatency'):
+            latency = snap[name]
+            if latency['samples']:
+                lines.append('{}: p50 {:.1f} ms, p99 {:.1f} ms'.format(name, 1000*latency['p50'], 1000*latency['p99']))
+        lines.append('Backlog: {} (max {})  Dropped: {}  Coalesced: {}'.format(snap['backlog'], snap['backlogMax'], snap['dropped'], snap['coalesced']))
+        return '\n'.join(lines)
@@ -0,0 +1,221 @@
+import threading
+import time
+import xml.etree.ElementTree as et
+from collections import deque
+import numpy as np
+from PyTactio import SerialProcessor, FRAME_DTYPE
+
+'''
+Acquisition from several Tactio network controllers at once.
+
+A layout config can name the serial port of each sensor with a <port>
+element; sensors without one are on the default port. Since addresses are
+only unique within a chain, every sensor is identified by a key combining
+the index of its port and its address (see sensorKey). Sensors on the
+first port keep their plain address as key, so single-port configs work
+unchanged.
+
+MultiChainProcessor reads every port on its own thread and merges the frames
+into one stream ordered by timestamp, with the key in the addr field. It
+offers the read_batch/addressLists interface of SerialProcessor and the same
+send* commands, addressed by key
+'''
+
+def sensorKey(portIndex, addr):
+    return (portIndex << 8) | addr
+
+def splitKey(key):
+    return key >> 8, key & 0xFF
+
+'''
+Reads a layout config and returns the list of port names, in order of first
+use, and the key of every sensor in the config's order
+'''
+def loadLayout(configPath, defaultPort):
+    position_data = et.parse(configPath).getroot()
+    portNames = []
+    keys = []
+    for sensor in position_data:
+        portElement = sensor.find('port')
+        portName = defaultPort if portElement is None else portElement.text.strip()
+        if portName not in portNames:
+            portNames.append(portName)
+        keys.append(sensorKey(portNames.index(portName), int(sensor.find('id').text)))
+    return portNames, keys
+
+
+class MultiChainProcessor:
+    '''
+    ports - open pyserial-compatible ports, one per chain
+    timeout - how long each reader thread blocks on its port per read
+    slack - seconds frames are held back beyond what ordering strictly
+            needs, absorbing timestamp jitter between ports
+    maxPending - frames kept waiting for read_batch; the oldest beyond that
+                 are dropped (and counted in dropped), so memory stays
+                 bounded when nobody reads, e.g. while the GUI plays a
+                 recording back
+    '''
+    def __init__(self, ports, timeout=0.05, slack=0.02, maxPending=1 << 16):
+        self.ports = list(ports)
+        self.processors = [SerialProcessor(port) for port in self.ports]
+        self.timeout = timeout
+        self.slack = slack
+        self.maxPending = maxPending
+        self.dropped = 0
+        self.addressLists = deque()
+        self.alive = False
+        self._queues = [deque() for port in self.ports] # Frame batches of every port, each queue in timestamp order
+        self._pendingCount = 0
+        # Every frame a port delivers from now on is stamped no earlier than its progress
+        self._progress = [0.0]*len(self.ports)
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._readLoop, args=(i,), daemon=True) for i in range(len(self.ports))]
+
+    def start(self):
+        self.alive = True
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.alive = False
+        for thread in self._threads:
+            thread.join()
+        for port in self.ports:
+            port.close()
+
+    def _readLoop(self, index):
+        processor = self.processors[index]
+        batchSize = 1024
+        while self.alive:
+            frames = processor.read_batch(batchSize, self.timeout)
+            if len(frames) == batchSize:
+                progress = frames['timestamp'].max() # More may be buffered, stamped no earlier than these
+            else:
+                progress = time.monotonic() # Anything still to come is read after this point
+                processor.lastTimestamp = max(processor.lastTimestamp, progress) # and not back-dated before it
+            frames['addr'] = (index << 8) | frames['addr']
+            with self._cond:
+                if len(frames):
+                    self._queues[index].append(frames)
+                    self._pendingCount += len(frames)
+                    if self._pendingCount > self.maxPending:
+                        self._dropOldest()
+                while processor.addressLists:
+                    self.addressLists.append([sensorKey(index, addr) for addr in processor.addressLists.popleft()])
+                self._progress[index] = progress
+                self._cond.notify()
+
+    # Keeps the newest maxPending pending frames (give or take frames with the same timestamp). Called with the lock held
+    def _dropOldest(self):
+        stamps = np.concatenate([frames['timestamp'] for queue in self._queues for frames in queue])
+        cutoff = np.partition(stamps, len(stamps) - self.maxPending)[len(stamps) - self.maxPending] # Oldest timestamp kept
+        for queue in self._queues:
+            if queue:
+                frames = np.concatenate(queue)
+                queue.clear()
+                queue.append(frames[np.searchsorted(frames['timestamp'], cutoff, side='left'):])
+        count = sum(len(frames) for queue in self._queues for frames in queue)
+        self.dropped += self._pendingCount - count
+        self._pendingCount = count
+
+    # Removes and returns the frames of queue stamped up to watermark. Called with the lock held
+    @staticmethod
+    def _popUpTo(queue, watermark):
+        ready = []
+        while queue and queue[0]['timestamp'][-1] <= watermark:
+            ready.append(queue.popleft())
+        if queue:
+            count = int(np.searchsorted(queue[0]['timestamp'], watermark, side='right'))
+            if count:
+                ready.append(queue[0][:count])
+                queue[0] = queue[0][count:]
+        return ready
+
+    # Merges the pending frames every port has progressed past, up to maxFrames. Called with the lock held
+    def _takeReady(self, maxFrames):
+        if not self._pendingCount:
+            return np.empty(0, dtype=FRAME_DTYPE)
+        watermark = min(self._progress) - self.slack
+        runs = [self._popUpTo(queue, watermark) for queue in self._queues]
+        runs = [np.concatenate(run) if run else np.empty(0, dtype=FRAME_DTYPE) for run in runs]
+        ready = np.concatenate(runs)
+        # Every port's run is already sorted, and a stable sort of a few sorted runs is a merge of them (timsort)
+        order = np.argsort(ready['timestamp'], kind='stable')
+        if len(order) > maxFrames:
+            # A stable merge takes a prefix of every run, the rest goes back to the front of its queue
+            starts = np.cumsum([0] + [len(run) for run in runs])
+            taken = np.bincount(np.searchsorted(starts, order[:maxFrames], side='right') - 1, minlength=len(runs))
+            for queue, run, count in zip(self._queues, runs, taken):
+                if count < len(run):
+                    queue.appendleft(run[count:])
+            order = order[:maxFrames]
+        self._pendingCount -= len(order)
+        return ready[order]
+
+    '''
+    Returns up to max_frames frames from all ports in timestamp order,
+    waiting up to timeout seconds (None waits forever) for some to be ready
+    '''
+    def read_batch(self, max_frames=256, timeout=0.1):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                frames = self._takeReady(max_frames)
+                if len(frames):
+                    return frames
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return frames
+                self._cond.wait(remaining)
+
+    # Link counters summed over all ports
+    @property
+    def discardedBytes(self):
+        return sum(processor.discardedBytes for processor in self.processors)
+
+    @property
+    def malformedMessages(self):
+        return sum(processor.malformedMessages for processor in self.processors)
+
+    '''
+    Returns the SerialProcessor and chain address of the sensor with key
+    '''
+    def route(self, key):
+        portIndex, addr = splitKey(key)
+        return self.processors[portIndex], addr
+
+    def send(self, action, key):
+        processor, addr = self.route(key)
+        processor.send(action, addr)
+
+    def sendLEDon(self, key):
+        processor, addr = self.route(key)
+        processor.sendLEDon(addr)
+
+    def sendLEDoff(self, key):
+        processor, addr = self.route(key)
+        processor.sendLEDoff(addr)
+
+    def sendCalCmd(self, key):
+        processor, addr = self.route(key)
+        processor.sendCalCmd(addr)
+
+    def sendBiasCalEn(self, key):
+        processor, addr = self.route(key)
+        processor.sendBiasCalEn(addr)
+
+    def sendBiasCalDis(self, key):
+        processor, addr = self.route(key)
+        processor.sendBiasCalDis(addr)
+
+    def sendHeartOn(self, key):
+        processor, addr = self.route(key)
+        processor.sendHeartOn(addr)
+
+    def sendHeartOff(self, key):
+        processor, addr = self.route(key)
+        processor.sendHeartOff(addr)
+
+    def requestAddresses(self):
+        for processor in self.processors:
+            processor.requestAddresses()
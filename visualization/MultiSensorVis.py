@@ -10,8 +10,21 @@ import PyTactio
 import json
 
 from NumpyArrayEncoder import NumpyArrayEncoder
+import AcquisitionProcess
+import Calibration
+import CommandScheduler
+import Contacts
+import Filters
+import FrameStore
+import History
+import Metrics
+import MultiChain
+import Recorder
 import SingleGrid
+import StreamServer
+import Sweeps
 import ParseThread
+import Playback
 
 
 '''
@@ -19,16 +32,17 @@ This class implements the main widget of the GUI
 '''
 
 class MultiSensorVis(QtWidgets.QMainWindow):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, config='configs/6sensor.xml', port='/dev/ttyACM0', separateProcess=False, server=None, calibration='./regression_params.json', refreshRate=30, **kwargs):
         super(QtWidgets.QMainWindow, self).__init__(*args, **kwargs)
         self.setWindowTitle("Tactio")
 
         '''
         Reads in XML data to define sensor locations
         '''
-        position_data = et.parse('configs/6sensor.xml').getroot()
+        position_data = et.parse(config).getroot()
         self.sensorCount = len(position_data)
-        self.sensorIDs = [int(position_data[i].find('id').text) for i in range(self.sensorCount)]
+        # Sensors are identified by keys combining their port and address (see MultiChain.py)
+        self.portNames, self.sensorIDs = MultiChain.loadLayout(config, port)
 
         '''
         Reads in XML data for parameters of model
@@ -37,38 +51,33 @@ class MultiSensorVis(QtWidgets.QMainWindow):
         '''
         
         '''
-        Reads in JSON data for parameters of model
+        Reads in JSON data for parameters of model, compiled into a lookup table
         '''
-        regFile = open('./regression_params.json', 'r')
-        model_data = json.load(regFile)
-        self.model_slope = {}
-        self.model_offset = {}
-        for key in model_data:
-            splitName = key.split('_')
-            node = splitName[0][4:]
-            idx1 = splitName[1]
-            idx2 = splitName[2]
-            if node in self.model_slope.keys():
-                self.model_slope[node][int(idx1), int(idx2)] = model_data[key][0]
-                self.model_offset[node][int(idx1), int(idx2)] = model_data[key][1]
-            else:
-                self.model_slope[node] = np.zeros((4,4))
-                self.model_offset[node] = np.zeros((4,4))
-                self.model_slope[node][int(idx1), int(idx2)] = model_data[key][0]
-                self.model_offset[node][int(idx1), int(idx2)] = model_data[key][1]
+        params = Calibration.loadRegressionParams(calibration)
+        # Parameters are stored per key ("node<key>_<row>_<column>"), which is the plain address on the first port
+        uncalibrated = [key for key in self.sensorIDs if key not in params]
+        if(uncalibrated):
+            print("No calibration parameters for sensors {}, shown raw".format(uncalibrated))
+        params = {key: params[key] for key in self.sensorIDs if key in params}
+        self.calibration = Calibration.CalibrationLUT(self.sensorIDs, params)
+        self.widgetRows = PyTactio.addressIndex(self.sensorIDs) # Maps sensor addresses to sensorWidgets
 
         #Blank widget to act as parent for all sensor widgets
-        sensorAreaWidget = QtGui.QWidget()
+        sensorAreaWidget = QtWidgets.QWidget()
 
         self.sensorWidgets = [SingleGrid.SensorGrid() for i in range(self.sensorCount)]
+        self.sensorNames = [] # Shown in place of the keys, which include the port
 
         # Sets parameters of screen based on XML document
         sensorXpos = []
         sensorYpos = []
         sizes = []
         for i in range(self.sensorCount):
-            self.sensorWidgets[i].setId(self.sensorIDs[i])
+            portIndex, addr = MultiChain.splitKey(self.sensorIDs[i])
+            self.sensorNames.append(addr if portIndex == 0 else "{} ({})".format(addr, self.portNames[portIndex]))
+            self.sensorWidgets[i].setId(self.sensorIDs[i], self.sensorNames[i])
             self.sensorWidgets[i].sendData.connect(self.sendMessageCallback)
+            self.sensorWidgets[i].showHistory.connect(self.showHistoryCallback)
             self.sensorWidgets[i].setParent(sensorAreaWidget)
             sensorx = int(position_data[i].find('x_pos').text)
             sensorXpos.append(sensorx)
@@ -89,8 +98,14 @@ class MultiSensorVis(QtWidgets.QMainWindow):
         maxsizeY = max(sensorYpos) + self.sensorWidgets[sensorYpos.index(max(sensorYpos))].height() + min(sensorYpos) 
         sensorAreaWidget.setMinimumSize(maxsizeX, maxsizeY)
 
+        # Contacts are drawn over the sensors, in the same coordinates as the config
+        squares = list(zip(sensorXpos, sensorYpos, sizes))
+        self.contactOverlay = SingleGrid.ContactOverlay(self.sensorWidgets, squares, sensorAreaWidget)
+        self.contactOverlay.resize(maxsizeX, maxsizeY)
+        self.contactOverlay.hide()
+
         #adding buttons for recording and saving
-        self.rec_btn = QtGui.QPushButton("Rec", self)
+        self.rec_btn = QtWidgets.QPushButton("Rec", self)
         self.rec_btn.setStyleSheet("min-height: 50px;"
                                    "max-height: 50px;"
                                    "min-width: 50px;"
@@ -110,8 +125,15 @@ class MultiSensorVis(QtWidgets.QMainWindow):
         self.fileSelBtn.clicked.connect(self.fileSelCallback)
         self.fileSelBtn.setMaximumWidth(50)
 
+        # Position in the recording being played back, hidden for live data
+        self.playbackSlider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.playbackSlider.setRange(0, 1000)
+        self.playbackSlider.sliderReleased.connect(self.seekPlaybackCallback)
+        self.playbackSlider.hide()
+
         # hbox holds all 3 buttons in a row
         recordButtonHbox = QtWidgets.QHBoxLayout()
+        recordButtonHbox.addWidget(self.playbackSlider)
         recordButtonHbox.addWidget(self.fileLine)
         recordButtonHbox.addWidget(self.fileSelBtn)
         recordButtonHbox.addWidget(self.rec_btn)
@@ -124,31 +146,90 @@ class MultiSensorVis(QtWidgets.QMainWindow):
         mainWidget.setLayout(vbox)
         self.setCentralWidget(mainWidget)
 
-        # Initializing recording
+        # Initializing recording. The recorder is fed every parsed frame directly by the parse thread
         self.is_recording = False
-        self.recording = {id : np.empty((1,4,4)) for id in self.sensorIDs} # Dictionary holding previous recordings
-
-        # QTimer kicks off every 50ms to record the latest information (if available)
-        self.vizTimer = QtCore.QTimer()
-        self.vizTimer.setInterval(50) # Convert Hz to ms interval
-        self.vizTimer.timeout.connect(self.timerCallback)
-        self.vizTimer.start()
-
-        #self.input_ser = serial.Serial('COM8') #Serial port for MBED Windows
-        #self.input_ser = serial.Serial('/dev/tty.usbmodem14202') #Serial port for MBED MacOS
-        self.input_ser = serial.Serial('/dev/ttyACM0') #Serial port for MBED Linux
-        self.input_ser.baudrate = 230400
+        self.recorder = Recorder.Recorder()
+
+        # port defaults to the serial port for MBED Linux
+        #port = 'COM8' #Serial port for MBED Windows
+        #port = '/dev/tty.usbmodem14202' #Serial port for MBED MacOS
         self.show()
 
+        # Latest frame of every sensor, redrawn at a fixed rate independent of the serial rate
+        self.frameStore = FrameStore.LatestFrameStore(self.sensorIDs)
+        self.displayTimer = QtCore.QTimer()
+        self.displayTimer.setInterval(int(1000/refreshRate)) # Convert Hz to ms interval
+        self.displayTimer.timeout.connect(self.displayCallback)
+        self.displayTimer.start()
+
         # Input Processor is instance of PyTactio library
-        self.processor = PyTactio.SerialProcessor(self.input_ser)
+        self.chains = None
+        self.client = None
+        if(server is not None):
+            # Attach to a running StreamServer that owns the chain, e.g. "unix:/tmp/tactio.sock"
+            self.acquisition = None
+            self.client = StreamServer.StreamClient(server, self.sensorIDs)
+            self.processor = self.client
+            source = self.client
+        elif(len(self.portNames) > 1):
+            # One reader thread per port, merged into a single time-ordered stream
+            self.acquisition = None
+            self.chains = MultiChain.MultiChainProcessor([serial.Serial(name, 230400) for name in self.portNames])
+            self.chains.start()
+            self.processor = self.chains
+            source = self.chains
+        elif(separateProcess):
+            # Decoding runs in its own process and the parse thread only copies frames out of shared memory
+            self.acquisition = AcquisitionProcess.AcquisitionProcess(self.portNames[0], 230400)
+            self.acquisition.start()
+            self.processor = PyTactio.SerialProcessor(self.acquisition.commandPort())
+            source = self.acquisition.reader()
+        else:
+            self.acquisition = None
+            self.input_ser = serial.Serial(self.portNames[0])
+            self.input_ser.baudrate = 230400
+            self.processor = PyTactio.SerialProcessor(self.input_ser)
+            source = self.processor
+
+        # The address list gives the order sensors are swept in, until then the config's order is assumed
+        self.processor.requestAddresses()
+
+        # Commands are queued and paced on a writer thread instead of blocking the GUI
+        self.scheduler = CommandScheduler.CommandScheduler(self.processor)
 
         # Threadpool used to run Parse Thread asynchronously
         self.threadpool = QtCore.QThreadPool()
-        self.worker = ParseThread.Parser(self.processor) 
-        self.worker.signals.gridData.connect(self.parseResultCallback) # Signal triggers callback to redraw sensor
+        self.worker = ParseThread.Parser(source) 
+        self.metrics = Metrics.AcquisitionMetrics()
+        self.worker.metrics = self.metrics
+        # Display reads the latest (filtered) frames on its own timer; the recorder keeps the raw frames
+        n = len(self.sensorIDs)
+        self.filters = Filters.FilterPipeline(self.sensorIDs, [Filters.BaselineTracker(n), Filters.Median(n), Filters.Kalman(n), Filters.EMA(n)])
+        for filter in self.filters.filters:
+            self.filters.setEnabled(filter, False)
+        self.filters.consumers.append(self.frameStore.write)
+        # Rolling history of what the grids show, plotted from the sensor context menu
+        self.history = History.HistoryBuffer(self.sensorIDs)
+        self.historyPlots = {} # Open SingleGrid.HistoryPlot windows by sensor ID
+        self.filters.consumers.append(self.history.write)
+        self.worker.consumers.append(self.filters.write)
+        # Contacts are found on baseline-compensated data; the tracker is only fed while they are shown
+        centres, pitch = Contacts.loadGeometry(config)
+        self.contacts = Contacts.ContactTracker(self.sensorIDs, centres, pitch)
+        self.contactFilters = Filters.FilterPipeline(self.sensorIDs, [Filters.BaselineTracker(n)])
+        self.contactFilters.consumers.append(self.contacts.write)
         self.worker.signals.sensorList.connect(self.sensorListCallback) # Signal triggers callback to print data
+        self.worker.consumers.append(self.recorder.append)
+        # Frames grouped into one snapshot per pass over the chain, with completeness and skew in the metrics.
+        # Only for a single chain: the ports of a MultiChain sweep independently
+        self.sweeps = None
+        if(self.chains is None):
+            self.sweeps = Sweeps.SweepAssembler(self.sensorIDs)
+            self.sweeps.consumers.append(self.metrics.recordSweeps)
+            self.worker.consumers.append(self.sweeps.write)
         self.threadpool.start(self.worker) 
+        self.liveSource = source
+        self.playback = None # Playback.PlaybackSource while a recording is played back
         
         self.calibrationOn=False # False = Raw value, True = Calibrated value
 
@@ -164,6 +245,63 @@ class MultiSensorVis(QtWidgets.QMainWindow):
         heartEnable = toolsMenu.addAction("Enable Heartbeat")
         heartEnable.triggered.connect(self.enableAllHeartbeat) # Enables heartbeat on sensors
 
+        showValues = toolsMenu.addAction("Show Values")
+        showValues.setCheckable(True)
+        showValues.setChecked(True)
+        showValues.toggled.connect(self.showValuesCallback) # Draws numbers on top of the grids
+
+        showMetrics = toolsMenu.addAction("Show Metrics")
+        showMetrics.setCheckable(True)
+        showMetrics.toggled.connect(self.showMetricsCallback) # Overlay with acquisition health
+
+        showContacts = toolsMenu.addAction("Show Contacts")
+        showContacts.setCheckable(True)
+        showContacts.toggled.connect(self.showContactsCallback) # Tracks contacts across the sensors
+
+        dumpMetrics = toolsMenu.addAction("Save Metrics...")
+        dumpMetrics.triggered.connect(self.dumpMetricsCallback)
+
+        # Overlay showing the acquisition metrics, refreshed once a second while visible
+        self.metricsLabel = QtWidgets.QLabel(self)
+        self.metricsLabel.setStyleSheet("QLabel {background-color: rgba(0, 0, 0, 160); color: white; padding: 6px;}")
+        self.metricsLabel.move(10, menuBar.sizeHint().height() + 10)
+        self.metricsLabel.hide()
+        self.metricsTimer = QtCore.QTimer()
+        self.metricsTimer.setInterval(1000)
+        self.metricsTimer.timeout.connect(self.updateMetricsOverlay)
+
+        filterMenu = menuBar.addMenu("Filtering")
+        for name, filter in zip(["Track Baseline", "Median", "Kalman", "Smooth (EMA)"], self.filters.filters):
+            action = filterMenu.addAction(name)
+            action.setCheckable(True)
+            action.toggled.connect(lambda on, filter=filter: self.filters.setEnabled(filter, on))
+
+        playbackMenu = menuBar.addMenu("Playback")
+        openRecording = playbackMenu.addAction("Open Recording...")
+        openRecording.triggered.connect(self.openRecordingCallback) # Plays a saved session instead of the chain
+
+        self.pauseAction = playbackMenu.addAction("Pause")
+        self.pauseAction.setCheckable(True)
+        self.pauseAction.toggled.connect(self.pausePlaybackCallback)
+
+        self.stepAction = playbackMenu.addAction("Step Sweep")
+        self.stepAction.triggered.connect(self.stepPlaybackCallback) # One frame of every sensor, while paused
+
+        speedMenu = playbackMenu.addMenu("Speed")
+        speedGroup = QtWidgets.QActionGroup(self)
+        for name, speed in [("0.25x", 0.25), ("1x", 1.0), ("4x", 4.0), ("16x", 16.0), ("As Fast As Possible", None)]:
+            action = speedMenu.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(speed == 1.0)
+            action.setActionGroup(speedGroup)
+            action.triggered.connect(lambda checked, speed=speed: self.setPlaybackSpeed(speed))
+        self.playbackSpeed = 1.0
+
+        self.liveAction = playbackMenu.addAction("Return to Live")
+        self.liveAction.triggered.connect(self.returnToLiveCallback)
+        for action in [self.pauseAction, self.stepAction, self.liveAction]:
+            action.setEnabled(False)
+
         calMenu = menuBar.addMenu("Calibration")
         calDisable = calMenu.addAction("Show Calibrated")
         calDisable.triggered.connect(self.enableCal) # Disables calibration on display
@@ -175,84 +313,203 @@ class MultiSensorVis(QtWidgets.QMainWindow):
     '''
     Turns all LEDs on (one at a time), then turns all off
     Starts at the first one in the chain (defined in the XML)
+    The sequence is timed by the command scheduler, so the GUI keeps running
     '''
     def flashSequenceLEDs(self):
-        for i in self.sensorIDs:
-            self.processor.sendLEDon(i)
-            time.sleep(0.2)
-        time.sleep(0.5)
-        for i in self.sensorIDs:
-            self.processor.sendLEDoff(i)
-            time.sleep(0.2)
+        self.scheduler.broadcast(PyTactio.SerialActions.LEDON, self.sensorIDs, spacing=0.2)
+        self.scheduler.broadcast(PyTactio.SerialActions.LEDOFF, self.sensorIDs, spacing=0.2,
+                                 start=0.2*len(self.sensorIDs) + 0.5)
 
     '''
     Disables all sensor heartbeats
     '''
     def disableAllHeartbeat(self):
-        for i in self.sensorIDs:
-            self.processor.sendHeartOff(i)
-            time.sleep(0.01)
+        self.scheduler.broadcast(PyTactio.SerialActions.HEART_OFF, self.sensorIDs)
 
     '''
     Enables all sensor heartbeats
     '''
     def enableAllHeartbeat(self):
-        for i in self.sensorIDs:
-            self.processor.sendHeartOn(i)
-            time.sleep(0.01)
+        self.scheduler.broadcast(PyTactio.SerialActions.HEART_ON, self.sensorIDs)
+
+    def showValuesCallback(self, show):
+        for widget in self.sensorWidgets:
+            widget.setShowValues(show)
+
+    def showContactsCallback(self, show):
+        if(show):
+            self.contactFilters.setEnabled(self.contactFilters.filters[0], False)
+            self.contactFilters.setEnabled(self.contactFilters.filters[0], True) # Restart the baseline
+            # The list is replaced rather than changed, as the parse thread may be iterating over it
+            self.worker.consumers = self.worker.consumers + [self.contactFilters.write]
+        else:
+            self.worker.consumers = [consumer for consumer in self.worker.consumers if consumer != self.contactFilters.write]
+            self.contactOverlay.setContacts([])
+        self.contactOverlay.setVisible(show)
+        self.contactOverlay.raise_()
+
+    '''
+    Restarts the parse thread on another source (a recording or the chain),
+    keeping everything it feeds
+    '''
+    def switchSource(self, source):
+        consumers = self.worker.consumers
+        self.killParserThread()
+        self.history.clear() # The new source's timeline does not continue the old one
+        self.worker = ParseThread.Parser(source)
+        self.worker.metrics = self.metrics
+        self.worker.consumers = consumers
+        self.worker.signals.sensorList.connect(self.sensorListCallback)
+        self.threadpool.start(self.worker)
+
+    def openRecordingCallback(self):
+        path = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Recording', filter='Recordings (*.tactio *.tactioz)',
+                                                     options=QtWidgets.QFileDialog.DontUseNativeDialog)[0]
+        if(path != ''):
+            self.startPlayback(path)
+
+    def startPlayback(self, path):
+        previous = self.playback
+        self.playback = Playback.PlaybackSource(path, speed=self.playbackSpeed)
+        self.switchSource(self.playback)
+        if(previous is not None):
+            previous.close()
+        self.pauseAction.setChecked(False)
+        for action in [self.pauseAction, self.stepAction, self.liveAction]:
+            action.setEnabled(True)
+        self.playbackSlider.show()
+        self.setWindowTitle("Tactio - " + os.path.basename(path))
+
+    def returnToLiveCallback(self):
+        self.switchSource(self.liveSource)
+        self.playback.close()
+        self.playback = None
+        for action in [self.pauseAction, self.stepAction, self.liveAction]:
+            action.setEnabled(False)
+        self.playbackSlider.hide()
+        self.setWindowTitle("Tactio")
+
+    def pausePlaybackCallback(self, pause):
+        if(self.playback is None):
+            return
+        if(pause):
+            self.playback.pause()
+        else:
+            self.playback.play()
+
+    def stepPlaybackCallback(self):
+        if(self.playback is not None):
+            self.pauseAction.setChecked(True)
+            self.playback.step(len(self.sensorIDs))
+
+    def setPlaybackSpeed(self, speed):
+        self.playbackSpeed = speed
+        if(self.playback is not None):
+            self.playback.setSpeed(speed)
+
+    def seekPlaybackCallback(self):
+        if(self.playback is not None):
+            fraction = self.playbackSlider.value() / self.playbackSlider.maximum()
+            self.playback.seek(self.playback.start + fraction*(self.playback.end - self.playback.start))
+
+    '''
+    Opens the history plot of a sensor, or raises it if already open
+    '''
+    def showHistoryCallback(self, sensorID):
+        plot = self.historyPlots.get(sensorID)
+        if(plot is None):
+            plot = SingleGrid.HistoryPlot(self.history, sensorID, self.sensorNames[self.widgetRows[sensorID]],
+                                          transform=self.displayValues)
+            self.historyPlots[sensorID] = plot
+        plot.show()
+        plot.raise_()
+
+    # Values as the grids show them: calibrated (scaled like in parseResultCallback) when calibration is on
+    def displayValues(self, voltage, sensorID):
+        if(self.calibrationOn):
+            return 1000*self.calModel(voltage, sensorID)
+        return voltage
+
+    def showMetricsCallback(self, show):
+        self.metricsLabel.setVisible(show)
+        if(show):
+            self.updateMetricsOverlay()
+            self.metricsTimer.start()
+        else:
+            self.metricsTimer.stop()
+
+    def updateMetricsOverlay(self):
+        self.metricsLabel.setText(self.metrics.summary())
+        self.metricsLabel.adjustSize()
+        self.metricsLabel.raise_()
+
+    # Writes the metrics snapshot to a JSON file
+    def dumpMetricsCallback(self):
+        save_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Metrics', options=QtWidgets.QFileDialog.DontUseNativeDialog)[0]
+        if save_name != '':
+            self.metrics.dump(save_name)
 
     def enableCal(self):
         self.calibrationOn = True
+        for plot in self.historyPlots.values():
+            plot.resetMeans()
 
     def disableCal(self):
         self.calibrationOn = False
+        for plot in self.historyPlots.values():
+            plot.resetMeans()
     '''
     Sends corresponding command using PyTactio based on message passed from ParseThread
     Separates PyTactio from QT code
     '''
     def sendMessageCallback(self, sendData):
-        if(sendData[0] == PyTactio.SerialActions.LEDON):
-            self.processor.sendLEDon(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.LEDOFF):
-            self.processor.sendLEDoff(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.CAL_BIAS):
-            self.processor.sendCalCmd(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.BIAS_EN):
-            self.processor.sendBiasCalEn(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.BIAS_DIS):
-            self.processor.sendBiasCalDis(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.HEART_ON):
-            self.processor.sendHeartOn(sendData[1])
-        elif(sendData[0] == PyTactio.SerialActions.HEART_OFF):
-            self.processor.sendHeartOff(sendData[1])
+        self.scheduler.submit(sendData[0], sendData[1])
     
     def sensorListCallback(self, sensorList):
         print(sensorList)
+        if(self.sweeps is not None):
+            self.sweeps.setChainOrder(sensorList)
 
     def calModel(self, voltage, sensorID):
         if(self.calibrationOn):
-            # Formula goes here
-            input_voltage = 3300
-            r2 = 390
-            conductance = voltage/(r2*input_voltage  - r2 * voltage)
-            out = self.model_slope[str(sensorID)]*conductance + self.model_offset[str(sensorID)]
-            out[np.where(out < 0)] = 0
-            return out
+            return self.calibration.apply(voltage, sensorID)
         else:
             return voltage
 
+    # Redraws the sensors that received frames since the last refresh
+    def displayCallback(self):
+        if(self.playback is not None and not self.playbackSlider.isSliderDown()):
+            length = max(self.playback.end - self.playback.start, 1e-9)
+            self.playbackSlider.setValue(int(self.playbackSlider.maximum()*(self.playback.position - self.playback.start)/length))
+        if(self.contactOverlay.isVisible()):
+            self.contactOverlay.setContacts(self.contacts.contacts)
+        rows, frames, timestamps = self.frameStore.readChanged()
+        self.metrics.recordBacklog(self.frameStore.backlog, coalesced=self.frameStore.coalesced.sum()) # Frames published since the last refresh
+        if(len(rows) == 0):
+            return
+        self.metrics.recordQueueLatency(timestamps)
+        sensorIDs = np.asarray(self.sensorIDs)[rows]
+        data = self.calModel(frames.astype(np.float64), sensorIDs)
+        for sensorID, voltage in zip(sensorIDs, data):
+            self.parseResultCallback((sensorID, voltage), calibrated=True)
+
     # Updates sensor data when callback is triggered
-    def parseResultCallback(self, parseResult):
+    def parseResultCallback(self, parseResult, calibrated=False):
         sensorID = parseResult[0]
         voltage = parseResult[1]
+        row = self.widgetRows[sensorID]
+        if(row < 0): # Not a sensor in the current layout
+            return
+        if(not calibrated):
+            voltage = self.calModel(voltage, sensorID)
         if(self.calibrationOn):
-            self.sensorWidgets[self.sensorIDs.index(sensorID)].setData(1000*self.calModel(voltage, sensorID))
+            self.sensorWidgets[row].setData(1000*voltage)
         else:
-            self.sensorWidgets[self.sensorIDs.index(sensorID)].setData(self.calModel(voltage, sensorID))
+            self.sensorWidgets[row].setData(voltage)
 
     # Updates selected file for recording
     def fileSelCallback(self):
-        save_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save File', options=QtGui.QFileDialog.DontUseNativeDialog)[0]
+        save_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save File', options=QtWidgets.QFileDialog.DontUseNativeDialog)[0]
         self.fileLine.setText(save_name)
 
     #start/stop recording function
@@ -260,7 +517,7 @@ class MultiSensorVis(QtWidgets.QMainWindow):
     def record(self):
         self.is_recording = not self.is_recording # Keeps track of two states for button (red or gray)
         if self.is_recording:
-            self.recording = {id : np.empty((1,4,4)) for id in self.sensorIDs} # resets dictionary holding previous recordings
+            self.recorder.start() # Discards the previous recording
             self.rec_btn.setStyleSheet("min-height: 50px;"
                                        "max-height: 50px;"
                                        "min-width: 50px;"
@@ -269,6 +526,7 @@ class MultiSensorVis(QtWidgets.QMainWindow):
                                        "color: black;"
                                        "border-radius: 25px")
         else:
+            self.recorder.stop()
             self.rec_btn.setStyleSheet("min-height: 50px;"
                                        "max-height: 50px;"
                                        "min-width: 50px;"
@@ -279,29 +537,26 @@ class MultiSensorVis(QtWidgets.QMainWindow):
             save_name = ""
             if(self.fileLine.text() == ''):
                 # If the file name hasn't previously been inserted in the line edit box, prompt user
-                save_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save File', options=QtGui.QFileDialog.DontUseNativeDialog)[0]
+                save_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save File', options=QtWidgets.QFileDialog.DontUseNativeDialog)[0]
             else:
                 # If the file name has been specified in the line edit box, use that
                 save_name = self.fileLine.text()
             
             '''
-            Since there's no serializable method for Numpy Arrays, we define a custom encoder to convert
-            Numpy Arrays to a serial representation (nested python arrays)
+            Recordings are saved raw in the indexed binary format (see Recording.py), compressed for
+            .tactioz files (see Codec.py), unless a .json
+            file is chosen. Since there's no serializable method for Numpy Arrays, we define a custom
+            encoder to convert Numpy Arrays to a serial representation (nested python arrays)
             '''
-            if save_name != '':
+            if save_name != '' and not save_name.endswith('.json'):
+                self.recorder.save(save_name)
+            elif save_name != '':
+                frames = self.recorder.frames()
+                recording = {}
+                for id in self.sensorIDs:
+                    recording[id] = self.calModel(frames['data'][frames['addr'] == id].astype(np.float64), id)
                 with open(save_name, "w") as outfile:  
-                    json.dump(self.recording, outfile, cls=NumpyArrayEncoder) 
-
-    # Kicks off when QTimer has a timeout event
-    def timerCallback(self): 
-        if self.is_recording:
-            for id in self.sensorIDs:
-                if(self.calibrationOn):
-                    self.recording[id] = np.append(self.recording[id], \
-                        np.expand_dims(self.sensorWidgets[self.sensorIDs.index(id)].data/1000,axis=0),axis=0)
-                else:
-                    self.recording[id] = np.append(self.recording[id], \
-                        np.expand_dims(self.sensorWidgets[self.sensorIDs.index(id)].data,axis=0),axis=0)
+                    json.dump(recording, outfile, cls=NumpyArrayEncoder) 
 
     # Add Keyboard Shortcuts
     def keyPressEvent(self, event):
@@ -317,6 +572,18 @@ class MultiSensorVis(QtWidgets.QMainWindow):
     # intercepts all kill events to wait for threads to safely close
     def closeEvent(self, event):
         self.killParserThread()
+        self.scheduler.stop()
+        if(self.acquisition is not None):
+            self.worker.parser.close()
+            self.acquisition.stop()
+        if(self.chains is not None):
+            self.chains.stop()
+        if(self.client is not None):
+            self.client.close()
+        if(self.playback is not None):
+            self.playback.close()
+        for plot in self.historyPlots.values():
+            plot.close()
         event.accept()
 
 
@@ -1,9 +1,13 @@
 from PyQt5 import QtWidgets, QtCore, Qt, QtGui
 import numpy as np
 import serial
+import threading
+import time
 import traceback
 import sys
-from PyTactio import SerialProcessor, SerialStatus
+from collections import deque
+from enum import Enum, auto
+from PyTactio import SerialProcessor, SerialStatus, FRAME_DTYPE
 
 '''
 Defines the signals available from a running worker thread.
@@ -14,7 +18,7 @@ finished - No data
 
 error - `tuple` (exctype, value, traceback.format_exc() )
 
-gridData - tuple of numpy grid and sensor ID
+framesReady - No data, emitted when the frame queue goes from empty to non-empty
 
 sensorList - list of all available sensors
 
@@ -22,36 +26,149 @@ sensorList - list of all available sensors
 class WorkerSignals(QtCore.QObject):
     finished = QtCore.pyqtSignal()
     error = QtCore.pyqtSignal(tuple)
-    gridData = QtCore.pyqtSignal(tuple)
+    framesReady = QtCore.pyqtSignal()
     sensorList = QtCore.pyqtSignal(list)
 
 
+'''
+What a FrameQueue does with frames that no longer fit
+
+DROP_OLDEST - discards the oldest queued frames first
+
+LATEST_PER_SENSOR - keeps only the newest queued frame of each sensor,
+falling back to DROP_OLDEST if that still does not fit
+'''
+class OverflowPolicy(Enum):
+    DROP_OLDEST = auto()
+    LATEST_PER_SENSOR = auto()
+
+
+'''
+Bounded, thread-safe queue of decoded frame batches (PyTactio.FRAME_DTYPE)
+between the parser thread and the GUI. The number of queued frames never
+exceeds maxFrames, so memory use and queue latency stay bounded when the
+consumer falls behind. Frames removed to make room are counted in dropped
+'''
+class FrameQueue:
+    def __init__(self, maxFrames=1024, policy=OverflowPolicy.DROP_OLDEST):
+        self.maxFrames = maxFrames
+        self.policy = policy
+        self.dropped = 0
+        self._batches = deque()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    '''
+    Queues a batch of frames, applying the overflow policy if needed.
+    Returns True if the queue was empty beforehand, i.e. the consumer needs
+    to be notified
+    '''
+    def put(self, frames):
+        with self._lock:
+            wasEmpty = self._count == 0
+            self._batches.append(frames)
+            self._count += len(frames)
+            if self._count > self.maxFrames:
+                if self.policy == OverflowPolicy.LATEST_PER_SENSOR:
+                    self._keepLatest()
+                self._dropOldest()
+            return wasEmpty
+
+    '''
+    Removes and returns everything queued as a single array
+    '''
+    def get(self):
+        with self._lock:
+            batches = list(self._batches)
+            self._batches.clear()
+            self._count = 0
+        if len(batches) == 1:
+            return batches[0]
+        return np.concatenate(batches) if batches else np.empty(0, dtype=FRAME_DTYPE)
+
+    # Both helpers are called with the lock held
+    def _keepLatest(self):
+        frames = np.concatenate(self._batches)
+        # np.unique returns first occurrences, so search the reversed addresses for the newest ones
+        _, lastFromEnd = np.unique(frames['addr'][::-1], return_index=True)
+        keep = np.sort(len(frames) - 1 - lastFromEnd)
+        self.dropped += len(frames) - len(keep)
+        self._batches = deque([frames[keep]])
+        self._count = len(keep)
+
+    def _dropOldest(self):
+        while self._count > self.maxFrames:
+            excess = self._count - self.maxFrames
+            oldest = self._batches[0]
+            if len(oldest) <= excess:
+                self._batches.popleft()
+                self._count -= len(oldest)
+                self.dropped += len(oldest)
+            else:
+                self._batches[0] = oldest[excess:]
+                self._count -= excess
+                self.dropped += excess
+
+
 '''
 Parser thread
 
 Inherits from QRunnable to handler worker thread setup, signals and wrap-up.
-Calls the parsing function from PyTactio and uses the result to trigger
-callbacks in the main thread
+Reads frame batches through PyTactio, blocking on the port for up to
+timeout seconds so the thread sleeps while the chain is quiet. Every batch
+is handed to the consumers on this thread and, if a queue is given, to the
+main thread through that bounded FrameQueue. Exceptions of the port or of
+a consumer are reported through signals.error and the metrics, and the
+thread keeps reading
 '''
 class Parser(QtCore.QRunnable):
 
-    def __init__(self, inputProcessor):
+    def __init__(self, inputProcessor, queue=None, batchSize=256, timeout=0.1):
         super(Parser, self).__init__()
         # Store constructor arguments (re-used for processing)
         self.signals = WorkerSignals()
         self.alive = True
         self.parser = inputProcessor
+        self.queue = queue
+        self.batchSize = batchSize
+        self.timeout = timeout # Also bounds how long closing the thread takes
+        # Callables handed every batch on this thread, before anything can be dropped by the queue
+        self.consumers = []
+        self.metrics = None # Optional Metrics.AcquisitionMetrics
 
     @QtCore.pyqtSlot()
     def run(self):
         while self.alive: # This is set to false by the main window, which causes this thread to close safely
             try:
-                result, msg = self.parser.parseSerial() # Runs the parser method
+                frames = self.parser.read_batch(self.batchSize, self.timeout) # Blocks until data or timeout
             except:
-                traceback.print_exc() # Emits a failure signal
-                exctype, value = sys.exc_info()[:2]
-            else:
-                if(msg == SerialStatus.DATA) : # Emits the grid data signal
-                    self.signals.gridData.emit(result)
-                elif(msg == SerialStatus.NET_ADDRS): # Emits the list of addresses signal
-                    self.signals.sensorList.emit(result)
+                self._reportException()
+                time.sleep(self.timeout) # The port may stay broken, so do not spin on it
+                continue
+            if self.metrics is not None:
+                self.metrics.recordFrames(frames)
+                self.metrics.recordLink(self.parser)
+            while self.parser.addressLists: # Emits the list of addresses signal
+                self.signals.sensorList.emit(self.parser.addressLists.popleft())
+            if len(frames):
+                for consumer in self.consumers:
+                    try:
+                        consumer(frames)
+                    except:
+                        self._reportException() # One failing consumer must not stop acquisition or the others
+                if self.queue is not None and self.queue.put(frames): # Only signal once per drain of the queue
+                    self.signals.framesReady.emit()
+                if self.queue is not None and self.metrics is not None:
+                    self.metrics.recordBacklog(len(self.queue), self.queue.dropped)
+
+    # Prints the exception being handled, records it and emits a failure signal
+    def _reportException(self):
+        traceback.print_exc()
+        exctype, value = sys.exc_info()[:2]
+        text = traceback.format_exc()
+        if self.metrics is not None:
+            self.metrics.recordException(text)
+        self.signals.error.emit((exctype, value, text))
@@ -0,0 +1,278 @@
+import mmap
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import Codec
+import Recording
+from PyTactio import FRAME_DTYPE
+
+'''
+Plays a saved session back as if it came from a chain.
+
+PlaybackSource offers read_batch and addressLists like
+PyTactio.SerialProcessor, so a ParseThread.Parser (and everything fed by it)
+runs on a recording exactly as on live data. Frames are released in
+arrival order at the recorded pace times speed, as fast as they are read
+with speed None, or only when step() is called while paused.
+
+Recordings are read in chunks of consecutive frames. The first timestamp
+of every chunk forms a sparse time index, so seeking is a search in that
+index plus one in the chunk landed on, whatever the length of the
+recording. Upcoming chunks are loaded ahead on a background thread.
+Both indexed recordings (Recording.py) and compressed archives (Codec.py)
+can be played
+'''
+
+# Chunks of an indexed recording, cut every chunkFrames frames of its time order
+class _RecordingChunks:
+    def __init__(self, path, chunkFrames):
+        self.recording = Recording.Recording(path)
+        self.chunkFrames = chunkFrames
+        self.starts = np.arange(0, len(self.recording), chunkFrames)
+        firsts = self.recording.timeOrder[self.starts]
+        self.startTimes = np.asarray(self.recording.frames['timestamp'][firsts], dtype=np.float64)
+        self.endTime = float(self.recording.frames['timestamp'][self.recording.timeOrder[-1]]) if len(self.starts) else 0.0
+
+    def load(self, i):
+        start = int(self.starts[i])
+        return self.recording.timeSlice(start, start + self.chunkFrames)
+
+# Chunks of a compressed archive, as written. The file is memory-mapped, so only the chunks played are read
+class _CodecChunks:
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self.data = memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)) # Slices of a memoryview are not copies
+        self.offsets = Codec.chunkOffsets(self.data)
+        self.startTimes = np.array([Codec.chunkStartTime(self.data[offset:]) for offset in self.offsets])
+        self.endTime = float(self.load(len(self.offsets) - 1)['timestamp'][-1]) if len(self.offsets) else 0.0
+
+    def load(self, i):
+        return Codec.decodeChunk(self.data[int(self.offsets[i]):])
+
+
+class PlaybackSource:
+    '''
+    path - recording (.tactio) or archive (.tactioz)
+    speed - playback rate relative to real time, None for as fast as possible
+    retime - shift timestamps to the current time, so latency measurements
+             downstream behave as with live data. position is always in
+             recording time
+    prefetch - chunks loaded ahead of the one being played
+    '''
+    def __init__(self, path, speed=1.0, retime=True, chunkFrames=1 << 14, prefetch=2):
+        if path.endswith(Codec.EXTENSION):
+            self._chunks = _CodecChunks(path)
+        else:
+            self._chunks = _RecordingChunks(path, chunkFrames)
+        self.retime = retime
+        self.prefetch = prefetch
+        self.addressLists = deque()
+        self._seen = [] # Addresses announced in addressLists so far, in order of first appearance
+        self._loader = ThreadPoolExecutor(1)
+        self._loading = {} # Chunk number -> Future of its frames
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self.paused = False
+        self._steps = 0 # Frames step() released while paused
+        self._speed = speed
+        self.start = float(self._chunks.startTimes[0]) if len(self._chunks.startTimes) else 0.0
+        self._seekLocked(self.start)
+
+    def __len__(self):
+        return len(self._chunks.startTimes)
+
+    '''
+    Answers like a chain asked for its addresses, with the sensors found in
+    the recording so far. They are listed in the order they first appeared,
+    which is the order of the chain (give or take where the recording
+    started within a sweep), as Sweeps.SweepAssembler expects
+    '''
+    def requestAddresses(self):
+        with self._lock:
+            if self._seen:
+                self.addressLists.append(list(self._seen))
+
+    # Announces the addresses of frames not seen before, in order of appearance
+    def _announce(self, addrs):
+        first = np.unique(addrs, return_index=True)[1]
+        new = [int(addr) for addr in addrs[np.sort(first)] if int(addr) not in self._seen]
+        if new:
+            self._seen += new
+            self.addressLists.append(list(self._seen))
+
+    # Future of the frames of chunk i, loaded ahead along with the chunks that follow it. Called with the lock held
+    def _request(self, i):
+        for j in range(i, min(i + self.prefetch + 1, len(self))):
+            if j not in self._loading:
+                self._loading[j] = self._loader.submit(self._chunks.load, j)
+        for j in [j for j in self._loading if j < i or j > i + self.prefetch]:
+            self._loading.pop(j).cancel()
+        return self._loading[i]
+
+    # Frames of chunk i. Called with the lock held
+    def _chunk(self, i):
+        return self._request(i).result()
+
+    # Chunk holding recording time t
+    def _chunkAt(self, t):
+        return max(int(np.searchsorted(self._chunks.startTimes, t, side='right')) - 1, 0)
+
+    '''
+    Recording time of the next frame to be played
+    '''
+    @property
+    def position(self):
+        with self._lock:
+            return self._nextTime()
+
+    # Called with the lock held
+    def _nextTime(self):
+        if self._frames is None:
+            return self.end
+        return float(self._frames['timestamp'][self._pos])
+
+    '''
+    Recording time of the last frame
+    '''
+    @property
+    def end(self):
+        return self._chunks.endTime
+
+    @property
+    def finished(self):
+        with self._lock:
+            return self._frames is None
+
+    @property
+    def speed(self):
+        return self._speed
+
+    '''
+    Changes the playback speed (None for as fast as possible) without a jump in position
+    '''
+    def setSpeed(self, speed):
+        with self._wake:
+            self._anchor(self._nextTime())
+            self._speed = speed
+            self._wake.notify_all()
+
+    def pause(self):
+        with self._wake:
+            self.paused = True
+            self._steps = 0
+
+    def play(self):
+        with self._wake:
+            self.paused = False
+            self._anchor(self._nextTime())
+            self._wake.notify_all()
+
+    '''
+    Releases the next count frames while paused
+    '''
+    def step(self, count=1):
+        with self._wake:
+            self.paused = True
+            self._steps += count
+            self._wake.notify_all()
+
+    '''
+    Continues playback from the first frame at or after recording time t
+    '''
+    def seek(self, t):
+        if len(self):
+            with self._lock:
+                future = self._request(self._chunkAt(t))
+            wait([future]) # Loaded without holding the lock, so read_batch and position do not stall meanwhile
+        with self._wake:
+            self._seekLocked(t)
+            self._wake.notify_all()
+
+    def _seekLocked(self, t):
+        self._steps = 0
+        if not len(self):
+            self._frames = None
+            return
+        chunk = self._chunkAt(t)
+        self._load(chunk)
+        if self._frames is not None:
+            self._pos = int(np.searchsorted(self._frames['timestamp'], t, side='left'))
+            if self._pos == len(self._frames):
+                self._load(chunk + 1)
+        self._anchor(t if self._frames is None else max(t, self._nextTime()))
+
+    # Makes chunk i current, or marks the end of the recording
+    def _load(self, i):
+        self._chunkIndex = i
+        self._pos = 0
+        self._frames = None
+        while self._chunkIndex < len(self):
+            frames = self._chunk(self._chunkIndex)
+            if len(frames):
+                self._frames = frames
+                self._announce(frames['addr'])
+                return
+            self._chunkIndex += 1
+
+    # Ties recording time t to the current wall clock time
+    def _anchor(self, t):
+        self._anchorTime = t
+        self._anchorClock = time.monotonic()
+
+    # Recording time up to which frames are due. Called with the lock held
+    def _dueTime(self):
+        if self.paused:
+            return -np.inf
+        if self._speed is None:
+            return np.inf
+        return self._anchorTime + (time.monotonic() - self._anchorClock)*self._speed
+
+    '''
+    Returns up to max_frames frames that are due, waiting up to timeout for
+    the next one. Returns nothing once the recording is over
+    '''
+    def read_batch(self, max_frames=256, timeout=0.1):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._wake:
+            while True:
+                if self._frames is None:
+                    if timeout:
+                        self._wake.wait(timeout) # Wait like a quiet port instead of spinning
+                    return np.empty(0, dtype=FRAME_DTYPE)
+                stamps = self._frames['timestamp']
+                limit = min(len(stamps), self._pos + max_frames)
+                if self.paused:
+                    count = min(self._steps, limit - self._pos)
+                    self._steps -= count
+                else:
+                    count = int(np.searchsorted(stamps[self._pos:limit], self._dueTime(), side='right'))
+                if count:
+                    return self._take(count)
+                if self.paused or self._speed is None:
+                    wait = None
+                else:
+                    wait = (stamps[self._pos] - self._dueTime())/self._speed
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return np.empty(0, dtype=FRAME_DTYPE)
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._wake.wait(wait)
+
+    # Removes the next count frames of the current chunk from playback. Called with the lock held
+    def _take(self, count):
+        frames = self._frames[self._pos:self._pos + count].copy()
+        self._pos += count
+        if self._pos == len(self._frames):
+            self._load(self._chunkIndex + 1)
+        if self.retime:
+            frames['timestamp'] += time.monotonic() - frames['timestamp'][-1]
+        return frames
+
+    def close(self):
+        with self._lock:
+            for future in self._loading.values():
+                future.cancel()
+        self._loader.shutdown(wait=False)
@@ -0,0 +1,151 @@
+import xml.etree.ElementTree as et
+import numpy as np
+from PyTactio import addressIndex
+
+'''
+Whole-surface pressure map stitched from the sensors of a config.
+
+The config is compiled once into a scatter index: the global image is a
+grid of cells of cellSize layout units (by default the smallest taxel
+pitch), and every sensor owns a fixed row of cell indices together with
+the taxel each cell shows. Writing frames is then a single fancy-indexed
+assignment into the preallocated image, whatever the layout. Sensors
+covering fewer cells than the largest one are padded with a scratch cell
+just past the end of the image, so all rows have the same length.
+
+`image` is a view of the map's own buffer, updated in place, so any number
+of readers can share it without copies. The map can also be resampled to
+a chosen resolution with bilinear or bicubic interpolation, done as two
+precomputed matrix products (rows, then columns)
+'''
+
+'''
+Interpolation weights for resampling n samples to size samples, as a
+(size, n) matrix. Samples are cell centres and edges are clamped
+'''
+def resampleMatrix(n, size, method='bilinear'):
+    position = (np.arange(size) + 0.5)*n/size - 0.5 # Output sample centres in input cells
+    base = np.floor(position).astype(np.intp)
+    t = position - base
+    if method == 'bilinear':
+        taps = np.array([0, 1])
+        weights = np.stack([1 - t, t], axis=1)
+    elif method == 'bicubic':
+        taps = np.array([-1, 0, 1, 2])
+        d = np.abs(t[:, None] - taps[None, :])
+        a = -0.5 # Keys kernel, as used by most image libraries
+        weights = np.where(d <= 1, ((a + 2)*d - (a + 3))*d*d + 1,
+                           np.where(d < 2, ((a*d - 5*a)*d + 8*a)*d - 4*a, 0))
+    else:
+        raise ValueError("Unknown interpolation method {}".format(method))
+    matrix = np.zeros((size, n))
+    columns = np.clip(base[:, None] + taps[None, :], 0, n - 1)
+    np.add.at(matrix, (np.repeat(np.arange(size), len(taps)), columns.ravel()), weights.ravel())
+    return matrix
+
+
+class PressureMap:
+    '''
+    configPath - layout config, read for x_pos, y_pos and size
+    sensorIDs - key of every sensor of the config, in config order
+                (as from MultiChain.loadLayout); the <id> values by default
+    cellSize - side of a cell of the image in layout units
+    transform - optional function (data, addrs) -> values applied to the
+                frames before they are written, e.g. CalibrationLUT.apply
+    '''
+    def __init__(self, configPath, sensorIDs=None, cellSize=None, transform=None, dtype=np.float32):
+        position_data = et.parse(configPath).getroot()
+        if sensorIDs is None:
+            sensorIDs = [int(sensor.find('id').text) for sensor in position_data]
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        self.transform = transform
+        squares = []
+        for sensor in position_data:
+            size = sensor.find('size')
+            size = 400 if size is None else int(size.text) # Same default as the GUI
+            squares.append((int(sensor.find('x_pos').text), int(sensor.find('y_pos').text), size))
+        self.squares = np.array(squares, dtype=np.float64)
+        pitch = self.squares[:, 2]/4
+        self.cellSize = pitch.min() if cellSize is None else cellSize
+        self.origin = self.squares[:, :2].min(axis=0)
+        extent = (self.squares[:, :2] + self.squares[:, 2:]).max(axis=0) - self.origin
+        self.width, self.height = np.ceil(extent/self.cellSize - 1e-9).astype(int)
+
+        self._buffer = np.zeros(self.width*self.height + 1, dtype=dtype) # Last element is the scratch cell
+        self.image = self._buffer[:-1].reshape(self.height, self.width)
+        self._compile()
+
+        self._rowMatrix = None
+        self._columnMatrix = None
+        self._partial = None
+        self.resampled = None
+
+    # Builds, for every sensor, the cells it covers and the taxel shown in each
+    def _compile(self):
+        # Cell boundaries of every taxel, rounded so neighbouring taxels neither overlap nor leave gaps
+        edges = np.arange(5)*self.squares[:, 2:]/4 # (n, 5) taxel boundaries within a sensor
+        x = np.rint((self.squares[:, :1] + edges - self.origin[0])/self.cellSize).astype(np.intp)
+        y = np.rint((self.squares[:, 1:2] + edges - self.origin[1])/self.cellSize).astype(np.intp)
+        steps = np.arange(5)
+        x = np.maximum.accumulate(x - steps, axis=1) + steps # Every taxel covers at least one cell
+        y = np.maximum.accumulate(y - steps, axis=1) + steps
+        x = np.minimum(x, self.width)
+        y = np.minimum(y, self.height)
+        cells = []
+        taxels = []
+        for i in range(len(self.squares)):
+            column = np.repeat(np.arange(4), np.diff(x[i]))
+            row = np.repeat(np.arange(4), np.diff(y[i]))
+            cellRows, cellColumns = np.meshgrid(np.arange(y[i, 0], y[i, -1]), np.arange(x[i, 0], x[i, -1]), indexing='ij')
+            cells.append((cellRows*self.width + cellColumns).ravel())
+            taxels.append((row[:, None]*4 + column[None, :]).ravel())
+        length = max(len(c) for c in cells)
+        scratch = self.width*self.height
+        self.cells = np.full((len(cells), length), scratch, dtype=np.intp)
+        self.taxels = np.zeros((len(cells), length), dtype=np.intp)
+        for i in range(len(cells)):
+            self.cells[i, :len(cells[i])] = cells[i]
+            self.taxels[i, :len(taxels[i])] = taxels[i]
+        self.covered = np.zeros(len(self._buffer), dtype=bool)
+        self.covered[self.cells] = True
+        self.covered = self.covered[:-1].reshape(self.height, self.width) # Cells belonging to a sensor
+
+    '''
+    Writes the (k, 4, 4) values of the sensors in rows (all distinct) into the image
+    '''
+    def scatter(self, rows, values):
+        values = np.asarray(values).reshape(len(rows), 16)
+        self._buffer[self.cells[rows]] = np.take_along_axis(values, self.taxels[rows], axis=1)
+
+    '''
+    Writes the latest frame of every known sensor in a batch into the image
+    '''
+    def write(self, frames):
+        rows = self.rows[frames['addr']]
+        # Only the last frame of each sensor matters
+        last = len(rows) - 1 - np.unique(rows[::-1], return_index=True)[1]
+        last = last[rows[last] >= 0]
+        frames = frames[last]
+        values = frames['data']
+        if(self.transform is not None):
+            values = self.transform(frames['data'], frames['addr'])
+        self.scatter(rows[last], values)
+
+    '''
+    Prepares resampling of the image to width x height with 'bilinear' or
+    'bicubic' interpolation
+    '''
+    def setResolution(self, width, height, method='bilinear'):
+        self._rowMatrix = resampleMatrix(self.height, height, method).astype(self.image.dtype)
+        self._columnMatrix = resampleMatrix(self.width, width, method).T.astype(self.image.dtype)
+        self._partial = np.zeros((height, self.width), dtype=self.image.dtype)
+        self.resampled = np.zeros((height, width), dtype=self.image.dtype)
+
+    '''
+    Resamples the current image into the preallocated resampled array and returns it
+    '''
+    def resample(self):
+        np.matmul(self._rowMatrix, self.image, out=self._partial)
+        np.matmul(self._partial, self._columnMatrix, out=self.resampled)
+        return self.resampled
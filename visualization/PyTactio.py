@@ -1,6 +1,37 @@
 import numpy as np
+import time
+from collections import deque
 from enum import Enum, auto
 
+FRAME_PAYLOAD = 32 # 16 taxels of 2 bytes each
+FRAME_LENGTH = 3 + FRAME_PAYLOAD # 0xFF, command byte and address ahead of the payload
+BUFFER_COMPACT = 1 << 16 # Parsed bytes kept at the front of the buffer before it is shifted
+
+'''
+Record layout of the structured arrays returned by the batch API.
+timestamp is the host monotonic time (seconds) at which the last byte of
+the frame arrived: the time of the read that brought it in, back-dated by
+the bytes read after it at the link's byte time (see SerialProcessor._stamp),
+valid is the low nibble of the column data command byte and data holds the
+raw 12-bit taxel values in the same [row, column] layout as parseSerial
+'''
+FRAME_DTYPE = np.dtype([('timestamp', '<f8'),
+                        ('addr', '<u2'),
+                        ('valid', 'u1'),
+                        ('data', '<u2', (4, 4))])
+
+_PAYLOAD_OFFSETS = np.arange(3, FRAME_LENGTH)
+
+'''
+Builds an array mapping every possible address to its position in
+sensorIDs, or to missing for addresses not in the list. Indexing it with
+an array of addresses replaces a per-frame sensorIDs.index lookup
+'''
+def addressIndex(sensorIDs, missing=-1):
+    index = np.full(1 << 16, missing, dtype=np.intp)
+    index[np.asarray(sensorIDs, dtype=np.intp)] = np.arange(len(sensorIDs))
+    return index
+
 '''
 Contains a set of enums representing possible actions over
 the serial port. These can be used to pass messages between
@@ -15,6 +46,20 @@ class SerialActions(Enum):
     HEART_ON = auto()
     HEART_OFF = auto()
 
+'''
+Command byte sent ahead of the sensor address for each action
+'''
+COMMAND_CODES = {
+    SerialActions.LEDON: 0b10000011,
+    SerialActions.LEDOFF: 0b10000010,
+    SerialActions.CAL_BIAS: 0b10001000,
+    SerialActions.BIAS_EN: 0b10001110,
+    SerialActions.BIAS_DIS: 0b10001110,
+    SerialActions.HEART_ON: 0b10010001,
+    SerialActions.HEART_OFF: 0b10010000,
+}
+GET_ADDRESSES = b'\x01' # Asks the network controller for the 0x50 list of known addresses
+
 '''
 Contains a set of error codes
 '''
@@ -36,69 +81,156 @@ class SerialProcessor:
         self.biasCal = False
         self.slopeCal = False
         self.interCal = False
+        # Bytes read from the port that have not been parsed yet
+        self._buffer = bytearray()
+        self._pos = 0
+        self._readTime = 0.0 # When the latest read returned
+        self._previousReadTime = 0.0 # When the read before it returned
+        self._readStart = 0 # Buffer offset of the first byte of the latest read
+        # Arrival time of the last frame decoded, by read_batch or parseSerial
+        self.lastTimestamp = 0.0
+        # Address lists (0x50 messages) seen by the batch API, oldest first
+        self.addressLists = deque()
+        # Link health counters
+        self.discardedBytes = 0 # Skipped while looking for the 0xFF sync byte
+        self.malformedMessages = 0 # Messages with an unknown command byte
+
+    '''
+    Sends the command for action on sensor at id as a single write
+    '''
+    def send(self, action, id):
+        self.input_ser.write(self.encodeCommand(action, id))
+        self.input_ser.flush()
 
     '''
     Commands sensor at id to turn on the LED
     '''
     def sendLEDon(self, id):
-        self.input_ser.write(int.to_bytes(0b10000011, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big'))
-        self.input_ser.flush()
+        self.send(SerialActions.LEDON, id)
 
     '''
     Commands sensor at id to turn off the LED
     '''
     def sendLEDoff(self, id):
-        self.input_ser.write(int.to_bytes(0b10000010, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big'))
-        self.input_ser.flush()
+        self.send(SerialActions.LEDOFF, id)
 
     '''
     Commands sensor at id to calibrate itself
     '''
     def sendCalCmd(self, id):
-        self.input_ser.write(int.to_bytes(0b10001000, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big')) 
-        self.input_ser.flush()
+        self.send(SerialActions.CAL_BIAS, id)
 
     '''
     Enables pre-stored bias calibration on sensor at id
     '''
     def sendBiasCalEn(self, id):
-        self.biasCal = True
-        self.input_ser.write(int.to_bytes(0b10001110, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big')) 
-        biasCalCmd = 0b00000000 | (self.biasCal << 2)  | (self.interCal << 1) | self.slopeCal
-        self.input_ser.write(int.to_bytes(biasCalCmd, 1, byteorder='big'))
-        self.input_ser.flush()
+        self.send(SerialActions.BIAS_EN, id)
 
     '''
     Disables pre-stored bias calibration on sensor at id
     '''
     def sendBiasCalDis(self, id):
-        self.biasCal = False
-        self.input_ser.write(int.to_bytes(0b10001110, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big')) 
-        biasCalCmd = 0b00000000 | (self.biasCal << 2)  | (self.interCal << 1) | self.slopeCal
-        self.input_ser.write(int.to_bytes(biasCalCmd, 1, byteorder='big'))
-        self.input_ser.flush()
+        self.send(SerialActions.BIAS_DIS, id)
     
     '''
     Enables heartbeat indicator on sensor at id
     '''
     def sendHeartOn(self, id):
-        self.input_ser.write(int.to_bytes(0b10010001, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big')) 
-        self.input_ser.flush()
+        self.send(SerialActions.HEART_ON, id)
 
     '''
     Disables heartbeat indicator on sensor at id
     '''
     def sendHeartOff(self, id):
-        self.input_ser.write(int.to_bytes(0b10010000, 1, byteorder='big'))
-        self.input_ser.write(int.to_bytes(id, 1, byteorder='big')) 
+        self.send(SerialActions.HEART_OFF, id)
+
+    '''
+    Asks the chain for the addresses of its sensors, which arrive as an
+    address list (see addressLists)
+    '''
+    def requestAddresses(self):
+        self.input_ser.write(GET_ADDRESSES)
         self.input_ser.flush()
 
+    '''
+    Returns the complete message for action on sensor id as bytes. Bias
+    calibration commands also update the stored calibration state, which
+    they carry in a third byte
+    '''
+    def encodeCommand(self, action, id):
+        if(action == SerialActions.BIAS_EN):
+            self.biasCal = True
+        elif(action == SerialActions.BIAS_DIS):
+            self.biasCal = False
+        if(action in (SerialActions.BIAS_EN, SerialActions.BIAS_DIS)):
+            biasCalCmd = 0b00000000 | (self.biasCal << 2)  | (self.interCal << 1) | self.slopeCal
+            return bytes([COMMAND_CODES[action], id, biasCalCmd])
+        return bytes([COMMAND_CODES[action], id])
+
+    '''
+    Moves everything waiting on the port into the internal buffer, then blocks
+    until at least minBytes unparsed bytes are available
+    '''
+    def _fill(self, minBytes=0):
+        waiting = self.input_ser.in_waiting
+        if waiting:
+            self._received(self.input_ser.read(waiting))
+        while len(self._buffer) - self._pos < minBytes:
+            self._received(self.input_ser.read(minBytes - (len(self._buffer) - self._pos)))
+
+    '''
+    Appends bytes just read from the port to the internal buffer and notes when they arrived
+    '''
+    def _received(self, data):
+        if data:
+            self._readStart = len(self._buffer)
+            self._buffer += data
+            self._previousReadTime, self._readTime = self._readTime, time.monotonic()
+
+    '''
+    Seconds a byte takes on the link (start, 8 data and stop bits), 0 for
+    ports without a baud rate
+    '''
+    @property
+    def byteTime(self):
+        baudrate = getattr(self.input_ser, 'baudrate', None)
+        return 10.0/baudrate if baudrate else 0.0
+
+    '''
+    Arrival times of the messages ending at the buffer offsets ends. The
+    bytes after a message were still being received after it, so it arrived
+    at least their transfer time before the latest read returned. A message
+    completed by the latest read also arrived after the read before it.
+    Times never go backwards, also across calls
+    '''
+    def _stamp(self, ends):
+        stamps = self._readTime - (len(self._buffer) - ends)*self.byteTime
+        stamps = np.where(ends > self._readStart, np.maximum(stamps, self._previousReadTime), stamps)
+        stamps = np.maximum.accumulate(np.maximum(stamps, self.lastTimestamp))
+        self.lastTimestamp = float(stamps[-1])
+        return stamps
+
+    # _stamp for a single message, without the array overhead
+    def _stampMessage(self, end):
+        stamp = self._readTime - (len(self._buffer) - end)*self.byteTime
+        if end > self._readStart:
+            stamp = max(stamp, self._previousReadTime)
+        self.lastTimestamp = max(stamp, self.lastTimestamp)
+        return self.lastTimestamp
+
+    '''
+    Drops parsed bytes from the front of the internal buffer
+    '''
+    def _compact(self):
+        if self._pos == len(self._buffer):
+            self._buffer.clear()
+            self._readStart = 0
+            self._pos = 0
+        elif self._pos > BUFFER_COMPACT:
+            del self._buffer[:self._pos]
+            self._readStart = max(self._readStart - self._pos, 0)
+            self._pos = 0
+
     '''
     Parses the input from serial port and returns as tuple of the format
     (DATA, STATUS)
@@ -106,36 +238,139 @@ class SerialProcessor:
     sensor data sent by the Tactio chain
     '''
     def parseSerial(self): 
-        if not self.input_ser.inWaiting():
+        if self._pos == len(self._buffer) and not self.input_ser.in_waiting:
             return (), SerialStatus.PORT_EMPTY
         else:
             if(not self.input_ser.isOpen()): # Skip and return zeros if there is nothing plugged in
                 return (), SerialStatus.PORT_CLOSED
             else:
-                byte = None
-                # Wait until 0xFF is read
-                while(not byte == 255):
-                    byte = int.from_bytes(self.input_ser.read(), byteorder='big')
+                self._fill()
+                # Wait until 0xFF is read, searching everything buffered at once
+                sync = self._buffer.find(b'\xff', self._pos)
+                while(sync < 0):
+                    self.discardedBytes += len(self._buffer) - self._pos
+                    self._pos = len(self._buffer)
+                    self._compact()
+                    self._fill(1)
+                    sync = self._buffer.find(b'\xff', self._pos)
                 # Read in command byte
-                byte = int.from_bytes(self.input_ser.read(), byteorder='big')
+                self.discardedBytes += sync - self._pos
+                self._pos = sync + 1
+                self._fill(1)
+                byte = self._buffer[self._pos]
+                self._pos += 1
                 # 0x50 corresponds to all known addresses
                 if(byte == 0x50):
-                    length = int.from_bytes(self.input_ser.read(), byteorder='big')
-                    addrs = length * [None]
-                    for i in range(length):
-                        addrs[i] = int.from_bytes(self.input_ser.read(), byteorder='big')
+                    self._fill(1)
+                    length = self._buffer[self._pos]
+                    self._fill(1 + length)
+                    addrs = list(self._buffer[self._pos + 1:self._pos + 1 + length])
+                    self._pos += 1 + length
+                    self._compact()
                     return addrs, SerialStatus.NET_ADDRS
                 # 0b0100 corresponds to column data
                 elif(byte&0xF0 == 0b01000000):
-                    valid = byte&0x0F
-                    addr = int.from_bytes(self.input_ser.read(), byteorder='big')
-                    data = np.zeros((4,4))
-                    # For each column
-                    for i in range(4):
-                        # For each row
-                        for j in range(4):
-                            data[j,i] = int.from_bytes(self.input_ser.read() + self.input_ser.read(), byteorder='big') & 0xFFF
+                    self._fill(1 + FRAME_PAYLOAD)
+                    addr = self._buffer[self._pos]
+                    payload = self._buffer[self._pos + 1:self._pos + 1 + FRAME_PAYLOAD]
+                    self._pos += 1 + FRAME_PAYLOAD
+                    self._stampMessage(self._pos) # Arrival time left in lastTimestamp
+                    self._compact()
+                    # Taxels arrive column by column, so the row-major reshape is transposed
+                    data = (np.frombuffer(payload, dtype='>u2').reshape(4,4).T & 0xFFF).astype(np.float64, order='C')
                     return (addr, data), SerialStatus.DATA
                 else:
                     # In case neither applies here
+                    self.malformedMessages += 1
+                    self._compact()
                     return (byte), SerialStatus.ERROR
+
+    '''
+    Decodes up to maxFrames complete column data frames from the internal
+    buffer without touching the port. Address lists are appended to
+    addressLists, and unknown command bytes are skipped the same way
+    parseSerial reports them as errors. A message cut off at the end of the
+    buffer is left in place until the rest of it has been read
+    '''
+    def _decodeBuffered(self, maxFrames):
+        buf = self._buffer
+        end = len(buf)
+        pos = self._pos
+        offsets = []
+        while len(offsets) < maxFrames:
+            sync = buf.find(b'\xff', pos)
+            if(sync < 0):
+                self.discardedBytes += end - pos
+                pos = end # Nothing but noise left in the buffer
+                break
+            self.discardedBytes += sync - pos
+            if(sync + 1 >= end):
+                pos = sync
+                break
+            byte = buf[sync + 1]
+            if(byte == 0x50):
+                if(sync + 2 >= end or sync + 3 + buf[sync + 2] > end):
+                    pos = sync
+                    break
+                length = buf[sync + 2]
+                self.addressLists.append(list(buf[sync + 3:sync + 3 + length]))
+                pos = sync + 3 + length
+            elif(byte&0xF0 == 0b01000000):
+                if(sync + FRAME_LENGTH > end):
+                    pos = sync
+                    break
+                offsets.append(sync)
+                pos = sync + FRAME_LENGTH
+            else:
+                self.malformedMessages += 1
+                pos = sync + 2
+        self._pos = pos
+
+        frames = np.empty(len(offsets), dtype=FRAME_DTYPE)
+        if offsets:
+            starts = np.array(offsets)
+            raw = np.frombuffer(buf, dtype=np.uint8)
+            frames['valid'] = raw[starts + 1] & 0x0F
+            frames['addr'] = raw[starts + 2]
+            payload = raw[starts[:, None] + _PAYLOAD_OFFSETS]
+            del raw # Release the export so the buffer can be resized again
+            # Taxels arrive column by column, so swap the last two axes to get [row, column]
+            frames['data'] = (payload.view('>u2') & 0xFFF).reshape(-1, 4, 4).transpose(0, 2, 1)
+            frames['timestamp'] = self._stamp(starts + FRAME_LENGTH)
+        self._compact()
+        return frames
+
+    '''
+    Reads everything available from the port and returns up to max_frames
+    column data frames as a structured array of FRAME_DTYPE. When nothing
+    complete is buffered, waits up to timeout seconds (None waits forever,
+    0 never blocks) and returns an empty array if no frame arrived
+    '''
+    def read_batch(self, max_frames=256, timeout=0.1):
+        self._fill()
+        frames = self._decodeBuffered(max_frames)
+        if len(frames) or timeout == 0:
+            return frames
+        # Reconfiguring a port's timeout is a system call, so only do it when it changes
+        if self.input_ser.timeout != timeout:
+            self.input_ser.timeout = timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            chunk = self.input_ser.read(max(1, self.input_ser.in_waiting))
+            if chunk:
+                self._received(chunk)
+                frames = self._decodeBuffered(max_frames)
+                if len(frames):
+                    return frames
+            if deadline is not None and time.monotonic() >= deadline:
+                return frames
+
+    '''
+    Generator yielding non-empty batches from read_batch for as long as the
+    port stays open
+    '''
+    def iter_frames(self, max_frames=256, timeout=0.1):
+        while self.input_ser.isOpen():
+            frames = self.read_batch(max_frames, timeout)
+            if len(frames):
+                yield frames
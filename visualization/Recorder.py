@@ -0,0 +1,125 @@
+import tempfile
+import threading
+import numpy as np
+from PyTactio import FRAME_DTYPE
+from Recording import writeRecording
+import Codec
+
+'''
+Records raw frames (PyTactio.FRAME_DTYPE) at the full rate they are parsed.
+
+Frames are copied into preallocated chunks of chunkFrames records, so each
+append costs O(1) amortized no matter how long the session runs. With spool
+set, every full chunk is written out to a temporary file and released,
+keeping memory use flat for long captures.
+
+append() is meant to be called from the parser thread, everything else from
+the main thread
+'''
+class Recorder:
+    def __init__(self, chunkFrames=1 << 14, spool=True):
+        self.chunkFrames = chunkFrames
+        self.spool = spool
+        self.recording = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def __len__(self):
+        return self._count
+
+    # Called with the lock held (or before the recorder is shared)
+    def _reset(self):
+        self._chunks = [] # Full chunks still held in memory
+        self._current = np.empty(self.chunkFrames, dtype=FRAME_DTYPE)
+        self._used = 0 # Records used in the current chunk
+        self._count = 0
+        self._spoolFile = tempfile.TemporaryFile() if self.spool else None
+        self._spooled = 0 # Records written to the spool file
+
+    '''
+    Discards anything previously recorded and starts a new recording
+    '''
+    def start(self):
+        with self._lock:
+            if self._spoolFile is not None:
+                self._spoolFile.close()
+            self._reset()
+            self.recording = True
+
+    '''
+    Stops recording. The recorded frames stay available until the next start
+    '''
+    def stop(self):
+        with self._lock:
+            self.recording = False
+
+    '''
+    Appends a batch of frames if a recording is running
+    '''
+    def append(self, frames):
+        with self._lock:
+            if not self.recording:
+                return
+            self._count += len(frames)
+            while len(frames):
+                take = min(len(frames), self.chunkFrames - self._used)
+                self._current[self._used:self._used + take] = frames[:take]
+                self._used += take
+                frames = frames[take:]
+                if self._used == self.chunkFrames:
+                    self._retireChunk()
+
+    # Moves the full current chunk to the spool file or the chunk list
+    def _retireChunk(self):
+        if self._spoolFile is not None:
+            self._spoolFile.write(self._current.tobytes())
+            self._spooled += self.chunkFrames
+        else:
+            self._chunks.append(self._current)
+            self._current = np.empty(self.chunkFrames, dtype=FRAME_DTYPE)
+        self._used = 0
+
+    '''
+    Returns everything recorded so far as a single array, in arrival order
+    '''
+    def frames(self):
+        with self._lock:
+            parts = list(self._chunks)
+            if self._spooled:
+                self._spoolFile.flush()
+                self._spoolFile.seek(0)
+                parts.insert(0, np.fromfile(self._spoolFile, dtype=FRAME_DTYPE, count=self._spooled))
+                self._spoolFile.seek(0, 2) # Back to the end for further appends
+            parts.append(self._current[:self._used].copy())
+        return np.concatenate(parts)
+
+    '''
+    Returns the recorded frames of a single sensor, in arrival order
+    '''
+    def sensorFrames(self, addr):
+        frames = self.frames()
+        return frames[frames['addr'] == addr]
+
+    '''
+    Writes everything recorded so far to an indexed recording (see
+    Recording.py), or to a compressed archive (see Codec.py) for paths
+    ending in .tactioz. Spooled frames are streamed from disk rather than loaded
+    '''
+    def save(self, path):
+        with self._lock:
+            if self._spoolFile is None:
+                frames = np.concatenate(self._chunks + [self._current[:self._used]])
+            else:
+                # Move the partial chunk to the spool so the whole recording can be mapped at once
+                self._spoolFile.write(self._current[:self._used].tobytes())
+                self._spooled += self._used
+                self._used = 0
+                self._spoolFile.flush()
+                if self._spooled:
+                    frames = np.memmap(self._spoolFile, dtype=FRAME_DTYPE, mode='r', shape=(self._spooled,))
+                else:
+                    frames = np.empty(0, dtype=FRAME_DTYPE)
+            if path.endswith(Codec.EXTENSION):
+                Codec.writeFile(path, frames)
+            else:
+                writeRecording(path, frames)
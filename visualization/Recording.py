@@ -0,0 +1,112 @@
+import struct
+import numpy as np
+from PyTactio import FRAME_DTYPE
+
+'''
+Binary recording container.
+
+Layout (little endian):
+    header        HEADER_SIZE bytes, see HEADER_FORMAT
+    frames        nFrames records of PyTactio.FRAME_DTYPE, grouped by sensor
+                  and in arrival order within each sensor
+    sensor table  nSensors records of SENSOR_DTYPE giving where each
+                  sensor's frames start and how many there are
+    time order    nFrames uint64 record numbers listing the frames in
+                  arrival order across all sensors
+
+Because each sensor's frames are contiguous and sorted by time, a time
+range of one sensor is a plain slice of the memory-mapped frames, so
+reading it needs neither a copy nor a pass over the file.
+Frames are stored raw; calibration is applied when reading
+'''
+MAGIC = b'TACTIOR\x00'
+VERSION = 1
+HEADER_FORMAT = '<8sHHIQQQQQ' # magic, version, header size, record size, nFrames, frames, sensor table, nSensors, time order offsets
+HEADER_SIZE = 64
+SENSOR_DTYPE = np.dtype([('addr', '<u2'), ('start', '<u8'), ('count', '<u8')])
+WRITE_CHUNK = 1 << 16 # Records gathered per write when reordering
+
+'''
+Writes frames (any FRAME_DTYPE array, including a memmap) in arrival order
+to an indexed recording at path
+'''
+def writeRecording(path, frames):
+    nFrames = len(frames)
+    bySensor = np.argsort(frames['addr'], kind='stable')
+    addrs, starts, counts = np.unique(frames['addr'][bySensor], return_index=True, return_counts=True)
+    sensors = np.empty(len(addrs), dtype=SENSOR_DTYPE)
+    sensors['addr'] = addrs
+    sensors['start'] = starts
+    sensors['count'] = counts
+    # The record number of arrival i is the position of i in the sensor ordering
+    timeOrder = np.empty(nFrames, dtype='<u8')
+    timeOrder[bySensor] = np.arange(nFrames)
+
+    dataOffset = HEADER_SIZE
+    sensorOffset = dataOffset + nFrames * FRAME_DTYPE.itemsize
+    orderOffset = sensorOffset + sensors.nbytes
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, HEADER_SIZE, FRAME_DTYPE.itemsize,
+                         nFrames, dataOffset, sensorOffset, len(sensors), orderOffset)
+    with open(path, 'wb') as outfile:
+        outfile.write(header.ljust(HEADER_SIZE, b'\x00'))
+        for i in range(0, nFrames, WRITE_CHUNK):
+            outfile.write(np.ascontiguousarray(frames[bySensor[i:i + WRITE_CHUNK]]).tobytes())
+        outfile.write(sensors.tobytes())
+        outfile.write(timeOrder.tobytes())
+
+'''
+Read-only view of a recording written by writeRecording. Nothing is loaded
+up front: frames, the sensor table and the time order are memory-mapped
+'''
+class Recording:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as infile:
+            header = infile.read(struct.calcsize(HEADER_FORMAT))
+        (magic, version, headerSize, recordSize, nFrames, dataOffset,
+         sensorOffset, nSensors, orderOffset) = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise ValueError("{} is not a Tactio recording".format(path))
+        if version != VERSION or recordSize != FRAME_DTYPE.itemsize:
+            raise ValueError("Unsupported recording version {} in {}".format(version, path))
+
+        # np.memmap cannot map zero-length regions, so empty recordings get empty arrays
+        self.frames = self._map(FRAME_DTYPE, dataOffset, nFrames)
+        self.sensors = self._map(SENSOR_DTYPE, sensorOffset, nSensors)
+        self.timeOrder = self._map(np.dtype('<u8'), orderOffset, nFrames)
+        self._rows = {int(addr): i for i, addr in enumerate(self.sensors['addr'])}
+
+    def _map(self, dtype, offset, count):
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def __len__(self):
+        return len(self.frames)
+
+    '''
+    Addresses of all sensors in the recording
+    '''
+    @property
+    def sensorIDs(self):
+        return [int(addr) for addr in self.sensors['addr']]
+
+    '''
+    Returns the frames of sensor addr with t0 <= timestamp < t1 as a view
+    into the file. Either bound may be None
+    '''
+    def sensor(self, addr, t0=None, t1=None):
+        if addr not in self._rows:
+            return self.frames[0:0]
+        entry = self.sensors[self._rows[addr]]
+        frames = self.frames[int(entry['start']):int(entry['start']) + int(entry['count'])]
+        times = frames['timestamp']
+        start = 0 if t0 is None else np.searchsorted(times, t0, side='left')
+        stop = len(frames) if t1 is None else np.searchsorted(times, t1, side='left')
+        return frames[start:stop]
+
+    '''
+    Returns frames start to stop (in arrival order across all sensors) as a copy
+    '''
+    def timeSlice(self, start, stop):
+        return self.frames[self.timeOrder[start:stop]]
@@ -1,111 +1,133 @@
 from PyQt5 import QtWidgets, QtCore, Qt, QtGui
+import pyqtgraph as pg
 from pyqtgraph import PlotWidget, plot
 import random
 import sys  # We need sys so that we can pass argv to QApplication
 import os
 from PyTactio import SerialActions
+import History
 
 import numpy as np
 
 '''
-The GridPoint Widget represents 1 colored square in a sensor's grid
+Colormap of the grid: 256 RGBA colors indexed by the scaled taxel value,
+going from black to full blue
 '''
-class GridPoint(QtWidgets.QWidget):
-    def __init__(self, *args, **kwargs):
+COLORMAP = np.zeros((256, 4), dtype=np.uint8)
+COLORMAP[:, 2] = np.arange(256)
+COLORMAP[:, 3] = 255
+
+'''
+Draws a 4 x 4 RGBA pixel buffer as one image scaled to the widget, with the
+taxel values printed on top when showValues is set
+'''
+class HeatmapView(QtWidgets.QWidget):
+    def __init__(self, pixels, *args, **kwargs):
         super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
-        self.setAutoFillBackground(True)
-        self.value = QtWidgets.QLabel()
-        # Ignoring size policy to enforce squareness on text box in grid point
-        self.value.setSizePolicy(QtGui.QSizePolicy(QtGui.QSizePolicy.Ignored,
-                                             QtGui.QSizePolicy.Ignored))
-        self.value.setParent(self)
-        self.value.setStyleSheet('QLabel {color: #FFFFFF;}')
-        self.value.setAlignment(QtCore.Qt.AlignCenter)
-        self.value.setFont(QtGui.QFont("Arial", 10))
-
-        p = self.palette()
-        p.setColor(self.backgroundRole(), QtGui.QColor(0,0,0)) # Initialize to black
-        self.setPalette(p)
-        self.setValue(0)
-        layout = QtWidgets.QHBoxLayout()
-        layout.addWidget(self.value) # Placing label in a layout lets it expand to hold more digits
-        self.setLayout(layout)
+        self.pixels = pixels # Kept alive here since the QImage only wraps its memory
+        self.image = QtGui.QImage(pixels.data, 4, 4, 4*4, QtGui.QImage.Format_RGBA8888)
+        self.values = np.zeros((4,4))
+        self.showValues = True
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
 
-    '''
-    Sets numerical of label
-    '''
-    def setValue(self, num):
-        self.value.setText("{:.2f}".format(float(num)))
+    def paintEvent(self, e):
+        side = min(self.width(), self.height()) # Maintains squareness of the grid
+        left = (self.width() - side) // 2
+        target = QtCore.QRect(left, 0, side, side)
+        painter = QtGui.QPainter(self)
+        painter.drawImage(target, self.image) # No smoothing, so every taxel stays a solid square
+        if(self.showValues):
+            cell = side / 4
+            painter.translate(left, 0)
+            painter.setPen(QtGui.QColor(255, 255, 255))
+            painter.setFont(QtGui.QFont("Arial", max(1, int(cell/6))))
+            for i in range(4):
+                for j in range(4):
+                    rect = QtCore.QRectF(j*cell, i*cell, cell, cell)
+                    painter.drawText(rect, QtCore.Qt.AlignCenter, "{:.2f}".format(float(self.values[i, j])))
+        painter.end()
 
-    '''
-    Dynamic font changing based on widget size
-    ''' 
-    def resizeEvent(self, e):
-        self.value.setFont(QtGui.QFont("Arial", int(self.width()/6)))
 
-    '''
-    Sets color to some scale of blue (0 - 255)
-    '''
-    def setColor(self, color):
-        p = self.palette()
-        p.setColor(self.backgroundRole(), color)
-        self.setPalette(p)
+'''
+Transparent layer over the sensor area marking the tracked contacts
+(Contacts.CONTACT_DTYPE) with a circle of their area and their ID.
+Contacts are in config coordinates; squares holds the (x_pos, y_pos, size)
+of every grid in the config, and each contact is drawn relative to where
+the heatmap of the nearest grid actually is on screen
+'''
+class ContactOverlay(QtWidgets.QWidget):
+    def __init__(self, grids, squares, *args, **kwargs):
+        super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.grids = grids
+        self.squares = np.asarray(squares, dtype=np.float64)
+        self.contacts = []
 
- 
+    def setContacts(self, contacts):
+        self.contacts = contacts
+        self.update()
+
+    def paintEvent(self, e):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtGui.QPen(QtGui.QColor(255, 160, 0), 3))
+        centres = self.squares[:, :2] + self.squares[:, 2:]/2
+        for contact in self.contacts:
+            i = np.argmin(np.hypot(centres[:, 0] - contact['x'], centres[:, 1] - contact['y']))
+            heatmap = self.grids[i].heatmap
+            side = min(heatmap.width(), heatmap.height()) # Drawn square, as in HeatmapView
+            corner = heatmap.mapTo(self.parentWidget(), QtCore.QPoint((heatmap.width() - side)//2, 0))
+            scale = side/self.squares[i, 2]
+            centre = QtCore.QPointF(corner.x() + (contact['x'] - self.squares[i, 0])*scale,
+                                    corner.y() + (contact['y'] - self.squares[i, 1])*scale)
+            radius = float(np.sqrt(contact['area']/np.pi))*scale
+            painter.drawEllipse(centre, radius, radius)
+            painter.drawText(centre + QtCore.QPointF(radius, -radius), str(contact['id']))
+        painter.end()
 
 
 '''
-This widget is the main component of the visualization. It has a grid of 4 x 4 grid points which change color based on input
+This widget is the main component of the visualization. It shows a grid of 4 x 4 squares which change color based on input
 '''
 class SensorGrid(QtWidgets.QWidget):
     sendData = QtCore.pyqtSignal((tuple)) # Define signal
+    showHistory = QtCore.pyqtSignal(int) # Emitted with the sensor ID to open its history plot
     def __init__(self,  *args, **kwargs):
         super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
 
-        # Grid Widgets stored in a 2D array
-        self.gridWidgets = [[GridPoint(), GridPoint(), GridPoint(), GridPoint()],
-        [GridPoint(), GridPoint(), GridPoint(), GridPoint()],
-        [GridPoint(), GridPoint(), GridPoint(), GridPoint()],
-        [GridPoint(), GridPoint(), GridPoint(), GridPoint()]]
-
         # numerical data associated with each measurement
         self.data = np.zeros((4,4))
         self.id = 0 # Sensor ID
+        self.colormap = COLORMAP
+        # RGBA color of every grid square, drawn as a single image
+        self.pixels = np.zeros((4,4,4), dtype=np.uint8)
+        self.pixels[:] = self.colormap[0]
+        self.heatmap = HeatmapView(self.pixels)
 
-        # Arrange rows using HBoxLayouts
-        hboxes = [QtWidgets.QHBoxLayout(), QtWidgets.QHBoxLayout(), QtWidgets.QHBoxLayout(), QtWidgets.QHBoxLayout()]
-
-        # And a single VBoxLayout arranges all the rows into a grid
+        # A single VBoxLayout stacks the ID label on top of the grid
         vbox = QtWidgets.QVBoxLayout()
         self.id_box = QtWidgets.QLabel("Sensor {}".format(self.id))
         self.id_box.setAlignment(QtCore.Qt.AlignCenter)
         vbox.addWidget(self.id_box)
-
-        # Loop through all widgets and add them to layouts accordingly
-        for i in range(len(hboxes)):
-            for j in range(len(self.gridWidgets[i])):
-                hboxes[i].addWidget(self.gridWidgets[i][j])
-                hboxes[i].setSpacing(0) #Spacing between columns
-            vbox.addItem(hboxes[i]) #Add each row to the VBoxLayout
+        vbox.addWidget(self.heatmap)
 
         vbox.setSpacing(0)
         self.setLayout(vbox)
         self.setMinimumSize(200,200) # Minimum size based on default font size
 
     '''
-    Sets ID and text
+    Sets ID and text. name is shown instead of the ID if given
     '''
-    def setId(self, id):
+    def setId(self, id, name=None):
         self.id = id
-        self.id_box.setText("Sensor {}".format(self.id))
+        self.id_box.setText("Sensor {}".format(self.id if name is None else name))
 
     '''
-    Maintains squareness of widget
+    Turns drawing of the numerical values on or off
     '''
-    def resizeEvent(self, e):
-        for i in range(len(self.gridWidgets[0])): 
-            for j in range(len(self.gridWidgets)):
-                self.gridWidgets[i][j].setFixedSize(self.width() / 4, self.height()/4)
+    def setShowValues(self, show):
+        self.heatmap.showValues = show
+        self.heatmap.update()
 
     '''
     Sets data and color of grid
@@ -113,10 +135,10 @@ class SensorGrid(QtWidgets.QWidget):
     def setData(self, data, show = True):
         self.data = data
         if(show):
-            for i in range(len(self.gridWidgets[0])): 
-                for j in range(len(self.gridWidgets)):
-                    self.gridWidgets[i][j].setValue(data[i][j])
-                    self.setGridColor(self.gridWidgets[i][j], self.data2color(data[i][j]))
+            index = np.clip(self.data2color(np.asarray(data)), 0, 255).astype(np.uint8)
+            self.pixels[:] = self.colormap[index]
+            self.heatmap.values = data
+            self.heatmap.update() # Repaints are coalesced by Qt
 
     '''
     Used to compute scalings for colors to make the visualis look prettier
@@ -124,19 +146,6 @@ class SensorGrid(QtWidgets.QWidget):
     def data2color(self,data): # Here we can add some sort of scaling (linear or logarithmic)
         return data*500
 
-    '''
-    Sets the color of a particular grid widget
-    '''
-    def setGridColor(self, gridWidget, color):
-        clip_color = self.clamp(0, color, 255)
-        gridWidget.setColor(QtGui.QColor(0, 0, clip_color)) # Assigns corresponding value to grid widget color
-
-    '''
-    Clamps a value between the minimum and maximum
-    '''
-    def clamp(self, minimum, x, maximum):
-        return max(minimum, min(x, maximum))
-
     ''' 
     Handles the menu when a sensor is right-clicked on
     '''
@@ -153,6 +162,7 @@ class SensorGrid(QtWidgets.QWidget):
         turnBiasCalOn = calMenu.addAction("Enable Bias Cal")
         turnBiasCalOff = calMenu.addAction("Disable Bias Cal")
         contextMenu.addMenu(calMenu)
+        historyAct = contextMenu.addAction("Show History")
 
         action = contextMenu.exec_(self.mapToGlobal(event.pos()))
         if(action == onLEDAct):
@@ -169,3 +179,128 @@ class SensorGrid(QtWidgets.QWidget):
             self.sendData.emit((SerialActions.HEART_ON, self.id))
         elif(action == offHeartAct):
             self.sendData.emit((SerialActions.HEART_OFF, self.id))
+        elif(action == historyAct):
+            self.showHistory.emit(self.id)
+
+
+'''
+Rolling plot of the history of one sensor (History.HistoryBuffer row),
+either the mean of its taxels or every taxel as its own curve. The plot is
+redrawn on a timer from the newest frames, decimated to the width of the
+plot, with time in seconds relative to the newest frame, while the window
+is open. The mean of every frame is worked out once, as it arrives, and
+kept in a ring the size of the history. transform, if given, is applied
+as transform(values, sensorID) to (k, 4, 4) values, e.g. to show
+calibrated values: to every frame before taking its mean, and to the
+decimated window for the taxel curves, which assumes it never reverses the
+order of a taxel's values. Call resetMeans() when the transform changes
+'''
+class HistoryPlot(QtWidgets.QWidget):
+    WINDOWS = [("1 s", 1.0), ("10 s", 10.0), ("1 min", 60.0), ("5 min", 300.0), ("All", None)]
+
+    def __init__(self, history, sensorID, name=None, transform=None, refreshRate=30, *args, **kwargs):
+        super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
+        self.history = history
+        self.sensorID = sensorID
+        self.row = history.rows[sensorID]
+        self.transform = transform
+        self._meanCount = 0 # Frames of the sensor whose mean is in the ring
+        self._meanTimes = np.zeros(history.capacity)
+        self._means = np.zeros(history.capacity)
+        self.setWindowTitle("Sensor {} history".format(sensorID if name is None else name))
+
+        self.plotWidget = PlotWidget()
+        self.plotWidget.setLabel('bottom', "Time", units='s')
+        self.plotWidget.showGrid(x=True, y=True, alpha=0.3)
+        self.meanCurve = self.plotWidget.plot(pen='w')
+        self.taxelCurves = [self.plotWidget.plot(pen=pg.intColor(i, 16)) for i in range(16)]
+        for curve in self.taxelCurves:
+            curve.hide()
+
+        self.windowBox = QtWidgets.QComboBox()
+        for name, seconds in self.WINDOWS:
+            self.windowBox.addItem(name, seconds)
+        self.windowBox.setCurrentIndex(1)
+        self.taxelBox = QtWidgets.QCheckBox("Every taxel")
+        self.taxelBox.toggled.connect(self.setShowTaxels)
+
+        hbox = QtWidgets.QHBoxLayout()
+        hbox.addWidget(QtWidgets.QLabel("Window"))
+        hbox.addWidget(self.windowBox)
+        hbox.addWidget(self.taxelBox)
+        hbox.addStretch()
+        vbox = QtWidgets.QVBoxLayout()
+        vbox.addItem(hbox)
+        vbox.addWidget(self.plotWidget)
+        self.setLayout(vbox)
+        self.resize(600, 300)
+
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(int(1000/refreshRate)) # Convert Hz to ms interval
+        self.timer.timeout.connect(self.refresh) # Started when shown
+
+    '''
+    Switches between one curve per taxel and the mean of the sensor
+    '''
+    def setShowTaxels(self, show):
+        self.meanCurve.setVisible(not show)
+        for curve in self.taxelCurves:
+            curve.setVisible(show)
+        self.refresh()
+
+    '''
+    Forgets the means worked out so far, so they are recomputed with the current transform
+    '''
+    def resetMeans(self):
+        self._meanCount = 0
+
+    def refresh(self):
+        showTaxels = self.taxelBox.isChecked()
+        if(showTaxels):
+            timestamps, values = self.history.window(self.row, self.windowBox.currentData())
+        else:
+            timestamps, values = self._meanWindow(self.windowBox.currentData())
+        if(not len(timestamps)):
+            return
+        x, y = History.decimate(timestamps - timestamps[-1], values, max(self.plotWidget.width(), 1))
+        if(showTaxels and self.transform is not None): # Min/max of the raw values map to those of the transformed ones
+            y = self._transform(y)
+        if(showTaxels):
+            for i, curve in enumerate(self.taxelCurves):
+                curve.setData(x, y[:, i])
+        else:
+            self.meanCurve.setData(x, y[:, 0])
+
+    # Timestamps and means (k, 1) of the last seconds (None for all) of the history, adding the means of new frames
+    def _meanWindow(self, seconds):
+        count, timestamps, values = self.history.since(self.row, self._meanCount)
+        if(count < self._meanCount): # The history was cleared
+            self._meanCount = 0
+            count, timestamps, values = self.history.since(self.row, 0)
+        if(len(values)):
+            if(self.transform is not None): # The mean of the transformed taxels, not the transform of their mean
+                values = self._transform(values)
+            slots = np.arange(count - len(values), count) % len(self._means)
+            self._meanTimes[slots] = timestamps
+            self._means[slots] = values.mean(axis=1)
+        self._meanCount = count
+        held = min(count, len(self._means))
+        slots = (count - held + np.arange(held)) % len(self._means)
+        timestamps = self._meanTimes[slots]
+        if(seconds is not None and held):
+            slots = slots[np.searchsorted(timestamps, timestamps[-1] - seconds, side='left'):]
+            timestamps = self._meanTimes[slots]
+        return timestamps, self._means[slots, np.newaxis]
+
+    # Transform of (k, 16) taxel values
+    def _transform(self, values):
+        return np.asarray(self.transform(values.reshape(-1, 4, 4), self.sensorID), dtype=np.float64).reshape(len(values), 16)
+
+    def showEvent(self, event):
+        self.timer.start() # Stopped while closed, so a reopened plot is live again
+        self.refresh()
+        event.accept()
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        event.accept()
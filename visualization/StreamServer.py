@@ -0,0 +1,391 @@
+import argparse
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+from PyTactio import SerialActions, FRAME_DTYPE
+from CommandScheduler import CommandScheduler
+
+'''
+Fan-out server sharing one Tactio chain between several processes.
+
+A headless daemon owns the serial port(s), decodes frames and publishes
+them to any number of clients over a Unix-domain or localhost TCP socket.
+Every message is a HEADER (type, payload length) followed by the payload:
+
+    MSG_FRAMES      server -> client, raw PyTactio.FRAME_DTYPE records
+    MSG_ADDRS       server -> client, uint16 sensor keys of a 0x50 address list
+    MSG_SUBSCRIBE   client -> server, uint16 sensor keys to receive (empty = all)
+    MSG_COMMAND     client -> server, COMMAND (SerialActions value, sensor key)
+    MSG_GET_ADDRS   client -> server, asks the chain for its address list
+
+A client that stops reading is not allowed to stall the others: once more
+than maxBuffered bytes are waiting for it, further batches for that client
+are dropped (and counted) until it catches up. Client messages that do
+not decode (unknown type, wrong payload length, unknown action, key of no
+sensor chain) are ignored and counted in malformed. A client announcing a
+payload longer than MAX_REQUEST is counted and disconnected, so no inbox
+grows beyond one message.
+
+Addresses are written "unix:/path/to/socket" or "tcp:host:port"
+'''
+HEADER = struct.Struct('<BI')
+COMMAND = struct.Struct('<BH')
+MSG_FRAMES = 1
+MSG_ADDRS = 2
+MSG_SUBSCRIBE = 3
+MSG_COMMAND = 4
+MSG_GET_ADDRS = 5
+MAX_REQUEST = 2 << 16 # Largest client message payload, a subscription listing every key
+
+def message(kind, payload=b''):
+    return HEADER.pack(kind, len(payload)) + payload
+
+'''
+Turns "unix:/path" or "tcp:host:port" into a socket family and address
+'''
+def parseAddress(text):
+    scheme, _, rest = text.partition(':')
+    if scheme == 'unix':
+        return socket.AF_UNIX, rest
+    if scheme == 'tcp':
+        host, _, port = rest.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError("Unknown stream address {}, expected unix:/path or tcp:host:port".format(text))
+
+'''
+Splits complete messages off the front of buffer, returning (type, payload)
+pairs. Raises ValueError for a payload longer than maxPayload
+'''
+def _takeMessages(buffer, maxPayload=None):
+    messages = []
+    pos = 0
+    while len(buffer) - pos >= HEADER.size:
+        kind, length = HEADER.unpack_from(buffer, pos)
+        if maxPayload is not None and length > maxPayload:
+            raise ValueError("Message of {} bytes, at most {} expected".format(length, maxPayload))
+        if len(buffer) - pos - HEADER.size < length:
+            break
+        start = pos + HEADER.size
+        messages.append((kind, bytes(buffer[start:start + length])))
+        pos = start + length
+    del buffer[:pos]
+    return messages
+
+
+class _Client:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.subscribed = None # Boolean array indexed by sensor key, None for everything
+        self.dropped = 0 # Frames dropped because the client fell behind
+
+
+class StreamServer:
+    '''
+    source - anything with read_batch/addressLists (SerialProcessor, MultiChainProcessor, ...)
+    address - where to listen, see parseAddress
+    processor - what commands are sent through, defaults to source
+    '''
+    def __init__(self, source, address, processor=None, maxBuffered=1 << 20, batchSize=1024, timeout=0.05):
+        self.source = source
+        self.processor = processor if processor is not None else source
+        self.scheduler = CommandScheduler(self.processor)
+        self.maxBuffered = maxBuffered
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.alive = False
+        self.addresses = None # Last address list, sent to clients as they connect
+        self.clients = {}
+        self.malformed = 0 # Client messages ignored as invalid
+        self._lock = threading.Lock()
+
+        family, self.address = parseAddress(address)
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address) # Left behind by a previous run
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        # Written to by the acquisition thread to wake the network loop when there is output
+        self._wake, self._wakeWriter = socket.socketpair()
+        self._wake.setblocking(False)
+        self.selector.register(self._wake, selectors.EVENT_READ)
+
+    '''
+    Runs until stop() is called: acquisition on a thread of its own, the
+    socket handling on the calling thread
+    '''
+    def serveForever(self):
+        self.alive = True
+        acquisition = threading.Thread(target=self._acquire, daemon=True)
+        acquisition.start()
+        try:
+            while self.alive:
+                self._poll()
+        finally:
+            self.alive = False
+            acquisition.join()
+            self._close()
+
+    def stop(self):
+        self.alive = False
+        self._wakeWriter.send(b'\x00')
+
+    def _acquire(self):
+        while self.alive:
+            frames = self.source.read_batch(self.batchSize, self.timeout)
+            with self._lock:
+                while self.source.addressLists:
+                    self.addresses = np.asarray(self.source.addressLists.popleft(), dtype='<u2')
+                    for client in self.clients.values():
+                        client.outbox += message(MSG_ADDRS, self.addresses.tobytes())
+                if len(frames):
+                    for client in self.clients.values():
+                        self._queueFrames(client, frames)
+            self._wakeWriter.send(b'\x00')
+
+    # Called with the lock held
+    def _queueFrames(self, client, frames):
+        if client.subscribed is not None:
+            frames = frames[client.subscribed[frames['addr']]]
+        if not len(frames):
+            return
+        if len(client.outbox) > self.maxBuffered:
+            client.dropped += len(frames)
+            return
+        client.outbox += message(MSG_FRAMES, frames.tobytes())
+
+    def _poll(self):
+        for key, events in self.selector.select(self.timeout):
+            if key.fileobj is self.listener:
+                self._accept()
+            elif key.fileobj is self._wake:
+                try:
+                    while self._wake.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                client = self.clients.get(key.fileobj)
+                if client is not None and events & selectors.EVENT_READ:
+                    self._receive(client)
+        self._flush()
+
+    def _accept(self):
+        sock, _ = self.listener.accept()
+        sock.setblocking(False)
+        client = _Client(sock)
+        with self._lock:
+            if self.addresses is not None:
+                client.outbox += message(MSG_ADDRS, self.addresses.tobytes())
+            self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _drop(self, client):
+        self.selector.unregister(client.sock)
+        client.sock.close()
+        with self._lock:
+            del self.clients[client.sock]
+
+    def _receive(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        client.inbox += data
+        try:
+            messages = _takeMessages(client.inbox, MAX_REQUEST)
+        except ValueError:
+            self.malformed += 1 # Would have to be buffered without limit, so the client goes
+            self._drop(client)
+            return
+        for kind, payload in messages:
+            try:
+                self._handle(client, kind, payload)
+            except (struct.error, ValueError, IndexError):
+                self.malformed += 1 # Unknown type, bad length, unknown action or a key no chain has
+
+    def _handle(self, client, kind, payload):
+        if kind == MSG_SUBSCRIBE:
+            keys = np.frombuffer(payload, dtype='<u2')
+            subscribed = None
+            if len(keys):
+                subscribed = np.zeros(1 << 16, dtype=bool)
+                subscribed[keys] = True
+            with self._lock:
+                client.subscribed = subscribed
+        elif kind == MSG_COMMAND:
+            action, key = COMMAND.unpack(payload)
+            self.scheduler.submit(SerialActions(action), key)
+        elif kind == MSG_GET_ADDRS:
+            self.processor.requestAddresses()
+        else:
+            raise ValueError("Unknown message type {}".format(kind))
+
+    # Sends as much queued output as every client will take without blocking
+    def _flush(self):
+        with self._lock:
+            clients = [client for client in self.clients.values() if client.outbox]
+            for client in clients:
+                try:
+                    sent = client.sock.send(client.outbox)
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                except OSError:
+                    continue # Dropped on its next read
+                del client.outbox[:sent]
+        for client in clients:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.outbox else 0)
+            if client.sock in self.clients and self.selector.get_key(client.sock).events != events:
+                self.selector.modify(client.sock, events)
+
+    def _close(self):
+        self.scheduler.stop()
+        for client in list(self.clients.values()):
+            self._drop(client)
+        self.selector.close()
+        self.listener.close()
+        self._wake.close()
+        self._wakeWriter.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+'''
+Write side of a StreamClient, so a CommandScheduler can send through it
+'''
+class _SocketWriter:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+'''
+Client of a StreamServer with the read_batch/addressLists interface of
+SerialProcessor, so ParseThread.Parser and the GUI can use it in place of
+a serial port. Commands are forwarded to the server: send* as usual, or
+through a CommandScheduler, which encodeCommand and input_ser support
+'''
+class StreamClient:
+    def __init__(self, address, sensors=None):
+        family, address = parseAddress(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.input_ser = _SocketWriter(self.sock)
+        self.addressLists = deque()
+        self._buffer = bytearray()
+        self._pending = deque() # Frame batches received but not returned yet
+        self.subscribe(sensors)
+
+    '''
+    Receives only the sensors with the given keys, or everything for None
+    '''
+    def subscribe(self, sensors=None):
+        keys = np.asarray([] if sensors is None else list(sensors), dtype='<u2')
+        self.input_ser.write(message(MSG_SUBSCRIBE, keys.tobytes()))
+
+    def read_batch(self, max_frames=256, timeout=0.1):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._pending:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            # The socket stays blocking: the scheduler thread sends commands through it meanwhile
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return np.empty(0, dtype=FRAME_DTYPE)
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise ConnectionError("Stream server closed the connection")
+            self._buffer += data
+            for kind, payload in _takeMessages(self._buffer):
+                if kind == MSG_FRAMES:
+                    self._pending.append(np.frombuffer(payload, dtype=FRAME_DTYPE).copy())
+                elif kind == MSG_ADDRS:
+                    self.addressLists.append(np.frombuffer(payload, dtype='<u2').tolist())
+            if deadline is not None and time.monotonic() >= deadline and not self._pending:
+                return np.empty(0, dtype=FRAME_DTYPE)
+        frames = self._pending.popleft()
+        if len(frames) > max_frames:
+            self._pending.appendleft(frames[max_frames:])
+            frames = frames[:max_frames]
+        return frames
+
+    def encodeCommand(self, action, key):
+        return message(MSG_COMMAND, COMMAND.pack(action.value, key))
+
+    def send(self, action, key):
+        self.input_ser.write(self.encodeCommand(action, key))
+
+    def requestAddresses(self):
+        self.input_ser.write(message(MSG_GET_ADDRS))
+
+    def sendLEDon(self, key):
+        self.send(SerialActions.LEDON, key)
+
+    def sendLEDoff(self, key):
+        self.send(SerialActions.LEDOFF, key)
+
+    def sendCalCmd(self, key):
+        self.send(SerialActions.CAL_BIAS, key)
+
+    def sendBiasCalEn(self, key):
+        self.send(SerialActions.BIAS_EN, key)
+
+    def sendBiasCalDis(self, key):
+        self.send(SerialActions.BIAS_DIS, key)
+
+    def sendHeartOn(self, key):
+        self.send(SerialActions.HEART_ON, key)
+
+    def sendHeartOff(self, key):
+        self.send(SerialActions.HEART_OFF, key)
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    import serial
+    import MultiChain
+    from PyTactio import SerialProcessor
+    parser = argparse.ArgumentParser(description='Share a Tactio chain between several clients')
+    parser.add_argument('--port', default='/dev/ttyACM0', help='Serial port of the network controller')
+    parser.add_argument('--baud', type=int, default=230400)
+    parser.add_argument('--config', help='Layout config, needed when sensors are spread over several ports')
+    parser.add_argument('--listen', default='unix:/tmp/tactio.sock', help='unix:/path or tcp:host:port')
+    args = parser.parse_args()
+
+    portNames = MultiChain.loadLayout(args.config, args.port)[0] if args.config else [args.port]
+    ports = [serial.Serial(name, args.baud) for name in portNames]
+    if len(ports) > 1:
+        source = MultiChain.MultiChainProcessor(ports)
+        source.start()
+    else:
+        source = SerialProcessor(ports[0])
+    server = StreamServer(source, args.listen)
+    print('Serving {} on {}'.format(', '.join(portNames), args.listen))
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,131 @@
+import threading
+import numpy as np
+from PyTactio import addressIndex
+
+'''
+Assembles the frames of each pass over the chain into one snapshot.
+
+The chain sends one frame per sensor per sweep, always in the same order:
+the order of the address list (0x50 message) the network controller
+reports. A sweep therefore ends with the last sensor of that order, or as
+soon as a frame comes from a sensor at or before the previous frame's
+position, when frames were lost. Every sweep becomes one snapshot of all
+sensors, (n_sensors, 4, 4) in the order of sensorIDs, with the arrival time
+of every sensor's frame, how complete the sweep was, and its skew (time
+from its first to its last frame). Sensors missing from a sweep keep their
+last values and are marked as not present.
+
+SweepAssembler is fed frame batches by the acquisition thread, e.g. as a
+ParseThread.Parser consumer, and hands every batch of completed sweeps to
+its consumers as one array of sweepDtype records. Frames of sensors not in
+the address list are ignored. It assumes a single chain: the frames of
+several ports (MultiChain.py) interleave and split each other's sweeps
+'''
+
+'''
+Record layout of the snapshots of n sensors. timestamp is the arrival of
+the sweep's last frame, complete the fraction of sensors present
+'''
+def sweepDtype(n):
+    return np.dtype([('timestamp', '<f8'),
+                     ('skew', '<f8'),
+                     ('complete', '<f4'),
+                     ('present', '?', (n,)),
+                     ('times', '<f8', (n,)), # Arrival of every sensor's frame, NaN when missing
+                     ('data', '<u2', (n, 4, 4))])
+
+
+class SweepAssembler:
+    '''
+    sensorIDs - sensor keys, in the order of the snapshot rows
+    chainOrder - order the chain sends its sensors in; sensorIDs until an
+                 address list is given to setChainOrder
+    '''
+    def __init__(self, sensorIDs, chainOrder=None):
+        self.sensorIDs = list(sensorIDs)
+        self.rows = addressIndex(self.sensorIDs)
+        self.dtype = sweepDtype(len(self.sensorIDs))
+        self.latest = np.zeros((len(self.sensorIDs), 4, 4), dtype=np.uint16) # Values held for missing sensors
+        self.count = 0 # Sweeps completed so far
+        self.consumers = [] # Called with every non-empty array of completed sweeps
+        self._lock = threading.Lock()
+        self.setChainOrder(self.sensorIDs if chainOrder is None else chainOrder)
+
+    '''
+    Sets the order the chain sends its sensors in, e.g. from an address
+    list, and starts a new sweep
+    '''
+    def setChainOrder(self, addrs):
+        with self._lock:
+            addrs = [addr for addr in addrs if self.rows[addr] >= 0]
+            self.positions = addressIndex(addrs) # Position of every address in the chain order
+            self.chainRows = self.rows[np.asarray(addrs, dtype=np.intp)] # Snapshot row of every position
+            self._current = self._emptySweep() # Sweep being assembled
+            self._lastPosition = -1
+
+    def _emptySweep(self):
+        sweep = np.zeros(1, dtype=self.dtype)[0]
+        sweep['times'] = np.nan
+        return sweep
+
+    '''
+    Adds a batch of frames (PyTactio.FRAME_DTYPE) and returns the sweeps it
+    completed, also handing them to the consumers
+    '''
+    def write(self, frames):
+        with self._lock:
+            sweeps = self._assemble(frames)
+        if len(sweeps):
+            for consumer in self.consumers:
+                consumer(sweeps)
+        return sweeps
+
+    # Called with the lock held
+    def _assemble(self, frames):
+        positions = self.positions[frames['addr']]
+        known = np.flatnonzero(positions >= 0)
+        if not len(known):
+            return np.empty(0, dtype=self.dtype)
+        frames = frames[known]
+        positions = positions[known]
+        # A frame at or before the previous frame's position starts a new sweep
+        sweep = np.cumsum(positions <= np.r_[self._lastPosition, positions[:-1]])
+        sweeps = np.zeros(sweep[-1] + 1, dtype=self.dtype)
+        sweeps['times'] = np.nan
+        sweeps[0] = self._current
+        rows = self.chainRows[positions]
+        sweeps['present'][sweep, rows] = True
+        sweeps['times'][sweep, rows] = frames['timestamp']
+        sweeps['data'][sweep, rows] = frames['data']
+
+        # Every sweep but the last is closed by the next one, the last by its final sensor
+        self._lastPosition = int(positions[-1])
+        closed = len(sweeps) - 1
+        if self._lastPosition == len(self.chainRows) - 1:
+            closed += 1
+            self._lastPosition = -1
+        if closed < len(sweeps):
+            self._current = sweeps[closed].copy()
+        else:
+            self._current = self._emptySweep()
+        sweeps = sweeps[:closed]
+        if not len(sweeps):
+            return sweeps
+
+        # Missing sensors keep the values of the last sweep they were present in
+        present = sweeps['present']
+        source = np.maximum.accumulate(np.where(present, np.arange(len(sweeps))[:, None], -1), axis=0)
+        held = np.where(source >= 0, source, 0)
+        data = sweeps['data'][held, np.arange(len(self.sensorIDs))]
+        data[source < 0] = np.broadcast_to(self.latest, data.shape)[source < 0]
+        sweeps['data'] = data
+        self.latest = data[-1].copy()
+
+        times = sweeps['times']
+        last = np.max(np.where(present, times, -np.inf), axis=1)
+        first = np.min(np.where(present, times, np.inf), axis=1)
+        sweeps['timestamp'] = last
+        sweeps['skew'] = last - first
+        sweeps['complete'] = present.mean(axis=1)
+        self.count += len(sweeps)
+        return sweeps
@@ -0,0 +1,368 @@
+import os
+import select
+import sys
+import threading
+import time
+import tty
+import xml.etree.ElementTree as et
+import numpy as np
+from PyTactio import SerialActions, FRAME_LENGTH
+
+'''
+Simulated Tactio sensor chain for testing without hardware.
+
+SimulatedChain can be passed anywhere a pyserial port is expected (for
+example to PyTactio.SerialProcessor). It emits the real protocol: column
+data frames (0xFF, 0x4F, address, 16 big-endian 12-bit taxels in column
+order) for every sensor once per sweep, and the 0x50 address list in reply
+to the 0x01 request. Command bytes written to it are decoded and logged.
+
+PtyChain serves a SimulatedChain on a pseudo-terminal, so programs that open
+a real serial device (MultiSensorVis, CommandLine) can be pointed at it
+'''
+
+'''
+Command bytes understood by the chain, with the total message length
+'''
+COMMANDS = {
+    0b10000011: (SerialActions.LEDON, 2),
+    0b10000010: (SerialActions.LEDOFF, 2),
+    0b10001000: (SerialActions.CAL_BIAS, 2),
+    0b10001110: (None, 3), # Bias calibration enable/disable, decided by the configuration byte
+    0b10010001: (SerialActions.HEART_ON, 2),
+    0b10010000: (SerialActions.HEART_OFF, 2),
+}
+GET_ADDRS = 0x01
+
+'''
+Reads the sensor addresses from a configs/*.xml layout
+'''
+def loadSensorIDs(configPath):
+    position_data = et.parse(configPath).getroot()
+    return [int(sensor.find('id').text) for sensor in position_data]
+
+
+class SimulatedChain:
+    '''
+    sensorIDs - addresses of the simulated sensors, in chain order
+    frameRate - sweeps per second, each sweep sending one frame per sensor.
+                None sends frames as fast as they are read
+    noise - standard deviation of the Gaussian noise added to every taxel
+    baseline - resting taxel value, a scalar or an array broadcastable to
+               (n_sensors, 4, 4). Defaults to a random value per taxel
+    corruptRate - probability that junk bytes are injected before a frame
+    throttle - limit the output to what the link could carry at baudrate
+    '''
+    def __init__(self, sensorIDs, frameRate=100.0, noise=8.0, baseline=None,
+                 corruptRate=0.0, baudrate=230400, throttle=True, seed=None):
+        self.sensorIDs = list(sensorIDs)
+        self.frameRate = frameRate
+        self.noise = noise
+        self.corruptRate = corruptRate
+        self.baudrate = baudrate
+        self.throttle = throttle
+        self.timeout = None
+        self.is_open = True
+        self.rng = np.random.default_rng(seed)
+        n = len(self.sensorIDs)
+        if baseline is None:
+            baseline = self.rng.uniform(200, 600, (n, 4, 4))
+        self.baseline = np.broadcast_to(np.asarray(baseline, dtype=np.float64), (n, 4, 4)).copy()
+        # Additional load on each taxel, e.g. set by a test to simulate a press
+        self.load = np.zeros((n, 4, 4))
+
+        # Device state changed by commands
+        self.led = {id: False for id in self.sensorIDs}
+        self.heartbeat = {id: True for id in self.sensorIDs}
+        self.biasCal = {id: False for id in self.sensorIDs}
+        self.commandLog = [] # (host time, SerialActions or GET_ADDRS, address, configuration byte or None)
+        self.corruptBytes = 0 # Junk bytes injected so far
+
+        self._out = bytearray()
+        self._in = bytearray()
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._sweeps = 0 # Sweeps generated since start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._out.clear()
+
+    '''
+    Seconds between two sweeps, taking the link capacity into account
+    '''
+    @property
+    def sweepInterval(self):
+        interval = 0.0 if self.frameRate is None else 1.0 / self.frameRate
+        if self.throttle:
+            # 10 bits per byte on the wire (start, 8 data, stop)
+            interval = max(interval, len(self.sensorIDs) * FRAME_LENGTH * 10.0 / self.baudrate)
+        return interval
+
+    '''
+    Generates nSweeps sweeps of frames and returns them as bytes, independent
+    of the simulated clock
+    '''
+    def generate(self, nSweeps):
+        n = len(self.sensorIDs)
+        values = self.baseline + self.load + self.noise * self.rng.standard_normal((nSweeps, n, 4, 4))
+        bias = np.array([self.biasCal[id] for id in self.sensorIDs])
+        values[:, bias] -= self.baseline[bias]
+        values = np.clip(np.rint(values), 0, 0xFFF).astype('>u2')
+        frames = np.empty((nSweeps, n, FRAME_LENGTH), dtype=np.uint8)
+        frames[:, :, 0] = 0xFF
+        frames[:, :, 1] = 0x4F
+        frames[:, :, 2] = self.sensorIDs
+        # Taxels are sent column by column
+        frames[:, :, 3:] = values.transpose(0, 1, 3, 2).reshape(nSweeps, n, 16).view(np.uint8)
+        frames = frames.reshape(nSweeps * n, FRAME_LENGTH)
+        if self.corruptRate <= 0:
+            return frames.tobytes()
+
+        out = bytearray()
+        corrupt = self.rng.random(len(frames)) < self.corruptRate
+        for frame, junk in zip(frames, corrupt):
+            if junk:
+                count = int(self.rng.integers(1, 9))
+                out += self.rng.integers(0, 256, count, dtype=np.uint8).tobytes()
+                self.corruptBytes += count
+            out += frame.tobytes()
+        return bytes(out)
+
+    # Appends every sweep that is due by now to the output buffer. Called with the lock held
+    def _advance(self):
+        interval = self.sweepInterval
+        if interval == 0:
+            return
+        due = int((time.monotonic() - self._start) / interval) - self._sweeps
+        if due > 0:
+            self._out += self.generate(due)
+            self._sweeps += due
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._advance()
+            return len(self._out)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    '''
+    Returns up to size bytes, waiting up to timeout (forever if None) for
+    all of them like a pyserial port does
+    '''
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                if self.sweepInterval == 0 and len(self._out) < size:
+                    sweepBytes = len(self.sensorIDs) * FRAME_LENGTH
+                    self._out += self.generate(-(-(size - len(self._out)) // sweepBytes))
+                else:
+                    self._advance()
+                if len(self._out) >= size or (deadline is not None and time.monotonic() >= deadline):
+                    data = bytes(self._out[:size])
+                    del self._out[:size]
+                    return data
+                wait = self._start + (self._sweeps + 1) * self.sweepInterval - time.monotonic()
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            time.sleep(max(wait, 0))
+
+    '''
+    Accepts command bytes, applies them to the simulated state and logs them
+    '''
+    def write(self, data):
+        with self._lock:
+            self._in += data
+            self._handleCommands()
+        return len(data)
+
+    # Decodes complete commands from the input buffer. Called with the lock held
+    def _handleCommands(self):
+        while self._in:
+            byte = self._in[0]
+            if byte == GET_ADDRS:
+                self.commandLog.append((time.monotonic(), GET_ADDRS, None, None))
+                self._out += bytes([0xFF, 0x50, len(self.sensorIDs)] + self.sensorIDs)
+                del self._in[:1]
+                continue
+            if byte not in COMMANDS:
+                del self._in[:1] # Unknown byte, the firmware ignores it as well
+                continue
+            action, length = COMMANDS[byte]
+            if len(self._in) < length:
+                return
+            id = self._in[1]
+            config = self._in[2] if length == 3 else None
+            del self._in[:length]
+            if action is None:
+                action = SerialActions.BIAS_EN if config & 0b100 else SerialActions.BIAS_DIS
+            self.commandLog.append((time.monotonic(), action, id, config))
+            if id not in self.led:
+                continue
+            if action in (SerialActions.LEDON, SerialActions.LEDOFF):
+                self.led[id] = action == SerialActions.LEDON
+            elif action in (SerialActions.HEART_ON, SerialActions.HEART_OFF):
+                self.heartbeat[id] = action == SerialActions.HEART_ON
+            elif action in (SerialActions.BIAS_EN, SerialActions.BIAS_DIS):
+                self.biasCal[id] = action == SerialActions.BIAS_EN
+
+
+'''
+Port that reads back a fixed byte string as fast as it is asked for, e.g.
+bytes from SimulatedChain.generate, for measuring decoding without any
+pacing. Writes are accepted and kept in written
+'''
+class MemoryPort:
+    def __init__(self, data):
+        self.data = memoryview(bytes(data))
+        self.pos = 0
+        self.timeout = None
+        self.is_open = True
+        self.written = bytearray()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    @property
+    def exhausted(self):
+        return self.pos >= len(self.data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data) - self.pos
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        data = bytes(self.data[self.pos:self.pos + size])
+        self.pos += len(data)
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+
+'''
+Serves a SimulatedChain on a pseudo-terminal. port is the device path to
+open with serial.Serial. Like a device on a USB serial link, output the
+reader does not take is dropped rather than blocking the chain: at most
+maxPending bytes wait on the pty, and whole chunks of frames beyond that
+are counted in droppedBytes
+'''
+class PtyChain:
+    def __init__(self, chain, pollInterval=0.002, maxPending=1 << 16):
+        self.chain = chain
+        self.pollInterval = pollInterval
+        self.maxPending = maxPending
+        self.droppedBytes = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave) # Otherwise the line discipline echoes frames back as commands until the port is opened
+        os.set_blocking(self._master, False) # A full pty must never block the thread, or stop() could not join it
+        self.port = os.ttyname(self._slave)
+        self.alive = False
+        self._pending = bytearray() # Output waiting for room on the pty
+        self._closeLock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.alive = True
+        self._thread.start()
+
+    '''
+    Stops serving. The pty is closed by the serving thread as it exits, so a
+    thread still busy after the join timeout never uses a closed descriptor
+    '''
+    def stop(self):
+        self.alive = False
+        if self._thread.ident is None:
+            self._close() # Never started
+            return
+        self._thread.join(1.0)
+        if not self._thread.is_alive():
+            self._close()
+
+    def _close(self):
+        with self._closeLock:
+            if self._master is not None:
+                os.close(self._master)
+                os.close(self._slave)
+                self._master = self._slave = None
+
+    def _run(self):
+        try:
+            self._serve()
+        finally:
+            self._close()
+
+    def _serve(self):
+        while self.alive:
+            readable, _, _ = select.select([self._master], [], [], self.pollInterval)
+            if readable:
+                try:
+                    self.chain.write(os.read(self._master, 1024))
+                except BlockingIOError:
+                    pass
+            waiting = self.chain.in_waiting
+            if waiting:
+                data = self.chain.read(waiting) # Always taken, so the chain's output never piles up
+                if len(self._pending) + len(data) <= self.maxPending:
+                    self._pending += data
+                else:
+                    self.droppedBytes += len(data)
+            if self._pending:
+                try:
+                    written = os.write(self._master, self._pending)
+                except BlockingIOError:
+                    written = 0
+                del self._pending[:written]
+
+
+if __name__ == '__main__':
+    config = sys.argv[1] if len(sys.argv) > 1 else 'configs/6sensor.xml'
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+    chain = SimulatedChain(loadSensorIDs(config), frameRate=rate)
+    with PtyChain(chain) as pty:
+        print('Simulating {} sensors at {} sweeps/s on {}'.format(len(chain.sensorIDs), rate, pty.port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    for entry in chain.commandLog:
+        print(entry)
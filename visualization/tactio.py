@@ -0,0 +1,300 @@
+import argparse
+import os
+import sys
+
+'''
+Command line interface to a Tactio chain.
+
+    tactio scan                      addresses of the sensors on the chain
+    tactio stream                    print (or pipe) live frames
+    tactio record out.tactio         record frames to a file (compressed for .tactioz)
+    tactio replay in.tactio          print (or pipe) the frames of a recording
+    tactio serve                     share the chain with other programs (StreamServer.py)
+    tactio bench                     measure the hot paths on simulated chains
+    tactio gui                       the MultiSensorVis window
+
+--port picks the source of frames: a serial port, "sim" for a simulated
+chain of the config's sensors, a stream server address (unix:/path,
+tcp:host:port) or a recording to play back. Modules are only imported by the commands that need them,
+so only "gui" loads Qt and every other command starts without it
+'''
+
+'''
+Path of a data file shipped with the modules (configs/*.xml,
+regression_params.json): next to this file in a checkout, under
+share/tactio of the environment once installed
+'''
+def dataPath(name):
+    here = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    installed = os.path.join(sys.prefix, 'share', 'tactio', name)
+    return installed if not os.path.exists(here) and os.path.exists(installed) else here
+
+DEFAULT_CONFIG = dataPath(os.path.join('configs', '6sensor.xml'))
+DEFAULT_CALIBRATION = dataPath('regression_params.json')
+
+'''
+Opens the source selected by --port and returns it. Frames are read with
+read_batch and commands sent with the send* methods of what is returned
+'''
+def openChain(args):
+    if args.port == 'sim':
+        import TactioSim
+        from PyTactio import SerialProcessor
+        chain = TactioSim.SimulatedChain(TactioSim.loadSensorIDs(args.config or DEFAULT_CONFIG), frameRate=args.sim_rate, baudrate=args.baud)
+        return SerialProcessor(chain)
+    if args.port.startswith(('unix:', 'tcp:')):
+        import StreamServer
+        return StreamServer.StreamClient(args.port)
+    if args.port.endswith(('.tactio', '.tactioz')):
+        import Playback
+        return Playback.PlaybackSource(args.port) # A recording, played back in real time
+    import serial
+    portNames = [args.port]
+    if args.config:
+        import MultiChain
+        portNames = MultiChain.loadLayout(args.config, args.port)[0]
+    if len(portNames) > 1:
+        import MultiChain
+        chains = MultiChain.MultiChainProcessor([serial.Serial(name, args.baud) for name in portNames])
+        chains.start()
+        return chains
+    from PyTactio import SerialProcessor
+    return SerialProcessor(serial.Serial(portNames[0], args.baud))
+
+def closeChain(processor):
+    if hasattr(processor, 'stop'):
+        processor.stop() # MultiChainProcessor
+    elif hasattr(processor, 'close'):
+        processor.close() # StreamClient, PlaybackSource
+    else:
+        processor.input_ser.close()
+
+def parseSensors(text):
+    return None if text is None else [int(value, 0) for value in text.split(',')]
+
+'''
+Writes frames to the output in the chosen format: "text" is one line per
+frame, "csv" adds a header and "raw" is the PyTactio.FRAME_DTYPE records
+themselves, for piping into another program
+'''
+class FrameWriter:
+    def __init__(self, format, sensors=None):
+        self.format = format
+        self.sensors = sensors
+        if format == 'csv':
+            taxels = ','.join('t{}{}'.format(i, j) for i in range(4) for j in range(4))
+            print('timestamp,addr,valid,' + taxels)
+
+    def write(self, frames):
+        import numpy as np
+        if self.sensors is not None:
+            frames = frames[np.isin(frames['addr'], self.sensors)]
+        if self.format == 'raw':
+            sys.stdout.buffer.write(frames.tobytes())
+            sys.stdout.buffer.flush()
+            return
+        separator = ',' if self.format == 'csv' else ' '
+        lines = []
+        for frame in frames:
+            values = separator.join(str(value) for value in frame['data'].ravel())
+            if self.format == 'csv':
+                lines.append('{:.6f},{},{},{}'.format(frame['timestamp'], frame['addr'], frame['valid'], values))
+            else:
+                lines.append('{:12.6f} {:5d}  {}'.format(frame['timestamp'], frame['addr'], values))
+        if lines:
+            print('\n'.join(lines), flush=True)
+
+
+def scan(args):
+    import time
+    if args.ports:
+        from serial.tools import list_ports
+        for port in list_ports.comports():
+            print('{}\t{}'.format(port.device, port.description))
+        return
+    processor = openChain(args)
+    counts = {}
+    try:
+        processor.requestAddresses()
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            frames = processor.read_batch(1024, max(deadline - time.monotonic(), 0))
+            for addr in frames['addr'].tolist():
+                counts[addr] = counts.get(addr, 0) + 1
+            while processor.addressLists:
+                addrs = processor.addressLists.popleft()
+                print('Known addresses: ' + ', '.join('{} (0x{:02x})'.format(addr, addr) for addr in addrs))
+    finally:
+        closeChain(processor)
+    for addr in sorted(counts):
+        print('{:5d}: {} frames in {:.1f} s'.format(addr, counts[addr], args.timeout))
+
+def stream(args):
+    import time
+    processor = openChain(args)
+    writer = FrameWriter(args.format, parseSensors(args.sensors))
+    deadline = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            frames = processor.read_batch(1024, 0.1)
+            if len(frames):
+                writer.write(frames)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        closeChain(processor)
+
+def record(args):
+    import time
+    import Codec
+    import Recorder
+    processor = openChain(args)
+    if args.output.endswith(Codec.EXTENSION):
+        recorder = Codec.CodecWriter(args.output, compressor=args.compressor) # Compressed as it records
+    else:
+        recorder = Recorder.Recorder()
+        recorder.start()
+    print('Recording to {}, Ctrl-C to stop'.format(args.output), file=sys.stderr)
+    deadline = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            recorder.append(processor.read_batch(1024, 0.1))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        closeChain(processor)
+        if isinstance(recorder, Codec.CodecWriter):
+            recorder.close()
+            count = recorder.count
+        else:
+            recorder.stop()
+            recorder.save(args.output)
+            count = len(recorder)
+    print('Saved {} frames'.format(count), file=sys.stderr)
+
+def replay(args):
+    import Playback
+    playback = Playback.PlaybackSource(args.input, speed=args.speed or None, retime=False)
+    playback.seek(playback.start + args.start)
+    writer = FrameWriter(args.format, parseSensors(args.sensors))
+    try:
+        while not playback.finished:
+            frames = playback.read_batch(1024, 0.1)
+            if len(frames):
+                writer.write(frames)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        playback.close()
+
+def serve(args):
+    import StreamServer
+    processor = openChain(args)
+    server = StreamServer.StreamServer(processor, args.listen)
+    print('Serving on {}'.format(args.listen), file=sys.stderr)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        closeChain(processor)
+
+def bench(args):
+    import Benchmark
+    configs = [args.config] if args.config else Benchmark.CONFIGS
+    names = None if args.only is None else args.only.split(',')
+    unknown = set(names or []) - set(Benchmark.BENCHMARKS)
+    if unknown:
+        sys.exit('Unknown benchmarks: {} (choose from {})'.format(', '.join(sorted(unknown)), ', '.join(Benchmark.BENCHMARKS)))
+    previous = None if args.compare is None else Benchmark.load(args.compare)
+    report = Benchmark.run(configs, names, args.frames, args.batch, args.corrupt,
+                           progress=lambda key, result: print(Benchmark.formatResult(key, result), flush=True))
+    if args.output:
+        Benchmark.save(report, args.output)
+    if previous is not None:
+        lines, regressions = Benchmark.compare(previous, report, args.tolerance)
+        print('\nAgainst {} ({}):'.format(args.compare, previous['environment']['revision']))
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit('{} regressions'.format(len(regressions)))
+
+def gui(args):
+    from PyQt5 import QtWidgets
+    import MultiSensorVis
+    config = args.config or DEFAULT_CONFIG
+    port = args.port
+    server = None
+    simulator = None
+    if port.startswith(('unix:', 'tcp:')):
+        server = port
+    elif port == 'sim':
+        import TactioSim
+        simulator = TactioSim.PtyChain(TactioSim.SimulatedChain(TactioSim.loadSensorIDs(config), frameRate=args.sim_rate, baudrate=args.baud))
+        simulator.start()
+        port = simulator.port
+    app = QtWidgets.QApplication(sys.argv[:1])
+    window = MultiSensorVis.MultiSensorVis(config=config, port=port, server=server,
+                                           calibration=args.calibration, separateProcess=args.separate_process)
+    status = app.exec_()
+    if simulator is not None:
+        simulator.stop()
+    sys.exit(status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='tactio', description='Tactio sensor chain tools')
+    parser.add_argument('--port', default='/dev/ttyACM0',
+                        help='serial port, "sim" for a simulated chain, a stream server address (unix:/path, tcp:host:port) or a recording')
+    parser.add_argument('--baud', type=int, default=230400)
+    parser.add_argument('--config', help='sensor layout XML (default {} where a layout is needed)'.format(DEFAULT_CONFIG))
+    parser.add_argument('--sim-rate', type=float, default=100.0, help='sweeps per second of the simulated chain')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('scan', help='list the addresses on the chain')
+    command.add_argument('--ports', action='store_true', help='list the serial ports of this machine instead')
+    command.add_argument('--timeout', type=float, default=2.0, help='seconds to listen for')
+    command.set_defaults(run=scan)
+
+    for name, run, help in [('stream', stream, 'print live frames'), ('replay', replay, 'print the frames of a recording')]:
+        command = commands.add_parser(name, help=help)
+        if name == 'replay':
+            command.add_argument('input', help='recording (.tactio or .tactioz)')
+            command.add_argument('--speed', type=float, default=1.0, help='playback speed, 0 for as fast as possible')
+            command.add_argument('--start', type=float, default=0.0, help='seconds into the recording to start at')
+        else:
+            command.add_argument('--duration', type=float, help='seconds to stream for (default until Ctrl-C)')
+        command.add_argument('--format', choices=['text', 'csv', 'raw'], default='text')
+        command.add_argument('--sensors', help='comma separated addresses to show (default all)')
+        command.set_defaults(run=run)
+
+    command = commands.add_parser('record', help='record frames to a file')
+    command.add_argument('output', help='recording to write (.tactio), or compressed archive (.tactioz)')
+    command.add_argument('--compressor', choices=['zlib', 'lzma', 'bz2', 'none'], default='zlib', help='compressor of .tactioz archives')
+    command.add_argument('--duration', type=float, help='seconds to record for (default until Ctrl-C)')
+    command.set_defaults(run=record)
+
+    command = commands.add_parser('serve', help='share the chain with other programs over a socket')
+    command.add_argument('--listen', default='unix:/tmp/tactio.sock', help='unix:/path or tcp:host:port')
+    command.set_defaults(run=serve)
+
+    command = commands.add_parser('bench', help='measure the hot paths on simulated chains (Benchmark.py)')
+    command.add_argument('--frames', type=int, default=20000, help='frames of every workload')
+    command.add_argument('--batch', type=int, default=1024, help='frames per batch of read_batch, calibration and recording')
+    command.add_argument('--corrupt', type=float, default=0.0, help='fraction of frames preceded by junk bytes')
+    command.add_argument('--only', help='comma separated benchmarks to run (default all)')
+    command.add_argument('--output', help='save the results to this JSON file')
+    command.add_argument('--compare', help='results of an earlier run to compare against, exiting with an error on regressions')
+    command.add_argument('--tolerance', type=float, default=0.1, help='change counted as a regression, as a fraction')
+    command.set_defaults(run=bench)
+
+    command = commands.add_parser('gui', help='open the visualization window')
+    command.add_argument('--calibration', default=DEFAULT_CALIBRATION, help='regression parameters (JSON)')
+    command.add_argument('--separate-process', action='store_true', help='decode in a separate process')
+    command.set_defaults(run=gui)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()